@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Maintenance and queries of the pigeon ancestry closure table.
+
+Existing databases get the table with a migration, rebuild() fills it again
+from the sire and dam of all pigeons. As long as it doesn't exist, the signal
+handlers won't do anything.
+"""
+
+
+import logging
+from collections import Counter
+from typing import Dict, Set, Tuple
+
+import peewee
+
+from pigeonplanner.database.models import Pigeon, PigeonAncestry, database
+
+logger = logging.getLogger(__name__)
+
+# Protection against endless loops when a pigeon is wrongly set as its own ancestor.
+MAX_DEPTH = 64
+# Four columns per row keeps a batch below the SQLite limit of 999 variables.
+INSERT_CHUNK_SIZE = 200
+
+# The sire and dam of each pigeon that is being saved, from before it was changed
+_old_parents = {}
+
+# Adds the changed ancestor paths, stored in the temporary delta table, to the pigeon and all
+# of its descendants at once. The WHERE clause avoids a parsing ambiguity with the upsert.
+APPLY_PATHS_SQL = """
+INSERT INTO pigeon_ancestry (ancestor_id, descendant_id, depth, path_count)
+SELECT delta.ancestor_id, descendant.descendant_id, delta.depth + descendant.depth,
+       SUM(delta.path_count * descendant.path_count)
+FROM temp.ancestry_delta AS delta
+CROSS JOIN (
+    SELECT descendant_id, depth, path_count FROM pigeon_ancestry WHERE ancestor_id = ?
+    UNION ALL
+    SELECT ?, 0, 1
+) AS descendant
+WHERE 1
+GROUP BY delta.ancestor_id, descendant.descendant_id, delta.depth + descendant.depth
+ON CONFLICT (ancestor_id, descendant_id, depth) DO UPDATE SET path_count = path_count + excluded.path_count
+"""
+
+
+def is_enabled() -> bool:
+    return PigeonAncestry.table_exists()
+
+
+def rebuild() -> int:
+    """Create the ancestry table if needed and fill it from the sire and dam of all pigeons.
+
+    :returns: the number of rows in the table
+    """
+    query = Pigeon.select(Pigeon.id, Pigeon.sire, Pigeon.dam).tuples()
+    parents = {pigeon_id: (sire_id, dam_id) for pigeon_id, sire_id, dam_id in query}
+    closure = {}
+    for pigeon_id in parents:
+        _compute_closure(pigeon_id, parents, closure)
+
+    rows = [
+        {"ancestor_id": ancestor_id, "descendant_id": pigeon_id, "depth": depth, "path_count": count}
+        for pigeon_id, ancestors in closure.items()
+        for (ancestor_id, depth), count in ancestors.items()
+    ]
+    with database.atomic():
+        database.create_tables([PigeonAncestry], safe=True)
+        PigeonAncestry.delete().execute()
+        for batch in peewee.chunked(rows, INSERT_CHUNK_SIZE):
+            PigeonAncestry.insert_many(batch).execute()
+    logger.debug("Rebuilt the ancestry table with %s row(s)", len(rows))
+    return len(rows)
+
+
+def get_descendant_ids(pigeon: Pigeon, max_depth: int = None) -> Set[int]:
+    query = PigeonAncestry.select(PigeonAncestry.descendant_id).where(PigeonAncestry.ancestor_id == pigeon.id)
+    if max_depth is not None:
+        query = query.where(PigeonAncestry.depth <= max_depth)
+    return {descendant_id for (descendant_id,) in query.distinct().tuples()}
+
+
+def count_descendants(pigeon: Pigeon) -> int:
+    return (
+        PigeonAncestry.select(PigeonAncestry.descendant_id)
+        .where(PigeonAncestry.ancestor_id == pigeon.id)
+        .distinct()
+        .count()
+    )
+
+
+def get_common_ancestors(pigeon1: Pigeon, pigeon2: Pigeon) -> Dict[int, Tuple[int, int]]:
+    """Get the ancestors both pigeons have in common.
+
+    :returns: a dictionary of ancestor id to a tuple with the closest depth for each pigeon
+    """
+    other = PigeonAncestry.alias()
+    query = (
+        PigeonAncestry.select(
+            PigeonAncestry.ancestor_id, peewee.fn.MIN(PigeonAncestry.depth), peewee.fn.MIN(other.depth)
+        )
+        .join(other, on=(other.ancestor_id == PigeonAncestry.ancestor_id))
+        .where((PigeonAncestry.descendant_id == pigeon1.id) & (other.descendant_id == pigeon2.id))
+        .group_by(PigeonAncestry.ancestor_id)
+        .tuples()
+    )
+    return {ancestor_id: (depth1, depth2) for ancestor_id, depth1, depth2 in query}
+
+
+def on_pigeon_pre_save(_sender, instance, created):  # noqa
+    if created:
+        return
+    try:
+        old = Pigeon.select(Pigeon.sire, Pigeon.dam).where(Pigeon.id == instance.id).get()
+    except Pigeon.DoesNotExist:
+        return
+    _old_parents[instance.id] = (old.sire_id, old.dam_id)
+
+
+def on_pigeon_post_save(_sender, instance, created):  # noqa
+    # A new pigeon has no descendants yet, so without parents there's nothing to add either.
+    old_parents = _old_parents.pop(instance.id, (None, None))
+    if (instance.sire_id, instance.dam_id) == old_parents or not is_enabled():
+        return
+    delta = _ancestors_from_parents((instance.sire_id, instance.dam_id), _get_ancestor_counts)
+    delta.subtract(_get_ancestor_counts(instance.id))
+    if not any(delta.values()):
+        return
+
+    with database.atomic():
+        # Every descendant inherits the changed line through this pigeon
+        _apply_paths(instance.id, delta)
+        PigeonAncestry.delete().where(PigeonAncestry.path_count <= 0).execute()
+
+
+def on_pigeon_post_delete(_sender, instance):
+    if not is_enabled():
+        return
+    delta = Counter({key: -count for key, count in _get_ancestor_counts(instance.id).items()})
+    with database.atomic():
+        _apply_paths(instance.id, delta)
+        PigeonAncestry.delete().where(
+            (PigeonAncestry.ancestor_id == instance.id)
+            | (PigeonAncestry.descendant_id == instance.id)
+            | (PigeonAncestry.path_count <= 0)
+        ).execute()
+
+
+def _get_ancestor_counts(pigeon_id) -> Counter:
+    query = (
+        PigeonAncestry.select(PigeonAncestry.ancestor_id, PigeonAncestry.depth, PigeonAncestry.path_count)
+        .where(PigeonAncestry.descendant_id == pigeon_id)
+        .tuples()
+    )
+    return Counter({(ancestor_id, depth): count for ancestor_id, depth, count in query})
+
+
+def _ancestors_from_parents(parent_ids, get_ancestors) -> Counter:
+    ancestors = Counter()
+    for parent_id in parent_ids:
+        if parent_id is None:
+            continue
+        ancestors[(parent_id, 1)] += 1
+        for (ancestor_id, depth), count in get_ancestors(parent_id).items():
+            if depth < MAX_DEPTH:
+                ancestors[(ancestor_id, depth + 1)] += count
+    return ancestors
+
+
+def _compute_closure(pigeon_id, parents, closure):
+    # Iterative depth-first walk, deep pedigrees would otherwise hit the recursion limit.
+    stack = [(pigeon_id, 0)]
+    while stack:
+        current, depth = stack[-1]
+        if current in closure:
+            stack.pop()
+            continue
+        parent_ids = parents.get(current, (None, None))
+        pending = [parent_id for parent_id in parent_ids if parent_id is not None and parent_id not in closure]
+        if pending and depth < MAX_DEPTH:
+            stack.extend((parent_id, depth + 1) for parent_id in pending)
+            continue
+        stack.pop()
+        closure[current] = _ancestors_from_parents(parent_ids, lambda parent_id: closure.get(parent_id, {}))
+
+
+def _apply_paths(pigeon_id, delta):
+    rows = [(ancestor_id, depth, count) for (ancestor_id, depth), count in delta.items() if count != 0]
+    if not rows:
+        return
+    database.execute_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS ancestry_delta (ancestor_id INTEGER, depth INTEGER, path_count INTEGER)"
+    )
+    database.execute_sql("DELETE FROM temp.ancestry_delta")
+    database.cursor().executemany("INSERT INTO temp.ancestry_delta VALUES (?, ?, ?)", rows)
+    database.execute_sql(APPLY_PATHS_SQL, (pigeon_id, pigeon_id))
+
+
+Pigeon.connect("pre_save", on_pigeon_pre_save)
+Pigeon.connect("post_save", on_pigeon_post_save)
+Pigeon.connect("post_delete", on_pigeon_post_delete)
@@ -20,15 +20,39 @@ Provides backup and restore functions
 """
 
 import os
+import json
+import time
+import zlib
+import shutil
+import sqlite3
+import hashlib
 import zipfile
 import logging
-from datetime import date
+import tempfile
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from pigeonplanner.core import const
+from pigeonplanner.database import session
+from pigeonplanner.database import migrations
+from pigeonplanner.database.main import JOURNAL_SUFFIXES, checkpoint_database
 from pigeonplanner.database.manager import dbmanager
 
 logger = logging.getLogger(__name__)
 
+# Number of database pages copied per step of the online backup
+BACKUP_PAGES = 256
+# Size of the chunks of an incremental backup. SQLite changes whole pages in place, with a
+# multiple of the page size an unchanged part of the database gives the same chunks again.
+CHUNK_SIZE = 64 * 1024
+MANIFEST_FORMAT = "pigeonplanner-backup"
+# Directory in the backup location for the automatic incremental backups
+BACKUP_STORE_DIRNAME = "pigeonplanner_backups"
+# Maximum number of databases that are restored at the same time
+RESTORE_WORKERS = 4
+# Buffer size to stream the files out of a backup
+RESTORE_BUFFER_SIZE = 1024 * 1024
+
 
 class BackupError(Exception):
     pass
@@ -42,21 +66,27 @@ def create_backup_filename():
     return "pigeonplanner_backup_%s.zip" % date.today().strftime("%Y-%m-%d")
 
 
-def create_backup(destination, overwrite=True, include_config=True):
-    """Create a backup file at the given destination.
+def create_manifest_filename():
+    return "pigeonplanner_backup_%s.json" % datetime.now().strftime("%Y-%m-%d_%H%M%S")
+
+
+def create_backup(destination, overwrite=True, include_config=True, progress=None):
+    """Create a backup file at the given destination. A consistent snapshot of each database
+    is taken with the SQLite online backup API, also while it's in use, and the snapshots are
+    compressed into the archive.
 
     :param destination: full path with filename
     :param overwrite:
     :param include_config:
+    :param progress: Optional. Function that's called with the fraction done, between 0 and 1.
+                     It's called from the thread that creates the backup.
     :return:
     """
 
     logger.debug("Create backup %s (overwrite=%s, include_config=%s)", destination, overwrite, include_config)
 
     if os.path.exists(destination):
-        if overwrite:
-            os.unlink(destination)
-        else:
+        if not overwrite:
             raise BackupError("The backup file already exists.")
 
     files = [
@@ -64,16 +94,120 @@ def create_backup(destination, overwrite=True, include_config=True):
     ]
     if include_config:
         files.append(const.CONFIGFILE)
-    files.extend([dbinfo.path for dbinfo in get_valid_databases()])
+    databases = [dbinfo.path for dbinfo in get_valid_databases()]
 
+    # Write to a temporary file first, an existing backup is only replaced by a complete one.
+    partial = destination + ".part"
+    tempdir = tempfile.mkdtemp()
     try:
-        with zipfile.ZipFile(destination, "w", zipfile.ZIP_STORED) as zfile:
+        with zipfile.ZipFile(partial, "w", zipfile.ZIP_DEFLATED) as zfile:
             for filepath in files:
-                filename = os.path.basename(filepath)
-                zfile.write(filepath, filename)
+                zfile.write(filepath, os.path.basename(filepath))
+            for index, dbpath in enumerate(databases):
+                snapshot = os.path.join(tempdir, os.path.basename(dbpath))
+                snapshot_database(dbpath, snapshot, _get_part_progress(progress, index, len(databases)))
+                zfile.write(snapshot, os.path.basename(dbpath))
+                os.remove(snapshot)
+        os.replace(partial, destination)
     except Exception as exc:
         logger.error(exc)
+        if os.path.exists(partial):
+            os.remove(partial)
         raise
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+    if progress is not None:
+        progress(1.0)
+
+
+def create_incremental_backup(directory, include_config=True, progress=None):
+    """Add a backup to the incremental backup store in the given directory. Only chunks that
+    aren't in the store yet are written, the backup itself is a small manifest that lists
+    the chunks of each file. Databases that didn't change since the previous backup aren't
+    read at all.
+
+    :param directory: path of the backup store, it's created if needed
+    :param include_config:
+    :param progress: Optional. Function that's called with the fraction done, between 0 and 1.
+    :return: path of the manifest
+    """
+
+    logger.debug("Create incremental backup in %s (include_config=%s)", directory, include_config)
+
+    store = BackupStore(directory)
+    previous = store.get_latest_manifest()
+    previous_entries = {} if previous is None else {entry["name"]: entry for entry in previous["files"]}
+
+    files = [
+        const.DATABASEINFO,
+    ]
+    if include_config:
+        files.append(const.CONFIGFILE)
+    databases = [dbinfo.path for dbinfo in get_valid_databases()]
+
+    entries = [store.add_file(filepath) for filepath in files]
+    tempdir = tempfile.mkdtemp()
+    try:
+        for index, dbpath in enumerate(databases):
+            name = os.path.basename(dbpath)
+            # Taken before the snapshot, a change during the snapshot is backed up next time.
+            source_stat = _get_source_stat(dbpath)
+            entry = previous_entries.get(name)
+            unchanged = entry is not None and source_stat is not None and entry.get("source") == source_stat
+            if not unchanged or not store.has_chunks(entry):
+                snapshot = os.path.join(tempdir, name)
+                snapshot_database(dbpath, snapshot, _get_part_progress(progress, index, len(databases)))
+                entry = store.add_file(snapshot, source_stat)
+                os.remove(snapshot)
+            else:
+                logger.debug("Database %s is unchanged since the previous backup", name)
+            entries.append(entry)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    manifest_path = store.write_manifest(entries)
+    if progress is not None:
+        progress(1.0)
+    return manifest_path
+
+
+def _get_source_stat(dbpath):
+    # Changes in a write-ahead log don't touch the database file itself. They're moved into the
+    # database first, the log of an open database would otherwise never be empty. The change
+    # counter in the database header isn't updated in WAL mode, so it can't be used instead.
+    if not checkpoint_database(dbpath):
+        return None
+    stat = os.stat(dbpath)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def snapshot_database(source, destination, progress=None):
+    """Copy a database with the SQLite online backup API. The copy is consistent, even when
+    the database is changed by another connection in the meantime.
+
+    :param source: path of the database
+    :param destination: path of the copy
+    :param progress: Optional. Function that's called with the fraction done after each step.
+    """
+
+    def on_progress(_status, remaining, total):
+        if progress is not None and total:
+            progress((total - remaining) / total)
+
+    source_connection = sqlite3.connect(source)
+    destination_connection = sqlite3.connect(destination)
+    try:
+        source_connection.backup(destination_connection, pages=BACKUP_PAGES, progress=on_progress)
+    finally:
+        destination_connection.close()
+        source_connection.close()
+
+
+def _get_part_progress(progress, index, count):
+    # Scale the progress of one database to its part of the whole backup
+    if progress is None:
+        return None
+    return lambda fraction: progress((index + fraction) / count)
 
 
 def get_valid_databases():
@@ -85,21 +219,220 @@ def get_valid_databases():
     return dbs
 
 
+class BackupStore:
+    """Directory with the incremental backups. Files are split into chunks which are stored
+    compressed and named after their SHA-256 hash, so each chunk is stored only once no
+    matter how many backups contain it. A backup is a JSON manifest in the directory with
+    the list of chunks of each file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.chunkdir = os.path.join(directory, "chunks")
+
+    def get_chunk_path(self, digest):
+        return os.path.join(self.chunkdir, digest[:2], digest[2:])
+
+    def has_chunks(self, entry):
+        return all(os.path.exists(self.get_chunk_path(digest)) for digest in entry["chunks"])
+
+    def add_chunk(self, data):
+        """Store the data if it isn't stored yet
+
+        :return: the hash of the data
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.get_chunk_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_atomic(path, zlib.compress(data))
+        return digest
+
+    def read_chunk(self, digest):
+        try:
+            with open(self.get_chunk_path(digest), "rb") as chunkfile:
+                data = zlib.decompress(chunkfile.read())
+        except (OSError, zlib.error) as exc:
+            raise RestoreError(_("The backup data is missing or damaged.")) from exc
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise RestoreError(_("The backup data is missing or damaged."))
+        return data
+
+    def add_file(self, filepath, source_stat=None):
+        """Split the file into chunks and store them
+
+        :param filepath: path of the file
+        :param source_stat: Optional. Size and modification time of the original file.
+        :return: the manifest entry of the file
+        """
+        chunks = []
+        size = 0
+        with open(filepath, "rb") as infile:
+            for data in iter(lambda: infile.read(CHUNK_SIZE), b""):
+                chunks.append(self.add_chunk(data))
+                size += len(data)
+        entry = {"name": os.path.basename(filepath), "size": size, "chunks": chunks}
+        if source_stat is not None:
+            entry["source"] = source_stat
+        return entry
+
+    def write_file(self, entry, outfile):
+        """Write the file of a manifest entry chunk by chunk to a binary file object"""
+        size = 0
+        for digest in entry["chunks"]:
+            size += outfile.write(self.read_chunk(digest))
+        if size != entry["size"]:
+            raise RestoreError(_("The backup data is missing or damaged."))
+
+    def restore_file(self, entry, destination):
+        """Write the file of a manifest entry to the destination. An existing file is only
+        replaced when the file was restored completely.
+        """
+        partial = destination + ".part"
+        try:
+            with open(partial, "wb") as outfile:
+                self.write_file(entry, outfile)
+            os.replace(partial, destination)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def read_file(self, entry):
+        return b"".join(self.read_chunk(digest) for digest in entry["chunks"])
+
+    def write_manifest(self, entries):
+        manifest = {"format": MANIFEST_FORMAT, "created": time.time(), "chunk_size": CHUNK_SIZE, "files": entries}
+        path = os.path.join(self.directory, create_manifest_filename())
+        _write_atomic(path, json.dumps(manifest, indent=1).encode("utf-8"))
+        return path
+
+    def get_manifests(self):
+        """Get the paths of all manifests, the oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        paths = [os.path.join(self.directory, name) for name in sorted(names)]
+        return [path for path in paths if self.load_manifest(path) is not None]
+
+    def get_latest_manifest(self):
+        manifests = self.get_manifests()
+        if not manifests:
+            return None
+        return self.load_manifest(manifests[-1])
+
+    @staticmethod
+    def load_manifest(path):
+        """Read a manifest
+
+        :return: the manifest dictionary or None if the file isn't a manifest
+        """
+        try:
+            with open(path, "rb") as manifestfile:
+                manifest = json.loads(manifestfile.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(manifest, dict) or manifest.get("format") != MANIFEST_FORMAT:
+            return None
+        return manifest
+
+
+def verify_database(path, name=None):
+    """Check the integrity of a database and if this version of Pigeon Planner can open it
+
+    :param path: path of the database
+    :param name: Optional. Name of the database in the error messages.
+    :raises RestoreError: when the database is damaged or newer than supported
+    """
+    name = name or os.path.basename(path)
+    connection = sqlite3.connect(path)
+    try:
+        check = connection.execute("PRAGMA quick_check").fetchall()
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.DatabaseError as exc:
+        raise RestoreError(_("The database '%s' in the backup is damaged.") % name) from exc
+    finally:
+        connection.close()
+    if check != [("ok",)]:
+        logger.error("Integrity check of %s failed: %s", name, check)
+        raise RestoreError(_("The database '%s' in the backup is damaged.") % name)
+    # Older databases are migrated when they're opened
+    if version > migrations.get_latest_version():
+        raise RestoreError(_("The database '%s' is made with a newer version of Pigeon Planner.") % name)
+
+
+def _write_atomic(path, data):
+    fd, temppath = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data)
+        os.replace(temppath, path)
+    except Exception:
+        os.remove(temppath)
+        raise
+
+
 class RestoreOperation:
+    """Restore a zip backup or an incremental backup from the manifest file"""
+
     def __init__(self, path):
         self.path = path
-        with zipfile.ZipFile(path, "r") as zfile:
-            self.namelist = zfile.namelist()
-            try:
-                self.database_info = zfile.read(os.path.basename(const.DATABASEINFO))
-                self.old_backup = False
-            except KeyError:
-                # Old style backups don't have a list of databases
-                self.database_info = None
-                self.old_backup = True
+        self.manifest = None
+        self.entries = {}
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path, "r") as zfile:
+                self.namelist = zfile.namelist()
+        else:
+            self.manifest = BackupStore.load_manifest(path)
+            if self.manifest is not None:
+                self.store = BackupStore(os.path.dirname(path))
+                self.entries = {entry["name"]: entry for entry in self.manifest["files"]}
+            self.namelist = list(self.entries)
+
+        if os.path.basename(const.DATABASEINFO) in self.namelist:
+            self.database_info = self._read(os.path.basename(const.DATABASEINFO))
+            self.old_backup = False
+        else:
+            # Old style backups don't have a list of databases
+            self.database_info = None
+            self.old_backup = True
+
+    def _read(self, name):
+        if self.manifest is not None:
+            return self.store.read_file(self.entries[name])
+        with zipfile.ZipFile(self.path, "r") as zfile:
+            return zfile.read(name)
+
+    def _extract_to_temp(self, name, directory):
+        """Stream a file out of the backup to a temporary file in the directory
+
+        :return: path of the temporary file
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, temppath = tempfile.mkstemp(prefix=name + ".", suffix=".part", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                if self.manifest is not None:
+                    self.store.write_file(self.entries[name], outfile)
+                else:
+                    # Each call has its own handle, this runs in several threads at once.
+                    with zipfile.ZipFile(self.path, "r") as zfile, zfile.open(name) as member:
+                        shutil.copyfileobj(member, outfile, RESTORE_BUFFER_SIZE)
+        except Exception:
+            os.remove(temppath)
+            raise
+        return temppath
+
+    def _extract_database(self, dbobj):
+        temppath = self._extract_to_temp(dbobj.filename, dbobj.directory)
+        try:
+            verify_database(temppath, dbobj.filename)
+        except Exception:
+            os.remove(temppath)
+            raise
+        return temppath
 
     def is_valid_archive(self):
-        if not zipfile.is_zipfile(self.path):
+        if not zipfile.is_zipfile(self.path) and self.manifest is None:
             return False
 
         if self.old_backup and "pigeonplanner.db" not in self.namelist:
@@ -119,11 +452,39 @@ class RestoreOperation:
 
         existing_paths = [dbobj.path for dbobj in dbmanager.get_databases()]
 
-        with zipfile.ZipFile(self.path, "r") as zfile:
-            if self.has_config_file() and configfile:
-                zfile.extract(os.path.basename(const.CONFIGFILE), const.PREFDIR)
-
-            for dbobj in dbobjs:
-                zfile.extract(dbobj.filename, dbobj.directory)
-                if dbobj.path not in existing_paths:
-                    dbmanager.add(dbobj.name, dbobj.description, dbobj.path)
+        # All files are extracted and the databases verified before any existing file is
+        # replaced, a damaged backup leaves everything as it was.
+        restored = []
+        error = None
+        with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as executor:
+            futures = [(dbobj.path, executor.submit(self._extract_database, dbobj)) for dbobj in dbobjs]
+            for path, future in futures:
+                try:
+                    restored.append((future.result(), path))
+                except Exception as exc:
+                    logger.error("Restoring %s failed: %s", path, exc)
+                    error = error or exc
+        if error is None and self.has_config_file() and configfile:
+            configname = os.path.basename(const.CONFIGFILE)
+            try:
+                temppath = self._extract_to_temp(configname, const.PREFDIR)
+                restored.append((temppath, os.path.join(const.PREFDIR, configname)))
+            except Exception as exc:
+                error = exc
+        if error is not None:
+            for temppath, _path in restored:
+                os.remove(temppath)
+            raise error
+
+        # The connections to the open database, also those of the read pool, can't be used after
+        # it's replaced. A leftover log or journal would be applied to the restored database.
+        if session.is_open():
+            session.close()
+        for temppath, path in restored:
+            for suffix in JOURNAL_SUFFIXES:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            os.replace(temppath, path)
+        for dbobj in dbobjs:
+            if dbobj.path not in existing_paths:
+                dbmanager.add(dbobj.name, dbobj.description, dbobj.path)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Championship and ace pigeon rankings.
+
+All results are fetched with one query and grouped per championship and
+pigeon in a single pass, the formula then scores each group of results.
+"""
+
+
+import heapq
+import locale
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import peewee
+
+from pigeonplanner.core import config
+from pigeonplanner.core import racestats
+from pigeonplanner.database.models import Pigeon, Racepoint, Result, database
+
+logger = logging.getLogger(__name__)
+
+GROUP_FIELDS = ("season", "category", "sector")
+# Minimum distance in kilometres and the points for a prize from that distance on
+DEFAULT_DISTANCE_POINTS = ((0, 10), (250, 20), (500, 30))
+
+
+class CoefficientFormula:
+    """Sum of the coefficients of the best prizes. Pigeons with the most prizes, up to the
+    number of counted races, are ranked first. Then a lower sum is better.
+    """
+
+    def __init__(self, best_races: int = 3):
+        self.best_races = best_races
+
+    def get_name(self) -> str:
+        return _("Coefficient of the best %s prizes") % self.best_races
+
+    def score(self, prizes: List[Tuple[float, float]]) -> Tuple[tuple, float]:
+        """Score the prizes of a pigeon
+
+        :param prizes: list of (place ratio, distance) tuples
+        :returns: a tuple of the sort key and the value to show
+        """
+        best = heapq.nsmallest(self.best_races, (ratio for ratio, _distance in prizes))
+        value = sum(best) * config.get("options.coef-multiplier")
+        return (-len(best), value), value
+
+    def format_value(self, value: float) -> str:
+        return locale.format_string("%.4f", value)
+
+
+class PrizePointsFormula:
+    """Points for each prize depending on the distance of the race. More points is better."""
+
+    def __init__(self, distance_points: Sequence[Tuple[float, float]] = DEFAULT_DISTANCE_POINTS):
+        self.distance_points = sorted(distance_points, reverse=True)
+
+    def get_name(self) -> str:
+        return _("Points per prize by distance")
+
+    def get_points(self, distance: float) -> float:
+        for min_distance, points in self.distance_points:
+            if distance >= min_distance:
+                return points
+        return 0
+
+    def score(self, prizes: List[Tuple[float, float]]) -> Tuple[tuple, float]:
+        value = sum(self.get_points(distance) for _ratio, distance in prizes)
+        return (-value,), value
+
+    def format_value(self, value: float) -> str:
+        return locale.format_string("%g", value)
+
+
+def get_formula_for_current_config():
+    if config.get("options.championship-formula") == "points":
+        return PrizePointsFormula()
+    return CoefficientFormula(config.get("options.championship-best-races"))
+
+
+def get_rankings(
+    formula, group_by: Sequence[str] = ("season",), seasons: Iterable[int] = None, db: peewee.Database = None
+) -> Dict[tuple, List[dict]]:
+    """Rank the pigeons for each championship.
+
+    :param formula: a formula object like CoefficientFormula or PrizePointsFormula
+    :param group_by: the fields that define a championship, any of GROUP_FIELDS
+    :param seasons: Optional. Only rank these seasons.
+    :param db: Optional. Run the queries on this database instead of the main one,
+               like the read-only database of a worker.
+    :returns: a dictionary of the group values to the list of ranked entries. An entry is a
+              dictionary with the rank, pigeon id, band, races, prizes, value and valuestr.
+    """
+    db = db or database
+    for field in group_by:
+        if field not in GROUP_FIELDS:
+            raise ValueError("Unknown group field: %r" % field)
+    columns = {
+        "season": racestats.season_expression(),
+        "category": Result.category,
+        "sector": Result.sector,
+    }
+    query = (
+        Result.select(
+            Result.pigeon,
+            Result.place,
+            Result.out,
+            peewee.fn.COALESCE(racestats.distance_expression(), 0.0),
+            *[columns[field] for field in group_by],
+        )
+        .join(Racepoint, peewee.JOIN.LEFT_OUTER, on=(Result.racepoint == Racepoint.racepoint))
+        .where(Result.out > 0)
+    )
+    if seasons is not None:
+        query = query.where(racestats.season_expression().in_(list(seasons)))
+
+    # One pass over all results, grouped by championship and pigeon. The rows are read from
+    # the cursor directly, they only contain plain values that need no conversion.
+    races = defaultdict(int)
+    prizes = defaultdict(list)
+    for pigeon_id, place, out, distance, *group in db.execute(query):
+        key = (tuple(group), pigeon_id)
+        races[key] += 1
+        if place > 0:
+            prizes[key].append((place / out, distance))
+
+    bands = _get_bands({pigeon_id for _group, pigeon_id in prizes}, db)
+    scored = defaultdict(list)
+    for (group, pigeon_id), pigeon_prizes in prizes.items():
+        sort_key, value = formula.score(pigeon_prizes)
+        scored[group].append((sort_key, bands.get(pigeon_id, ""), pigeon_id, value))
+
+    rankings = {}
+    for group, entries in scored.items():
+        entries.sort()
+        ranking = []
+        for sort_key, band, pigeon_id, value in entries:
+            # Equal scores share the same rank
+            rank = ranking[-1]["rank"] if ranking and ranking[-1]["sort_key"] == sort_key else len(ranking) + 1
+            ranking.append(
+                {
+                    "rank": rank,
+                    "sort_key": sort_key,
+                    "pigeon": pigeon_id,
+                    "band": band,
+                    "races": races[(group, pigeon_id)],
+                    "prizes": len(prizes[(group, pigeon_id)]),
+                    "value": value,
+                    "valuestr": formula.format_value(value),
+                }
+            )
+        rankings[group] = ranking
+    return rankings
+
+
+def _get_bands(pigeon_ids, db: peewee.Database) -> Dict[int, str]:
+    bands = {}
+    for chunk in peewee.chunked(list(pigeon_ids), 900):
+        query = Pigeon.select(
+            Pigeon.id,
+            Pigeon.band_format,
+            Pigeon.band_country,
+            Pigeon.band_letters,
+            Pigeon.band_number,
+            Pigeon.band_year,
+        ).where(Pigeon.id.in_(chunk))
+        for pigeon_id, *band in query.tuples().execute(db):
+            bands[pigeon_id] = Pigeon.format_band(*band)
+    return bands
@@ -61,11 +61,14 @@ def get_date() -> str:
     return datetime.date.today().strftime(const.DATE_FORMAT)
 
 
-def count_active_pigeons(pigeons: Optional[List[Pigeon]] = None) -> Dict[Union[str, int], int]:
+def count_active_pigeons(
+    pigeons: Optional[List[Pigeon]] = None, include_hidden: bool = False
+) -> Dict[Union[str, int], int]:
     """Count the number of active pigeons in the database. If an optional list of pigeons
     is given, count those.
 
     :param pigeons: Optional. List of Pigeon objects.
+    :param include_hidden: Optional. Count the hidden pigeons in the database as well.
     :returns: A dictionary containing total number of pigeons and numbers per sex.
     """
 
@@ -78,11 +81,9 @@ def count_active_pigeons(pigeons: Optional[List[Pigeon]] = None) -> Dict[Union[s
     }
 
     if pigeons is None:
-        query = (
-            Pigeon.select(Pigeon.sex, peewee.fn.Count(Pigeon.sex).alias("count"))
-            .where(Pigeon.visible == True)  # noqa
-            .group_by(Pigeon.sex)
-        )
+        query = Pigeon.select(Pigeon.sex, peewee.fn.Count(Pigeon.sex).alias("count")).group_by(Pigeon.sex)
+        if not include_hidden:
+            query = query.where(Pigeon.visible == True)  # noqa
         for row in query:
             counts[row.sex] = row.count
     else:
@@ -131,6 +131,12 @@ default_config = [
     ("options.distance-unit", 1),
     ("options.speed-unit", 1),
     ("options.band-format", "{empty}{empty}{number} / {year}"),
+    ("options.championship-formula", "coefficient"),
+    ("options.championship-best-races", 3),
+    # Database connection profile, the sizes are in MiB
+    ("options.database-wal", True),
+    ("options.database-cache-size", 32),
+    ("options.database-mmap-size", 256),
     # ("options.format-date", "%Y-%m-%d"),
     ("interface.arrows", False),
     ("interface.stats", False),
@@ -151,6 +157,7 @@ default_config = [
     ("backup.automatic-backup", True),
     ("backup.interval", 30),
     ("backup.location", const.HOMEDIR),
+    ("backup.incremental", False),
     ("backup.last", time.time()),
     ("columns.pigeon-name", True),
     ("columns.pigeon-band-country", False),
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Inbreeding coefficient (COI) and kinship calculations
+"""
+
+
+import locale
+import logging
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy
+
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+from pigeonplanner.core import enums
+from pigeonplanner.database.models import Pigeon, Status
+
+logger = logging.getLogger(__name__)
+
+# Protection against endless loops when a pigeon is wrongly set as its own ancestor.
+MAX_GENERATIONS = 64
+
+
+class KinshipCalculator:
+    """Calculate kinship and inbreeding coefficients with the recursive method.
+
+    The sire and dam of all pigeons are loaded once. Calculated kinship values
+    are kept for the lifetime of the object, so different pairs that share
+    ancestors don't recalculate the common part.
+    """
+
+    def __init__(self):
+        query = Pigeon.select(Pigeon.id, Pigeon.sire, Pigeon.dam).tuples()
+        self._parents = {pigeon_id: (sire_id, dam_id) for pigeon_id, sire_id, dam_id in query}
+        self._generations = self._compute_generations()
+        self._kinship = {}
+
+    def kinship(self, pigeon_id1: Optional[int], pigeon_id2: Optional[int]) -> float:
+        """Get the kinship coefficient of two pigeons. This is the probability that
+        two alleles taken at random from each pigeon are identical by descent.
+        """
+        if pigeon_id1 is None or pigeon_id2 is None:
+            return 0.0
+        key = (pigeon_id1, pigeon_id2) if pigeon_id1 <= pigeon_id2 else (pigeon_id2, pigeon_id1)
+        try:
+            return self._kinship[key]
+        except KeyError:
+            pass
+
+        if pigeon_id1 == pigeon_id2:
+            sire_id, dam_id = self._parents.get(pigeon_id1, (None, None))
+            value = 0.5 * (1.0 + self.kinship(sire_id, dam_id))
+        else:
+            # Always expand the youngest pigeon, it can't be an ancestor of the other one.
+            if self._generations.get(pigeon_id1, 0) < self._generations.get(pigeon_id2, 0):
+                pigeon_id1, pigeon_id2 = pigeon_id2, pigeon_id1
+            sire_id, dam_id = self._parents.get(pigeon_id1, (None, None))
+            if self._generations.get(pigeon_id1, 0) >= MAX_GENERATIONS:
+                sire_id = dam_id = None
+            value = 0.5 * (self.kinship(sire_id, pigeon_id2) + self.kinship(dam_id, pigeon_id2))
+
+        self._kinship[key] = value
+        return value
+
+    def inbreeding(self, pigeon_id: int) -> float:
+        """Get Wright's coefficient of inbreeding of a pigeon"""
+        sire_id, dam_id = self._parents.get(pigeon_id, (None, None))
+        return self.kinship(sire_id, dam_id)
+
+    def offspring_inbreeding(self, sire_id: int, dam_id: int) -> float:
+        """Get the coefficient of inbreeding the youngsters of this pair would have"""
+        return self.kinship(sire_id, dam_id)
+
+    def kinship_matrix(self, pigeon_ids: List[int]) -> Tuple[List[int], List[List[float]]]:
+        """Calculate the kinship of all pairs of the given pigeons at once with the tabular method.
+        When NumPy is available the rows are calculated vectorized, otherwise the recursive
+        method is used for each pair.
+
+        :returns: a tuple with the list of pigeon ids and the matrix, as a nested list or NumPy array
+        """
+        pigeon_ids = list(pigeon_ids)
+        if not numpy_available:
+            matrix = [[self.kinship(id1, id2) for id2 in pigeon_ids] for id1 in pigeon_ids]
+            return pigeon_ids, matrix
+
+        # All ancestors are needed, ordered so that parents come before their youngsters.
+        order = sorted(self._get_with_ancestors(pigeon_ids), key=lambda pid: self._generations.get(pid, 0))
+        index = {pigeon_id: i for i, pigeon_id in enumerate(order)}
+        # Additive relationship matrix, which is twice the kinship
+        relationship = numpy.zeros((len(order), len(order)))
+        for i, pigeon_id in enumerate(order):
+            sire_id, dam_id = self._parents.get(pigeon_id, (None, None))
+            sire_index, dam_index = index.get(sire_id), index.get(dam_id)
+            row = numpy.zeros(i)
+            if sire_index is not None:
+                row += 0.5 * relationship[sire_index, :i]
+            if dam_index is not None:
+                row += 0.5 * relationship[dam_index, :i]
+            relationship[i, :i] = row
+            relationship[:i, i] = row
+            diagonal = 1.0
+            if sire_index is not None and dam_index is not None:
+                diagonal += 0.5 * relationship[sire_index, dam_index]
+            relationship[i, i] = diagonal
+
+        selection = [index[pigeon_id] for pigeon_id in pigeon_ids]
+        return pigeon_ids, relationship[numpy.ix_(selection, selection)] / 2.0
+
+    def breeders_kinship_matrix(self) -> Tuple[List[int], List[List[float]]]:
+        """Calculate the kinship matrix for all visible pigeons with the breeder status"""
+        query = (
+            Pigeon.select(Pigeon.id)
+            .join(Status)
+            .where((Status.status_id == enums.Status.breeder) & (Pigeon.visible == True))  # noqa
+            .tuples()
+        )
+        return self.kinship_matrix([pigeon_id for (pigeon_id,) in query])
+
+    def _get_with_ancestors(self, pigeon_ids):
+        found = set()
+        stack = list(pigeon_ids)
+        while stack:
+            pigeon_id = stack.pop()
+            if pigeon_id is None or pigeon_id in found:
+                continue
+            found.add(pigeon_id)
+            stack.extend(self._parents.get(pigeon_id, (None, None)))
+        return found
+
+    def _compute_generations(self) -> Dict[int, int]:
+        # Pigeons without known parents are generation 0, others one more than their oldest parent.
+        generations = {}
+        for pigeon_id in self._parents:
+            stack = [(pigeon_id, 0)]
+            while stack:
+                current, depth = stack[-1]
+                if current in generations:
+                    stack.pop()
+                    continue
+                parent_ids = [pid for pid in self._parents.get(current, (None, None)) if pid is not None]
+                pending = [pid for pid in parent_ids if pid not in generations]
+                if pending and depth < MAX_GENERATIONS:
+                    stack.extend((pid, depth + 1) for pid in pending)
+                    continue
+                stack.pop()
+                generations[current] = 1 + max((generations.get(pid, 0) for pid in parent_ids), default=-1)
+        return generations
+
+
+_calculator = None
+
+
+def get_calculator() -> KinshipCalculator:
+    """Get the shared calculator. It's recreated after pigeons are changed."""
+    global _calculator
+    if _calculator is None:
+        _calculator = KinshipCalculator()
+    return _calculator
+
+
+def format_coefficient(value: float) -> str:
+    return locale.format_string("%.2f%%", value * 100)
+
+
+def on_pigeon_changed(_sender, _instance, **_kwargs):
+    global _calculator
+    _calculator = None
+
+
+Pigeon.connect("post_save", on_pigeon_changed)
+Pigeon.connect("post_delete", on_pigeon_changed)
@@ -18,16 +18,23 @@
 
 import os
 import logging
+import operator
+import functools
 
 import peewee
 
 from . import enums
 from . import errors
+from . import ancestry  # noqa: connects the ancestry table signal handlers
 from pigeonplanner import thumbnail
 from pigeonplanner.database.models import Pigeon, Image, Status, database
 
 logger = logging.getLogger(__name__)
 
+# Rows per insert query, all columns with a default are inserted as well. This keeps
+# the number of variables per query below the SQLite limit of 999.
+INSERT_CHUNK_SIZE = 30
+
 
 def add_pigeon(data, status, statusdata):
     """Add a pigeon
@@ -66,6 +73,44 @@ def add_pigeon(data, status, statusdata):
     return pigeon
 
 
+def add_pigeons(band_numbers, band_year, sex, status=enums.Status.active):
+    """Add many pigeons without a country and letters at once, like a range of bands.
+    The pigeons and their statuses are inserted in a single transaction. Bands that
+    already exist are skipped.
+
+    :param band_numbers: iterable of band numbers
+    :param band_year: the band year of all pigeons
+    :param sex: One of the sex constants
+    :param status: One of the status constants
+    :returns: a list of the ids of the added pigeons
+    """
+
+    _check_input_data({"sex": sex})
+    _apply_status_out_of_sync_workaround()
+
+    band_numbers = list(dict.fromkeys(band_numbers))
+    existing = Pigeon.get_for_band_numbers((number, band_year) for number in band_numbers)
+    new_numbers = [number for number in band_numbers if (number, band_year) not in existing]
+    logger.debug("Adding %s pigeon(s), %s already exist", len(new_numbers), len(existing))
+    if not new_numbers:
+        return []
+
+    rows = [
+        {"band_country": "", "band_letters": "", "band_number": number, "band_year": band_year, "sex": sex}
+        for number in new_numbers
+    ]
+    with database.atomic():
+        for batch in peewee.chunked(rows, INSERT_CHUNK_SIZE):
+            Pigeon.insert_many(batch).execute()
+        added = Pigeon.get_for_band_numbers((number, band_year) for number in new_numbers)
+        pigeon_ids = [added[(number, band_year)].id for number in new_numbers]
+        status_rows = [{"pigeon": pigeon_id, "status_id": status} for pigeon_id in pigeon_ids]
+        for batch in peewee.chunked(status_rows, INSERT_CHUNK_SIZE):
+            Status.insert_many(batch).execute()
+
+    return pigeon_ids
+
+
 def update_pigeon(pigeon, data, status, statusdata):
     """Update the pigeon
 
@@ -132,13 +177,105 @@ def remove_pigeon(pigeon):
     pigeon.delete_instance()
 
 
+def get_ancestors(pigeon, generations):
+    """Fetch all ancestors of a pigeon up to the given number of generations with a single
+    recursive query.
+
+    :param pigeon: the Pigeon object to start from
+    :param generations: number of generations to fetch, 1 means only sire and dam
+    :returns: a dictionary of pigeon id to Pigeon object
+    """
+    if generations < 1:
+        return {}
+
+    child = Pigeon.alias()
+    parent = Pigeon.alias()
+    base = (
+        Pigeon.select(Pigeon.id, peewee.Value(0).alias("generation"))
+        .where(Pigeon.id == pigeon.id)
+        .cte("ancestors", recursive=True, columns=("id", "generation"))
+    )
+    recursive = (
+        parent.select(parent.id, base.c.generation + 1)
+        .join(child, on=((parent.id == child.sire) | (parent.id == child.dam)))
+        .join(base, on=(child.id == base.c.id))
+        .where(base.c.generation < generations)
+    )
+    cte = base.union_all(recursive)
+    query = (
+        Pigeon.select()
+        .join(cte, on=(Pigeon.id == cte.c.id))
+        .where(Pigeon.id != pigeon.id)
+        .distinct()
+        .with_cte(cte)
+    )
+    return {ancestor.id: ancestor for ancestor in query}
+
+
 def build_pedigree_tree(pigeon, index, depth, lst):
+    """Fill the list with the pigeon and its ancestors. The sire of the pigeon at index i
+    is placed at 2i+1, the dam at 2i+2. All ancestors are fetched in one query.
+    """
+    if depth > 5 or pigeon is None or index >= len(lst):
+        return
+
+    ancestors = get_ancestors(pigeon, 5 - depth)
+    _fill_pedigree_tree(pigeon, index, depth, lst, ancestors)
+
+
+def _fill_pedigree_tree(pigeon, index, depth, lst, ancestors):
     if depth > 5 or pigeon is None or index >= len(lst):
         return
 
     lst[index] = pigeon
-    build_pedigree_tree(pigeon.sire, (2 * index) + 1, depth + 1, lst)
-    build_pedigree_tree(pigeon.dam, (2 * index) + 2, depth + 1, lst)
+    _fill_pedigree_tree(ancestors.get(pigeon.sire_id), (2 * index) + 1, depth + 1, lst, ancestors)
+    _fill_pedigree_tree(ancestors.get(pigeon.dam_id), (2 * index) + 2, depth + 1, lst, ancestors)
+
+
+def get_filtered_pigeon_ids(filter_items, pigeon_ids=None):
+    """Compile the filter items into a single query and return the matching pigeon ids
+
+    :param filter_items: iterable of filter items with a name, value, operator and type. The name
+                         is a Pigeon field, "status_id", "sire_filter" or "dam_filter".
+    :param pigeon_ids: Optional. Only check the pigeons with these ids.
+    :returns: a set of pigeon ids
+    """
+    sire = Pigeon.alias()
+    dam = Pigeon.alias()
+    parent_columns = {
+        "sire_filter": (sire.band_country, sire.band_letters, sire.band_number, sire.band_year),
+        "dam_filter": (dam.band_country, dam.band_letters, dam.band_number, dam.band_year),
+    }
+
+    query = (
+        Pigeon.select(Pigeon.id)
+        .join(Status, peewee.JOIN.LEFT_OUTER, on=(Status.pigeon == Pigeon.id))
+        .switch(Pigeon)
+        .join(sire, peewee.JOIN.LEFT_OUTER, on=(Pigeon.sire == sire.id))
+        .switch(Pigeon)
+        .join(dam, peewee.JOIN.LEFT_OUTER, on=(Pigeon.dam == dam.id))
+    )
+    for item in filter_items:
+        value = item.type(item.value)
+        if item.name in parent_columns:
+            if item.operator is not operator.eq:
+                raise ValueError("Unsupported operator for %s: %r" % (item.name, item.operator))
+            expression = functools.reduce(
+                operator.and_, [column == part for column, part in zip(parent_columns[item.name], value)]
+            )
+        else:
+            column = Status.status_id if item.name == "status_id" else getattr(Pigeon, item.name)
+            if item.type is int and isinstance(column, peewee.CharField):
+                column = column.cast("INTEGER")
+            expression = item.operator(column, value)
+        query = query.where(expression)
+    if pigeon_ids is None:
+        return {pigeon_id for (pigeon_id,) in query.tuples()}
+    matching = set()
+    # Stay below the SQLite limit on the number of variables in a query.
+    for chunk in peewee.chunked(list(pigeon_ids), 900):
+        matching.update(pigeon_id for (pigeon_id,) in query.where(Pigeon.id.in_(chunk)).tuples())
+    return matching
 
 
 def get_or_create_pigeon(band_tuple, sex, visible, **data):
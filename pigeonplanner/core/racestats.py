@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Maintenance and queries of the per pigeon, per season race statistics.
+
+The statistics are aggregated by the database from the results. After a
+result is saved or removed only the statistics of that pigeon and season are
+aggregated again. Bulk inserts don't send signals, call refresh() after them.
+Existing databases get the table with a migration, rebuild() aggregates it again.
+"""
+
+
+import logging
+from typing import Iterable, List, Tuple
+
+import peewee
+
+from pigeonplanner.core import config
+from pigeonplanner.database.models import Pigeon, PigeonSeasonStats, Racepoint, Result, database
+
+logger = logging.getLogger(__name__)
+
+# Racepoint distance units in metres, in the same order as the DistanceCombobox
+DISTANCE_UNITS = (0.9144, 1000.0, 1.0, 0.01, 0.025, 0.3048, 1609.344, 1852.0)
+
+# The key of each result that is being saved, from before it was changed
+_old_keys = {}
+
+FIELDS = [
+    PigeonSeasonStats.pigeon,
+    PigeonSeasonStats.season,
+    PigeonSeasonStats.races,
+    PigeonSeasonStats.prizes,
+    PigeonSeasonStats.place_ratio_sum,
+    PigeonSeasonStats.best_place_ratio,
+    PigeonSeasonStats.distance,
+    PigeonSeasonStats.speed_sum,
+    PigeonSeasonStats.speed_count,
+    PigeonSeasonStats.ace_points,
+]
+
+
+def is_enabled() -> bool:
+    return PigeonSeasonStats.table_exists()
+
+
+def season_expression() -> peewee.Expression:
+    return peewee.fn.substr(Result.date, 1, 4).cast("INTEGER")
+
+
+def distance_expression() -> peewee.Expression:
+    """The distance of the racepoint in kilometres. The Racepoint table needs to be joined."""
+    unit_factor = peewee.Case(Racepoint.unit, list(enumerate(DISTANCE_UNITS)), 1.0)
+    return Racepoint.distance.cast("REAL") * unit_factor / 1000.0
+
+
+def rebuild() -> int:
+    """Create the statistics table if needed and aggregate all results again.
+
+    :returns: the number of rows in the table
+    """
+    with database.atomic():
+        database.create_tables([PigeonSeasonStats], safe=True)
+        PigeonSeasonStats.delete().execute()
+        PigeonSeasonStats.insert_from(_aggregate_query(), FIELDS).execute()
+    num_rows = PigeonSeasonStats.select().count()
+    logger.debug("Rebuilt the race statistics table with %s row(s)", num_rows)
+    return num_rows
+
+
+def refresh(keys: Iterable[Tuple[int, int]]):
+    """Aggregate the statistics again for these (pigeon id, season) tuples"""
+    if not is_enabled():
+        return
+    with database.atomic():
+        for pigeon_id, season in set(keys):
+            PigeonSeasonStats.delete().where(
+                (PigeonSeasonStats.pigeon == pigeon_id) & (PigeonSeasonStats.season == season)
+            ).execute()
+            query = _aggregate_query().where((Result.pigeon == pigeon_id) & (season_expression() == season))
+            PigeonSeasonStats.insert_from(query, FIELDS).execute()
+
+
+def get_key(pigeon_id, date) -> Tuple[int, int]:
+    """Get the statistics key of a result from its pigeon id and date"""
+    return pigeon_id, int(str(date)[:4])
+
+
+def get_season_stats(pigeon: Pigeon) -> List[PigeonSeasonStats]:
+    """Get the statistics of each season of the pigeon, the latest season first"""
+    query = (
+        PigeonSeasonStats.select()
+        .where(PigeonSeasonStats.pigeon == pigeon.id)
+        .order_by(PigeonSeasonStats.season.desc())
+    )
+    return list(query)
+
+
+def get_season_ranking(season: int, limit: int = None) -> peewee.SelectQuery:
+    """Get the statistics of all pigeons of a season ordered by the ace points"""
+    query = (
+        PigeonSeasonStats.select(PigeonSeasonStats, Pigeon)
+        .join(Pigeon)
+        .where(PigeonSeasonStats.season == season)
+        .order_by(PigeonSeasonStats.ace_points.desc(), PigeonSeasonStats.place_ratio_sum.asc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def get_average_coefficient(stats: PigeonSeasonStats) -> float:
+    if stats.prizes == 0:
+        return 0.0
+    return stats.place_ratio_sum / stats.prizes * config.get("options.coef-multiplier")
+
+
+def get_best_coefficient(stats: PigeonSeasonStats) -> float:
+    if stats.best_place_ratio is None:
+        return 0.0
+    return stats.best_place_ratio * config.get("options.coef-multiplier")
+
+
+def get_average_speed(stats: PigeonSeasonStats) -> float:
+    if stats.speed_count == 0:
+        return 0.0
+    return stats.speed_sum / stats.speed_count
+
+
+def on_result_pre_save(_sender, instance, created):  # noqa
+    if created or not is_enabled():
+        return
+    # Remember where the result was before, it may move to another pigeon or season.
+    try:
+        old = Result.select(Result.pigeon, Result.date).where(Result.id == instance.id).get()
+    except Result.DoesNotExist:
+        return
+    _old_keys[instance.id] = get_key(old.pigeon_id, old.date)
+
+
+def on_result_post_save(_sender, instance, created):  # noqa
+    keys = {get_key(instance.pigeon_id, instance.date)}
+    old_key = _old_keys.pop(instance.id, None)
+    if old_key is not None:
+        keys.add(old_key)
+    refresh(keys)
+
+
+def on_result_post_delete(_sender, instance):
+    refresh([get_key(instance.pigeon_id, instance.date)])
+
+
+def on_racepoint_changed(_sender, instance, **_kwargs):
+    if not is_enabled():
+        return
+    query = Result.select(Result.pigeon, Result.date).where(Result.racepoint == instance.racepoint)
+    refresh(get_key(result.pigeon_id, result.date) for result in query)
+
+
+def _aggregate_query() -> peewee.SelectQuery:
+    placed = Result.place > 0
+    # Results without a number of pigeons still count as a race, only without a place ratio
+    out = peewee.fn.NULLIF(Result.out, 0)
+    place_ratio = Result.place.cast("REAL") / out
+    distance = distance_expression()
+    return (
+        Result.select(
+            Result.pigeon,
+            season_expression(),
+            peewee.fn.COUNT(Result.id),
+            peewee.fn.SUM(peewee.Case(None, [(placed, 1)], 0)),
+            # TOTAL() is 0.0 instead of NULL when there are only NULL values
+            peewee.fn.TOTAL(peewee.Case(None, [(placed, place_ratio)], 0.0)),
+            peewee.fn.MIN(peewee.Case(None, [(placed, place_ratio)], None)),
+            peewee.fn.SUM(peewee.fn.COALESCE(distance, 0.0)),
+            peewee.fn.SUM(peewee.Case(None, [(Result.speed > 0, Result.speed)], 0.0)),
+            peewee.fn.SUM(peewee.Case(None, [(Result.speed > 0, 1)], 0)),
+            # Ace points: 100 for a first place, decreasing to 100/out for the last one
+            peewee.fn.TOTAL(peewee.Case(None, [(placed, (Result.out - Result.place + 1) * 100.0 / out)], 0.0)),
+        )
+        .join(Racepoint, peewee.JOIN.LEFT_OUTER, on=(Result.racepoint == Racepoint.racepoint))
+        .group_by(Result.pigeon, season_expression())
+    )
+
+
+Result.connect("pre_save", on_result_pre_save)
+Result.connect("post_save", on_result_post_save)
+Result.connect("post_delete", on_result_post_delete)
+Racepoint.connect("post_save", on_racepoint_changed)
+Racepoint.connect("post_delete", on_racepoint_changed)
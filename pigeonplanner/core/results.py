@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Queries for the results window
+"""
+
+
+import logging
+import functools
+import itertools
+import operator
+from typing import List, Optional, Sequence, Tuple
+
+import peewee
+
+from pigeonplanner.core import common
+from pigeonplanner.core import config
+from pigeonplanner.database.models import Pigeon, Result
+
+logger = logging.getLogger(__name__)
+
+RACE_FIELDS = ("date", "racepoint", "type", "wind", "windspeed", "weather", "temperature")
+# Number of rows fetched at once by a paged view
+PAGE_SIZE = 200
+
+
+def coefficient_expression() -> peewee.Expression:
+    """The coefficient of a result as a SQL expression, see common.calculate_coefficient()"""
+    return Result.place.cast("REAL") / Result.out * config.get("options.coef-multiplier")
+
+
+def get_column(name: str):
+    """Get the column or expression for a name as used by the results window.
+    The band is a tuple of the four band columns.
+    """
+    columns = {
+        "date": Result.date,
+        "point": Result.racepoint,
+        "type": Result.type,
+        "wind": Result.wind,
+        "windspeed": Result.windspeed,
+        "weather": Result.weather,
+        "temperature": Result.temperature,
+        "place": Result.place,
+        "out": Result.out,
+        "speed": Result.speed,
+        "sector": Result.sector,
+        "category": Result.category,
+        "comment": Result.comment,
+        "year": Pigeon.band_year,
+        "band_tuple": (Pigeon.band_country, Pigeon.band_letters, Pigeon.band_number, Pigeon.band_year),
+    }
+    if name == "coef":
+        return coefficient_expression()
+    return columns[name]
+
+
+def build_where(filter_items) -> Optional[peewee.Expression]:
+    """Compile the filter items into a single expression for select_results()
+
+    :param filter_items: iterable of filter items with a name as used by get_column(), a value,
+                         an operator and a type
+    :returns: the expression or None without filter items
+    """
+    expressions = []
+    for item in filter_items:
+        value = item.type(item.value)
+        column = get_column(item.name)
+        if isinstance(column, tuple):
+            if item.operator is not operator.eq:
+                raise ValueError("Unsupported operator for %s: %r" % (item.name, item.operator))
+            expressions.extend(part_column == part for part_column, part in zip(column, value))
+            continue
+        if item.type is int and isinstance(column, peewee.CharField):
+            column = column.cast("INTEGER")
+        expressions.append(item.operator(column, value))
+    if not expressions:
+        return None
+    return functools.reduce(operator.and_, expressions)
+
+
+def get_order_by(name: str, descending: bool = False) -> List[peewee.Ordering]:
+    """Get the ordering for a column name. The id is always added to have a stable order for paging."""
+    if name in ("band", "band_tuple", "year"):
+        columns = [Pigeon.band_year, Pigeon.band_country, Pigeon.band_letters, Pigeon.band_number]
+    else:
+        columns = [get_column(name)]
+    columns.append(Result.id)
+    return [column.desc() if descending else column.asc() for column in columns]
+
+
+def select_results() -> peewee.SelectQuery:
+    """Select all result fields together with the band of the pigeon"""
+    return Result.select(
+        Result,
+        Pigeon.band_format,
+        Pigeon.band_country,
+        Pigeon.band_letters,
+        Pigeon.band_number,
+        Pigeon.band_year,
+    ).join(Pigeon, peewee.JOIN.LEFT_OUTER, on=(Result.pigeon == Pigeon.id))
+
+
+def format_result(result: dict) -> dict:
+    """Add the formatted band, place, coefficient and speed to a result dictionary
+    as selected by select_results().
+    """
+    band_format = result.pop("band_format")
+    band_tuple = tuple(result.pop(key) for key in ("band_country", "band_letters", "band_number", "band_year"))
+    # A result can have None as pigeon.
+    if band_format is None:
+        result["band_tuple"] = ()
+        result["band"] = ""
+        result["year"] = ""
+    else:
+        result["band_tuple"] = band_tuple
+        result["band"] = Pigeon.format_band(band_format, *band_tuple)
+        result["year"] = band_tuple[3]
+    result["ring"] = result["band"]
+
+    placestr, coef, coefstr = common.format_place_coef(result["place"], result["out"])
+    result["speedstr"] = common.format_speed(result["speed"])
+    result["coef"] = coef
+    result["coefstr"] = coefstr
+    result["placestr"] = placestr
+    return result
+
+
+def get_races(where: Optional[peewee.Expression] = None) -> List[Tuple[dict, List[dict]]]:
+    """Get all races with their results using a single query, no matter how many races there are.
+
+    :param where: Optional. Only get the results matching this expression, see build_where().
+                  Races without matching results are left out.
+    :returns: a list of tuples with a race dictionary and the list of result dictionaries,
+              ordered by date and racepoint
+    """
+    query = select_results()
+    if where is not None:
+        query = query.where(where)
+    query = query.order_by(Result.date.asc(), Result.racepoint.asc(), Result.id.asc()).dicts()
+    races = []
+    key = operator.itemgetter("date", "racepoint")
+    for _key, results in itertools.groupby(map(format_result, query), key):
+        results = list(results)
+        race = {field: results[0][field] for field in RACE_FIELDS}
+        races.append((race, results))
+    return races
+
+
+def count_results(where: Optional[peewee.Expression] = None) -> int:
+    query = Result.select().join(Pigeon, peewee.JOIN.LEFT_OUTER, on=(Result.pigeon == Pigeon.id))
+    if where is not None:
+        query = query.where(where)
+    return query.count()
+
+
+def get_results_page(
+    where: Optional[peewee.Expression], order_by: Sequence[peewee.Ordering], offset: int, limit: int = PAGE_SIZE
+) -> List[dict]:
+    """Get a window of the formatted result dictionaries. Filtering and sorting is done
+    by the database, so only the rows that will be shown are fetched.
+    """
+    query = select_results()
+    if where is not None:
+        query = query.where(where)
+    query = query.order_by(*order_by).offset(offset).limit(limit).dicts()
+    return [format_result(result) for result in query]
@@ -17,10 +17,18 @@
 
 
 import os
-import shutil
 import logging
+import sqlite3
+import threading
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from urllib.request import pathname2url
+
+import peewee
 
 from pigeonplanner.core import const
+from pigeonplanner.core import config
 from pigeonplanner.database import models
 from pigeonplanner.database import migrations
 
@@ -29,6 +37,28 @@ logger = logging.getLogger(__name__)
 peewee_logger = logging.getLogger("peewee")
 peewee_logger.disabled = True
 
+# Number of read-only connections for work outside of the main thread
+READ_POOL_WORKERS = 2
+
+# Files next to a database with changes that aren't in the database file itself yet
+JOURNAL_SUFFIXES = ("-wal", "-shm", "-journal")
+
+# File systems of network shares. The write-ahead log needs shared memory between the
+# connections, which isn't available when the database is opened from several computers.
+NETWORK_FILESYSTEMS = {
+    "9p",
+    "afs",
+    "cifs",
+    "davfs",
+    "fuse.gvfsd-fuse",
+    "fuse.sshfs",
+    "ncpfs",
+    "nfs",
+    "nfs4",
+    "smb3",
+    "smbfs",
+}
+
 
 class DatabaseVersionError(Exception):
     pass
@@ -38,10 +68,153 @@ class DatabaseMigrationError(Exception):
     pass
 
 
+def is_network_path(path: str) -> bool:
+    """Check if the path is on a network share. These are UNC paths, mapped network drives
+    on Windows and mounts of a known network file system on Linux.
+    """
+    path = os.path.abspath(path)
+    if path.startswith(("\\\\", "//")):
+        return True
+    if const.WINDOWS:
+        import ctypes
+
+        drive_remote = 4
+        drive = os.path.splitdrive(path)[0]
+        return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == drive_remote
+    try:
+        with open("/proc/mounts") as mounts:
+            entries = [line.split()[1:3] for line in mounts]
+    except OSError:
+        return False
+    path = os.path.realpath(path)
+    mount_fstype = None
+    mount_length = -1
+    for mountpoint, fstype in entries:
+        mountpoint = mountpoint.replace("\\040", " ")
+        if os.path.commonpath([path, mountpoint]) == mountpoint and len(mountpoint) > mount_length:
+            mount_fstype = fstype
+            mount_length = len(mountpoint)
+    return mount_fstype in NETWORK_FILESYSTEMS
+
+
+def can_use_wal(dbfile: str) -> bool:
+    if dbfile == ":memory:" or not config.get("options.database-wal"):
+        return False
+    # The log and shared memory files are created next to the database
+    if not os.access(os.path.dirname(os.path.abspath(dbfile)), os.W_OK):
+        return False
+    return not is_network_path(dbfile)
+
+
+def get_pragmas(dbfile: str) -> List[Tuple[str, object]]:
+    """Get the pragmas for a connection to the database from the configured profile.
+    Databases on a network share keep the rollback journal and don't use memory-mapped I/O.
+    """
+    pragmas = [
+        ("foreign_keys", 1),
+        ("temp_store", "MEMORY"),
+        # A negative cache size is in KiB instead of pages
+        ("cache_size", -config.get("options.database-cache-size") * 1024),
+    ]
+    if dbfile == ":memory:" or not is_network_path(dbfile):
+        pragmas.append(("mmap_size", config.get("options.database-mmap-size") * 1024 * 1024))
+    return pragmas
+
+
+def get_read_only_args(dbfile: str) -> Tuple[str, List[Tuple[str, object]]]:
+    """Get the URI and the pragmas for a read-only connection to the database. Unlike the main
+    connection it doesn't change the journal mode.
+    """
+    uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(dbfile))
+    return uri, get_pragmas(dbfile) + [("query_only", 1)]
+
+
+def copy_database(source: str, destination: str):
+    """Copy a database with the SQLite online backup API. Unlike a file copy this includes
+    the changes that are still in the write-ahead log.
+    """
+    with closing(sqlite3.connect(source)) as source_connection:
+        with closing(sqlite3.connect(destination)) as destination_connection:
+            source_connection.backup(destination_connection)
+
+
+def get_wal_size(dbfile: str) -> int:
+    try:
+        return os.path.getsize(dbfile + "-wal")
+    except OSError:
+        return 0
+
+
+def checkpoint_database(dbfile: str) -> bool:
+    """Move the changes in the write-ahead log into the database file and empty the log.
+
+    :returns: True if the database file holds all changes afterwards
+    """
+    if get_wal_size(dbfile) == 0:
+        return True
+    try:
+        with closing(sqlite3.connect(dbfile)) as connection:
+            busy, _log_frames, _checkpointed_frames = connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    except sqlite3.Error as exc:
+        logger.warning("Unable to checkpoint database %s: %s", dbfile, exc)
+        return False
+    if busy:
+        logger.debug("Database %s is busy, the write-ahead log is not checkpointed", dbfile)
+    return get_wal_size(dbfile) == 0
+
+
+class ReadOnlyPool:
+    """Read-only connections to a database for work outside of the main thread.
+
+    Each worker thread has its own connection, opened with a read-only URI. With the
+    write-ahead log the workers and the main connection don't block each other. The
+    queries should return plain rows, like dicts() or tuples(). Model instances would
+    load related rows through the main connection.
+    """
+
+    def __init__(self, dbfile: str, workers: int = READ_POOL_WORKERS):
+        if dbfile == ":memory:":
+            raise ValueError("An in-memory database can't be opened by another connection")
+        uri, pragmas = get_read_only_args(dbfile)
+        # The connections are only closed from another thread when the workers are done.
+        self.database = peewee.SqliteDatabase(uri, uri=True, check_same_thread=False, pragmas=pragmas)
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="pigeonplanner-db", initializer=self._connect
+        )
+
+    def _connect(self):
+        self.database.connect()
+        with self._lock:
+            self._connections.append(self.database.connection())
+
+    def submit(self, func: Callable, *args) -> Future:
+        """Call func(database, *args) on a worker with the read-only peewee database"""
+        return self._executor.submit(func, self.database, *args)
+
+    def select(self, query: peewee.SelectBase) -> Future:
+        """Run the query on a worker, the result of the future is the list of rows"""
+        return self.submit(_fetch_all, query)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+def _fetch_all(database: peewee.Database, query: peewee.SelectBase) -> list:
+    # Leave the query of the caller untouched, it caches its results.
+    return list(query.clone().execute(database))
+
+
 class DatabaseSession:
     def __init__(self):
         self.dbfile = None
         self.is_new_db = None
+        self._read_pool = None
 
     def open(self, dbfile: str = None):
         self.dbfile = dbfile or const.DATABASE
@@ -49,8 +222,10 @@ class DatabaseSession:
         logger.debug("Opening database %s (new db=%s)", self.dbfile, self.is_new_db)
         models.database.init(self.dbfile)
         models.database.connect()
-        # Set this explicitly to work with ON DELETE/UPDATE
-        models.database.pragma("foreign_keys", 1)
+        # Foreign keys are set explicitly to work with ON DELETE/UPDATE
+        for key, value in get_pragmas(self.dbfile):
+            models.database.pragma(key, value)
+        self.set_journal_mode()
 
         if self.is_new_db:
             logger.debug("Creating tables for the new database")
@@ -63,9 +238,34 @@ class DatabaseSession:
 
     def close(self):
         logger.debug("Closing database %s", self.dbfile)
+        if self._read_pool is not None:
+            self._read_pool.close()
+            self._read_pool = None
         models.database.close()
         self.dbfile = None
 
+    def set_journal_mode(self):
+        """Use the write-ahead log when possible. Readers and the writer don't block each other
+        and a transaction only needs a full sync at a checkpoint instead of at each commit.
+        Otherwise, also for a database that used the log before, the rollback journal is used
+        with full syncs.
+        """
+        journal_mode = None
+        if self.dbfile != ":memory:":
+            wanted = "WAL" if can_use_wal(self.dbfile) else "DELETE"
+            try:
+                journal_mode = models.database.pragma("journal_mode", wanted)
+            except peewee.OperationalError as exc:
+                logger.warning("Unable to set the journal mode to %s: %s", wanted, exc)
+        models.database.pragma("synchronous", "NORMAL" if journal_mode == "wal" else "FULL")
+        logger.debug("Database journal mode is %s", journal_mode)
+
+    def get_read_pool(self) -> ReadOnlyPool:
+        """Get the pool of read-only connections to the open database, it's created on first use"""
+        if self._read_pool is None:
+            self._read_pool = ReadOnlyPool(self.dbfile)
+        return self._read_pool
+
     # noinspection PyMethodMayBeStatic
     def is_open(self) -> bool:
         return not models.database.is_closed()
@@ -94,7 +294,7 @@ class DatabaseSession:
         # Make a backup of the database before migrating to restore it in
         # case an unexpected error happens during upgrade.
         backupdb = self.dbfile + "_bckp"
-        shutil.copy(self.dbfile, backupdb)
+        copy_database(self.dbfile, backupdb)
 
         for migration in migrations.get_migrations():
             if migration["version"] <= current_version:
@@ -105,7 +305,7 @@ class DatabaseSession:
             except Exception:
                 # Catch any exception during migration!
                 logger.error("Database migration failed!", exc_info=True)
-                shutil.copy(backupdb, self.dbfile)
+                copy_database(backupdb, self.dbfile)
                 os.remove(backupdb)
                 raise DatabaseMigrationError
 
@@ -27,6 +27,7 @@ from typing import List, Dict, Optional, Any
 from pigeonplanner.core import const
 from pigeonplanner.core import common
 from pigeonplanner.database import session
+from pigeonplanner.database.main import JOURNAL_SUFFIXES, checkpoint_database
 
 
 logger = logging.getLogger(__name__)
@@ -214,7 +215,7 @@ class DBManager:
 
         if dbobj.path != path:
             try:
-                shutil.move(dbobj.path, path)
+                self._move_database(dbobj.path, path)
             except (shutil.Error, IOError) as exc:
                 # Don't raise errno.ENOENT (No such file or directory)
                 # This means the user changes the location of a database that doesn't exist.
@@ -230,19 +231,21 @@ class DBManager:
     def delete(self, dbobj: DatabaseInfo):
         self.close_database()
 
-        try:
-            os.remove(dbobj.path)
-        except OSError as exc:
-            if exc.errno == errno.ENOENT:
-                # The database doesn't exist, no need to report this
-                pass
-            elif exc.errno == errno.EACCES:
-                # Permission denied, the path is not writable. Report back that
-                # the database isn't removed.
-                raise DatabaseOperationError(_("Unable to remove the database: permission denied"))
-            else:
-                # None of our special cases, raise the original exception
-                raise
+        # Also remove the write-ahead log and journal files, they belong to this database only
+        for path in [dbobj.path] + [dbobj.path + suffix for suffix in JOURNAL_SUFFIXES]:
+            try:
+                os.remove(path)
+            except OSError as exc:
+                if exc.errno == errno.ENOENT:
+                    # The database doesn't exist, no need to report this
+                    pass
+                elif exc.errno == errno.EACCES:
+                    # Permission denied, the path is not writable. Report back that
+                    # the database isn't removed.
+                    raise DatabaseOperationError(_("Unable to remove the database: permission denied"))
+                else:
+                    # None of our special cases, raise the original exception
+                    raise
 
         # Always update the config file
         self._dbs.remove(dbobj)
@@ -266,7 +269,12 @@ class DBManager:
                 break
 
         new_db_path = self._get_new_db_path(os.path.dirname(dbobj.path))
+        checkpoint_database(dbobj.path)
         shutil.copy(dbobj.path, new_db_path)
+        # The log of a busy database and a journal that wasn't rolled back yet are part of the copy
+        for suffix in ("-wal", "-journal"):
+            if os.path.exists(dbobj.path + suffix):
+                shutil.copy(dbobj.path + suffix, new_db_path + suffix)
 
         info = DatabaseInfo(name, new_db_path, description, False)
         self._dbs.append(info)
@@ -277,13 +285,22 @@ class DBManager:
         filename = os.path.basename(dbobj.path)
         destination = os.path.join(new_path, filename)
         try:
-            shutil.move(dbobj.path, destination)
+            self._move_database(dbobj.path, destination)
         except (shutil.Error, IOError) as exc:
             raise DatabaseOperationError(_("Moving the database failed with message:\n%s") % exc)
         dbobj.path = destination
         self.save()
         return dbobj
 
+    # noinspection PyMethodMayBeStatic
+    def _move_database(self, source: str, destination: str):
+        # Committed changes can still be in the write-ahead log after an unclean close
+        checkpoint_database(source)
+        shutil.move(source, destination)
+        for suffix in JOURNAL_SUFFIXES:
+            if os.path.exists(source + suffix):
+                shutil.move(source + suffix, destination + suffix)
+
     # noinspection PyMethodMayBeStatic
     def close_database(self):
         try:
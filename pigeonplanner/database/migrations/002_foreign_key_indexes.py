@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Make sure every foreign key has an index and add an index to find the results of a racepoint.
+
+Offspring lookups and the checks for ON DELETE actions search the referencing
+column. Databases created by Pigeon Planner already have the foreign key indexes,
+they're only added when missing.
+"""
+
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+database_version = 4
+
+# Table, column and the index name as it's created for a new database
+INDEXES = [
+    ("pigeon", "sire_id", "pigeon_sire_id"),
+    ("pigeon", "dam_id", "pigeon_dam_id"),
+    ("result", "pigeon_id", "result_pigeon_id"),
+    ("result", "racepoint", "result_racepoint"),
+    ("image", "pigeon_id", "image_pigeon_id"),
+    ("media", "pigeon_id", "media_pigeon_id"),
+    ("breeding", "sire_id", "breeding_sire_id"),
+    ("breeding", "dam_id", "breeding_dam_id"),
+    ("breeding", "child1_id", "breeding_child1_id"),
+    ("breeding", "child2_id", "breeding_child2_id"),
+    ("status", "partner_id", "status_partner_id"),
+    ("medication_pigeon_through", "pigeon_id", "medicationpigeonthrough_pigeon_id"),
+    ("medication_pigeon_through", "medication_id", "medicationpigeonthrough_medication_id"),
+]
+
+
+def do_migration(db):
+    tables = db.get_tables()
+    with db.atomic():
+        for table, column, index in INDEXES:
+            if table not in tables:
+                continue
+            logger.info("Adding index %s", index)
+            db.execute_sql('CREATE INDEX IF NOT EXISTS "%s" ON "%s" ("%s")' % (index, table, column))
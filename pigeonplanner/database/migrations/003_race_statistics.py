@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Add the table with the race statistics of each pigeon and season and aggregate it from the results.
+"""
+
+
+import logging
+
+from pigeonplanner.core import racestats
+
+logger = logging.getLogger(__name__)
+
+database_version = 5
+
+
+def do_migration(db):  # noqa
+    logger.info("Adding the race statistics table")
+    racestats.rebuild()
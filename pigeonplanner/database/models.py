@@ -16,11 +16,11 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 import os
-from typing import List, Callable, Optional, Union
+from typing import List, Dict, Iterable, Callable, Optional, Union
 
 from pigeonplanner.core import enums
 
-from peewee import SqliteDatabase
+from peewee import SqliteDatabase, chunked
 from peewee import (
     Check,
     ForeignKeyField,
@@ -95,8 +95,12 @@ class BaseModel(Model):
     def update_and_return(self, **kwargs) -> "BaseModel":
         cls = self.__class__
         update_query = cls.update(**kwargs).where(cls.id == self.id)
+        # An update query doesn't send any signals, do it here to behave like save()
+        pre_save.send(self, created=False)
         update_query.execute()
-        return cls.get(cls.id == self.id)
+        instance = cls.get(cls.id == self.id)
+        post_save.send(instance, created=False)
+        return instance
 
     @classmethod
     def get_fields_with_defaults(cls) -> dict:
@@ -176,17 +180,47 @@ class Pigeon(BaseModel):
             & (cls.band_year == year)
         )
 
-    @property
-    def band(self) -> str:
+    @classmethod
+    def get_for_band_numbers(cls, number_years: Iterable[tuple]) -> Dict[tuple, "Pigeon"]:
+        """Get the pigeons without a country and letters for many bands with a minimal number of queries.
+
+        :param number_years: iterable of (number, year) tuples
+        :returns: a dictionary of (number, year) to Pigeon for each band that exists
+        """
+        wanted = set(number_years)
+        numbers = list({number for number, _year in wanted})
+        pigeons = {}
+        # Stay below the SQLite limit on the number of variables in a query.
+        for chunk in chunked(numbers, 900):
+            query = cls.select().where(
+                (cls.band_country == "") & (cls.band_letters == "") & (cls.band_number.in_(chunk))
+            )
+            for pigeon in query:
+                key = (pigeon.band_number, pigeon.band_year)
+                if key in wanted:
+                    pigeons[key] = pigeon
+        return pigeons
+
+    @staticmethod
+    def format_band(band_format: str, country: str, letters: str, number: str, year: str) -> str:
+        """Format the band parts without the need of a Pigeon instance. This is used when
+        building rows from plain query tuples.
+        """
         values = {
-            "country": self.band_country,
-            "letters": self.band_letters,
-            "number": self.band_number,
-            "year": self.band_year,
-            "year_short": self.band_year[2:],
+            "country": country,
+            "letters": letters,
+            "number": number,
+            "year": year,
+            "year_short": year[2:],
             "empty": "",
         }
-        return self.band_format.format(**values)  # noqa
+        return band_format.format(**values)
+
+    @property
+    def band(self) -> str:
+        return self.format_band(
+            self.band_format, self.band_country, self.band_letters, self.band_number, self.band_year  # noqa
+        )
 
     @property
     def band_tuple(self) -> tuple:
@@ -243,6 +277,28 @@ class Pigeon(BaseModel):
             return None
 
 
+class PigeonAncestry(BaseModel):
+    """Closure table with a row for each ancestor of a pigeon. The path_count holds the number of
+    different lines through which the ancestor appears at this depth. Plain integer columns are used
+    instead of foreign keys to be able to update the table after a pigeon is deleted.
+    """
+
+    ancestor_id = IntegerField()
+    descendant_id = IntegerField()
+    depth = IntegerField()
+    path_count = IntegerField(default=1)
+
+    class Meta:
+        table_name = "pigeon_ancestry"
+        indexes = (
+            (("ancestor_id", "descendant_id", "depth"), True),
+            (("descendant_id", "depth"), False),
+        )
+
+    def __repr__(self):
+        return "<PigeonAncestry %s -> %s (%s)>" % (self.ancestor_id, self.descendant_id, self.depth)
+
+
 class Status(BaseModel):
     pigeon = ForeignKeyField(Pigeon, unique=True, backref="statuses", on_delete="CASCADE")
     status_id = IntegerField(default=enums.Status.active)
@@ -303,6 +359,7 @@ class Result(BaseModel):
         table_name = "result"
         indexes = (
             (("date", "racepoint"), False),
+            (("racepoint",), False),
             (("pigeon", "date", "racepoint", "place", "out", "category", "sector"), True),
         )
 
@@ -310,6 +367,33 @@ class Result(BaseModel):
         return "<Result %s for %s>" % (self.id, self.pigeon.band)
 
 
+class PigeonSeasonStats(BaseModel):
+    """Aggregated results of a pigeon for one season, maintained by core.racestats. The place
+    ratios are stored instead of coefficients so they don't depend on the coefficient multiplier.
+    """
+
+    pigeon = ForeignKeyField(Pigeon, backref="season_stats", on_delete="CASCADE")
+    season = IntegerField()
+    races = IntegerField(default=0)
+    prizes = IntegerField(default=0)
+    place_ratio_sum = FloatField(default=0.0)
+    best_place_ratio = FloatField(null=True)
+    distance = FloatField(default=0.0)
+    speed_sum = FloatField(default=0.0)
+    speed_count = IntegerField(default=0)
+    ace_points = FloatField(default=0.0)
+
+    class Meta:
+        table_name = "pigeon_season_stats"
+        indexes = (
+            (("pigeon", "season"), True),
+            (("season", "ace_points"), False),
+        )
+
+    def __repr__(self):
+        return "<PigeonSeasonStats %s for %s>" % (self.season, self.pigeon_id)
+
+
 class Breeding(BaseModel):
     sire = ForeignKeyField(Pigeon, backref="breeding_sire", on_delete="CASCADE")
     dam = ForeignKeyField(Pigeon, backref="breeding_dam", on_delete="CASCADE")
@@ -23,6 +23,8 @@ def get_exporters():
     global _exporters
     if _exporters is None:
         from .exportcsv import ExportCSV
+        from .exportjsonlines import ExportJSONLines
+        from .exportsqlite import ExportSQLite
 
-        _exporters = [ExportCSV]
+        _exporters = [ExportCSV, ExportJSONLines, ExportSQLite]
     return _exporters
@@ -30,33 +30,11 @@ class ExportCSV:
     filefilter = ("CSV", "*.csv")
 
     @classmethod
-    def run(cls, filepath, pigeons):
+    def run(cls, filepath, pigeon_ids=None):
+        """Export the pigeons with these ids, or all pigeons if None"""
         with open(filepath, "w", encoding="utf-8") as output:
-            writer = csv.DictWriter(output, dialect=csv.excel, quoting=csv.QUOTE_ALL, fieldnames=utils.COLS_PIGEON)
+            writer = csv.DictWriter(
+                output, dialect=csv.excel, quoting=csv.QUOTE_ALL, fieldnames=utils.COLS_PIGEON, extrasaction="ignore"
+            )
             writer.writerow(dict((name, name) for name in utils.COLS_PIGEON))
-            for pigeon in pigeons:
-                writer.writerow(
-                    {
-                        "band": pigeon.band,
-                        "country": pigeon.band_country,
-                        "letters": pigeon.band_letters,
-                        "number": pigeon.band_number,
-                        "year": pigeon.band_year,
-                        "sex": pigeon.sex,
-                        "visible": pigeon.visible,
-                        "status": pigeon.status_id,
-                        "colour": pigeon.colour,
-                        "name": pigeon.name,
-                        "strain": pigeon.strain,
-                        "loft": pigeon.loft,
-                        "image": "" if pigeon.main_image is None else pigeon.main_image,
-                        "sire": "" if pigeon.sire is None else pigeon.sire.band,
-                        "dam": "" if pigeon.dam is None else pigeon.dam.band,
-                        "extra1": pigeon.extra1,
-                        "extra2": pigeon.extra2,
-                        "extra3": pigeon.extra3,
-                        "extra4": pigeon.extra4,
-                        "extra5": pigeon.extra5,
-                        "extra6": pigeon.extra6,
-                    }
-                )
+            writer.writerows(utils.iter_pigeon_rows(pigeon_ids))
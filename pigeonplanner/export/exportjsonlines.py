@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+
+import json
+
+from . import utils
+
+
+__all__ = ["ExportJSONLines"]
+
+
+class ExportJSONLines:
+    name = "JSON Lines"
+    extension = ".jsonl"
+    filefilter = ("JSON Lines", "*.jsonl")
+
+    @classmethod
+    def run(cls, filepath, pigeon_ids=None):
+        """Export the pigeons with these ids, or all pigeons if None. Each line holds one pigeon."""
+        with open(filepath, "w", encoding="utf-8") as output:
+            for row in utils.iter_pigeon_rows(pigeon_ids):
+                pigeon = {name: row[name] for name in utils.COLS_PIGEON}
+                output.write(json.dumps(pigeon, ensure_ascii=False))
+                output.write("\n")
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Export a selection of pigeons to a new Pigeon Planner database.
+
+The new database is attached to the open one and all rows are copied with
+INSERT ... SELECT statements, so the rows never pass through Python.
+"""
+
+
+import os
+import logging
+
+import peewee
+
+from pigeonplanner.database import models
+from pigeonplanner.database.models import (
+    Breeding,
+    Image,
+    Media,
+    Medication,
+    Pigeon,
+    PigeonAncestry,
+    PigeonMedication,
+    PigeonSeasonStats,
+    Result,
+    Status,
+    database,
+)
+
+
+__all__ = ["ExportSQLite"]
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "subset"
+IDS_TABLE = "temp.export_pigeon_ids"
+
+
+class ExportSQLite:
+    name = _("Pigeon Planner database")
+    extension = ".db"
+    filefilter = (_("Pigeon Planner database"), "*.db")
+
+    @classmethod
+    def run(cls, filepath, pigeon_ids=None):
+        """Export the pigeons with these ids, or all pigeons if None, together with their
+        ancestors, statuses, images, media, results, medication and breeding records.
+        All data like colours, lofts and racepoints is copied as well, addresses aren't.
+        """
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        cls._create_schema(filepath)
+
+        database.execute_sql("ATTACH DATABASE ? AS %s" % SCHEMA, (filepath,))
+        try:
+            with database.atomic():
+                # The pigeons reference each other as sire and dam, check this when all are copied.
+                database.execute_sql("PRAGMA defer_foreign_keys = 1")
+                cls._collect_pigeon_ids(pigeon_ids)
+                cls._copy_rows()
+                database.execute_sql("DROP TABLE %s" % IDS_TABLE)
+        finally:
+            database.execute_sql("DETACH DATABASE %s" % SCHEMA)
+
+    @classmethod
+    def _create_schema(cls, filepath):
+        tables = [model for model in models.all_tables() if model.table_exists()]
+        subset_database = peewee.SqliteDatabase(filepath)
+        # All tables are given, binding the related models as well would rebind them wrongly on exit.
+        with subset_database.bind_ctx(tables, bind_refs=False, bind_backrefs=False):
+            subset_database.create_tables(tables)
+        subset_database.pragma("user_version", database.pragma("user_version"))
+        subset_database.close()
+
+    @classmethod
+    def _collect_pigeon_ids(cls, pigeon_ids):
+        database.execute_sql("CREATE TEMP TABLE %s (id INTEGER PRIMARY KEY)" % IDS_TABLE)
+        if pigeon_ids is None:
+            database.execute_sql("INSERT INTO %s SELECT id FROM pigeon" % IDS_TABLE)
+            return
+        sql = "INSERT OR IGNORE INTO %s VALUES (?)" % IDS_TABLE
+        database.cursor().executemany(sql, ((pigeon_id,) for pigeon_id in pigeon_ids))
+        # Add all ancestors, a pedigree in the new database is as complete as in this one.
+        database.execute_sql(
+            "WITH RECURSIVE ancestors(id) AS ("
+            " SELECT id FROM {ids}"
+            " UNION"
+            " SELECT parent.id FROM pigeon AS parent"
+            " JOIN pigeon AS child ON parent.id IN (child.sire_id, child.dam_id)"
+            " JOIN ancestors ON child.id = ancestors.id"
+            ") INSERT OR IGNORE INTO {ids} SELECT id FROM ancestors".format(ids=IDS_TABLE)
+        )
+
+    @classmethod
+    def _copy_rows(cls):
+        for model in models.all_tables():
+            if isinstance(model, type) and issubclass(model, models.DataModelMixin):
+                cls._copy(model)
+
+        cls._copy(Pigeon, cls._in_subset(Pigeon.id))
+        for model in (Status, Image, Media, Result):
+            cls._copy(model, cls._in_subset(model.pigeon))
+        # Optional tables
+        for field in (PigeonAncestry.descendant_id, PigeonSeasonStats.pigeon):
+            if field.model.table_exists():
+                cls._copy(field.model, cls._in_subset(field))
+        cls._copy(Breeding, "%s AND %s" % (cls._in_subset(Breeding.sire), cls._in_subset(Breeding.dam)))
+        cls._copy(PigeonMedication, cls._in_subset(PigeonMedication.pigeon))
+        cls._copy(
+            Medication,
+            "id IN (SELECT %s FROM %s.%s)"
+            % (PigeonMedication.medication.column_name, SCHEMA, PigeonMedication._meta.table_name),
+        )
+
+        # References to pigeons that are not exported
+        cls._clear_references(Status, Status.partner)
+        cls._clear_references(Breeding, Breeding.child1)
+        cls._clear_references(Breeding, Breeding.child2)
+
+    @classmethod
+    def _in_subset(cls, field):
+        return "%s IN (SELECT id FROM %s)" % (field.column_name, IDS_TABLE)
+
+    @classmethod
+    def _copy(cls, model, where=None):
+        table = model._meta.table_name
+        # Name the columns, migrated databases may have them in another order.
+        columns = ", ".join('"%s"' % field.column_name for field in model._meta.sorted_fields)
+        sql = "INSERT INTO %s.%s (%s) SELECT %s FROM main.%s" % (SCHEMA, table, columns, columns, table)
+        if where is not None:
+            sql += " WHERE " + where
+        cursor = database.execute_sql(sql)
+        logger.debug("Exported %s row(s) of %s", cursor.rowcount, table)
+
+    @classmethod
+    def _clear_references(cls, model, field):
+        column = field.column_name
+        database.execute_sql(
+            "UPDATE {schema}.{table} SET {column} = NULL "
+            "WHERE {column} IS NOT NULL AND {column} NOT IN (SELECT id FROM {schema}.pigeon)".format(
+                schema=SCHEMA, table=model._meta.table_name, column=column
+            )
+        )
@@ -16,6 +16,12 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 
+import peewee
+
+from pigeonplanner.core import enums
+from pigeonplanner.database.models import Pigeon, Status, Image, database
+
+
 COLS_PIGEON = (
     "band",
     "country",
@@ -39,3 +45,108 @@ COLS_PIGEON = (
     "extra5",
     "extra6",
 )
+
+# Temporary table with the ids of the pigeons to export in the wanted order
+_order_table = peewee.Table("export_order", ("position", "pigeon_id"), schema="temp")
+
+
+def iter_pigeon_rows(pigeon_ids=None):
+    """Yield a dictionary with the values of COLS_PIGEON for each pigeon. The status, main image,
+    sire and dam are joined in, so no Pigeon objects are created and nothing is fetched per pigeon.
+
+    :param pigeon_ids: Optional. List of pigeon ids, the rows are yielded in the same order.
+                       All pigeons are exported when this is None.
+    """
+    if pigeon_ids is None:
+        yield from _query_pigeon_rows()
+        return
+
+    # The ids are joined from a temporary table instead of a long list in the query. This keeps
+    # the order without holding the rows in memory.
+    database.execute_sql("CREATE TEMP TABLE export_order (position INTEGER PRIMARY KEY, pigeon_id INTEGER)")
+    try:
+        database.cursor().executemany("INSERT INTO temp.export_order VALUES (?, ?)", enumerate(pigeon_ids))
+        yield from _query_pigeon_rows(ordered=True)
+    finally:
+        database.execute_sql("DROP TABLE temp.export_order")
+
+
+def _query_pigeon_rows(ordered=False):
+    sire = Pigeon.alias()
+    dam = Pigeon.alias()
+    query = (
+        Pigeon.select(
+            Pigeon.id,
+            Pigeon.band_format,
+            Pigeon.band_country,
+            Pigeon.band_letters,
+            Pigeon.band_number,
+            Pigeon.band_year,
+            Pigeon.sex,
+            Pigeon.visible,
+            Status.status_id,
+            Pigeon.colour,
+            Pigeon.name,
+            Pigeon.strain,
+            Pigeon.loft,
+            Image.path,
+            sire.band_format,
+            sire.band_country,
+            sire.band_letters,
+            sire.band_number,
+            sire.band_year,
+            dam.band_format,
+            dam.band_country,
+            dam.band_letters,
+            dam.band_number,
+            dam.band_year,
+            Pigeon.extra1,
+            Pigeon.extra2,
+            Pigeon.extra3,
+            Pigeon.extra4,
+            Pigeon.extra5,
+            Pigeon.extra6,
+        )
+        .join(Status, peewee.JOIN.LEFT_OUTER, on=(Status.pigeon == Pigeon.id))
+        .switch(Pigeon)
+        .join(Image, peewee.JOIN.LEFT_OUTER, on=((Image.pigeon == Pigeon.id) & (Image.main == True)))  # noqa
+        .switch(Pigeon)
+        .join(sire, peewee.JOIN.LEFT_OUTER, on=(Pigeon.sire == sire.id))
+        .switch(Pigeon)
+        .join(dam, peewee.JOIN.LEFT_OUTER, on=(Pigeon.dam == dam.id))
+    )
+    if ordered:
+        query = query.switch(Pigeon).join(_order_table, on=(Pigeon.id == _order_table.pigeon_id))
+        query = query.order_by(_order_table.position)
+
+    # Read the rows from the cursor directly, only the visible flag needs a conversion.
+    for row in database.execute(query):
+        pigeon_id, band_format, country, letters, number, year, sex, visible, status_id = row[:9]
+        colour, name, strain, loft, image = row[9:14]
+        sire_band = row[14:19]
+        dam_band = row[19:24]
+        extra = row[24:30]
+        yield {
+            "id": pigeon_id,
+            "band": Pigeon.format_band(band_format, country, letters, number, year),
+            "country": country,
+            "letters": letters,
+            "number": number,
+            "year": year,
+            "sex": sex,
+            "visible": bool(visible),
+            "status": enums.Status.active if status_id is None else status_id,
+            "colour": colour,
+            "name": name,
+            "strain": strain,
+            "loft": loft,
+            "image": image or "",
+            "sire": "" if sire_band[0] is None else Pigeon.format_band(*sire_band),
+            "dam": "" if dam_band[0] is None else Pigeon.format_band(*dam_band),
+            "extra1": extra[0],
+            "extra2": extra[1],
+            "extra3": extra[2],
+            "extra4": extra[3],
+            "extra5": extra[4],
+            "extra6": extra[5],
+        }
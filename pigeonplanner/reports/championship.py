@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+from pigeonplanner.reports.common import HelperMethods
+from pigeonplanner.reportlib.basereport import Report, ReportOptions
+from pigeonplanner.reportlib.styles import (
+    ParagraphStyle,
+    FontStyle,
+    TableStyle,
+    TableCellStyle,
+    FONT_SANS_SERIF,
+    PAPER_PORTRAIT,
+    PARA_ALIGN_LEFT,
+)
+
+
+class ChampionshipReport(Report, HelperMethods):
+    def __init__(self, reportopts, data, userinfo):
+        """
+        :param data: a tuple of the formula, the group fields and the rankings as returned
+                     by core.championship.get_rankings()
+        """
+        Report.__init__(self, "Championship", reportopts)
+
+        self._formula, self._group_by, self._rankings = data
+        self._userinfo = userinfo
+
+    def write_report(self):
+        self.add_header()
+
+        group_names = {"season": _("Season"), "category": _("Category"), "sector": _("Sector")}
+        # The latest season first
+        for group in sorted(self._rankings, reverse=True):
+            title = ", ".join(
+                "%s: %s" % (group_names[field], value) for field, value in zip(self._group_by, group) if value != ""
+            )
+            self.doc.start_paragraph("title")
+            self.doc.write_text("%s - %s" % (title, self._formula.get_name()))
+            self.doc.end_paragraph()
+
+            self.doc.start_table("my_table", "table")
+            self.doc.start_row()
+            for name in (_("Rank"), _("Band no."), _("Races"), _("Prizes"), _("Total")):
+                self.add_cell(name, "headercell", "colheader")
+            self.doc.end_row()
+            for entry in self._rankings[group]:
+                self.doc.start_row()
+                for name in ("rank", "band", "races", "prizes", "valuestr"):
+                    self.add_cell(str(entry[name]), "cell", "celltext")
+                self.doc.end_row()
+            self.doc.end_table()
+
+
+class ChampionshipReportOptions(ReportOptions):
+    def set_values(self):
+        self.orientation = PAPER_PORTRAIT
+        self.margins = {"lmargin": 1.0, "rmargin": 1.0, "tmargin": 1.0, "bmargin": 1.0}
+
+    def make_default_style(self, default_style):
+        font = FontStyle()
+        font.set(face=FONT_SANS_SERIF, size=12)
+        para = ParagraphStyle()
+        para.set(font=font, align=PARA_ALIGN_LEFT, bborder=1, bmargin=0.5)
+        default_style.add_paragraph_style("header", para)
+
+        font = FontStyle()
+        font.set(face=FONT_SANS_SERIF, size=10, bold=1)
+        para = ParagraphStyle()
+        para.set(font=font, align=PARA_ALIGN_LEFT, tmargin=0.5, bmargin=0.2)
+        default_style.add_paragraph_style("title", para)
+
+        font = FontStyle()
+        font.set(face=FONT_SANS_SERIF, size=8, bold=1)
+        para = ParagraphStyle()
+        para.set(font=font)
+        default_style.add_paragraph_style("colheader", para)
+
+        font = FontStyle()
+        font.set(face=FONT_SANS_SERIF, size=7)
+        para = ParagraphStyle()
+        para.set(font=font)
+        default_style.add_paragraph_style("celltext", para)
+
+        table = TableStyle()
+        table.set_width(100)
+        table.set_column_widths([10, 40, 15, 15, 20])
+        default_style.add_table_style("table", table)
+
+        cell = TableCellStyle()
+        cell.set_padding(0.1)
+        cell.set_bottom_border(True)
+        default_style.add_cell_style("headercell", cell)
+
+        cell = TableCellStyle()
+        cell.set_padding(0.1)
+        default_style.add_cell_style("cell", cell)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Pigeon Planner.
+
+# Pigeon Planner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Pigeon Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
+
+"""
+Import result files without the graphical interface.
+
+The files are parsed concurrently in worker processes. Each worker opens a
+read-only connection to the database to match the bands, the results are
+inserted by the main process in a single transaction afterwards. The database models are only imported inside
+the functions, after gettext is installed in the (worker) process.
+"""
+
+
+import os
+import sys
+import glob
+import gettext
+import logging
+import argparse
+import operator
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from yapsy.VersionedPluginManager import VersionedPluginManager
+
+    yapsy_available = True
+    yapsy_logger = logging.getLogger("yapsy")
+    yapsy_logger.setLevel(logging.WARNING)
+except ImportError:
+    yapsy_available = False
+
+from pigeonplanner.core import const
+
+logger = logging.getLogger(__name__)
+
+# Keep the number of variables per insert query below the SQLite limit of 999
+INSERT_CHUNK_SIZE = 50
+
+
+# Process-wide cache of the parser plugins together with the plugin files they were collected from
+_parsers = None
+_parsers_signature = None
+
+
+def _get_plugin_places():
+    return [const.RESULTPARSERDIR, os.path.join(const.PLUGINDIR, "resultparsers")]
+
+
+def _get_plugin_signature(places):
+    signature = set()
+    for place in places:
+        for dirpath, _dirnames, filenames in os.walk(place):
+            for filename in filenames:
+                if not filename.endswith(".yapsy-plugin"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    signature.add((path, os.path.getmtime(path)))
+                except OSError:
+                    continue
+    return frozenset(signature)
+
+
+def find_parsers():
+    """Get all result parser plugins, sorted by name. The plugins are only collected again
+    when a plugin file was added, removed or changed since the previous call.
+    """
+    global _parsers, _parsers_signature
+
+    places = _get_plugin_places()
+    signature = _get_plugin_signature(places)
+    if _parsers is None or signature != _parsers_signature:
+        logger.debug("Collecting result parser plugins")
+        manager = VersionedPluginManager()
+        manager.setPluginPlaces(places)
+        manager.collectPlugins()
+        _parsers = sorted(manager.getAllPlugins(), key=operator.attrgetter("name"))
+        _parsers_signature = signature
+    return list(_parsers)
+
+
+def detect_parser(resultfile, plugins):
+    """Get the first parser plugin that recognises the file, or None"""
+    for plugin in plugins:
+        resultfile.seek(0)
+        try:
+            if plugin.plugin_object.check(resultfile):
+                return plugin
+        except (UnicodeDecodeError, ValueError):
+            continue
+    return None
+
+
+def stream_results(parser, resultfile):
+    """Parse a result file with the parser plugin object. Parsers that support it read
+    the file in a single streaming pass, others are parsed completely first.
+
+    :returns: a tuple of the race data and an iterator of (pigeon, ring, year, place, speed)
+              tuples. The pigeon is None for results that don't match a pigeon, parsers that
+              don't stream only return the matched results.
+    """
+    if hasattr(parser, "stream_file"):
+        return parser.stream_file(resultfile)
+    data, results = parser.parse_file(resultfile)
+    return data, ((pigeon, *result) for pigeon, result in results.items())
+
+
+def speed_to_float(speed) -> float:
+    try:
+        return float(str(speed).replace(",", "."))
+    except ValueError:
+        return 0.0
+
+
+def insert_results(rows) -> int:
+    """Insert the results in a single transaction. Results that already exist are skipped.
+
+    :param rows: list of dictionaries with the Result fields, the pigeon as an id
+    :returns: the number of inserted results
+    """
+    from pigeonplanner.core import racestats
+    from pigeonplanner.database.models import Result, database
+    from peewee import chunked
+
+    inserted = 0
+    with database.atomic():
+        for batch in chunked(rows, INSERT_CHUNK_SIZE):
+            cursor = database.execute(Result.insert_many(batch).on_conflict_ignore())
+            inserted += cursor.rowcount
+        # Bulk inserts don't send the signals that keep the statistics up to date
+        racestats.refresh(racestats.get_key(row["pigeon"], row["date"]) for row in rows)
+    return inserted
+
+
+def collect_files(patterns):
+    """Expand directories and glob patterns to a sorted list of files"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        paths.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(paths)
+
+
+def parse_result_file(path):
+    """Parse one result file. This runs in a worker process.
+
+    :returns: a tuple of the path, the parser name (None if no parser was found), a list of
+              dictionaries with the Result fields for the matched pigeons and the number of
+              results without a matching pigeon, None if the parser doesn't report those
+    """
+    plugins = find_parsers()
+    rows = []
+    unmatched = 0
+    with open(path) as resultfile:
+        plugin = detect_parser(resultfile, plugins)
+        if plugin is None:
+            return path, None, rows, unmatched
+        resultfile.seek(0)
+        if not hasattr(plugin.plugin_object, "stream_file"):
+            unmatched = None
+        data, results = stream_results(plugin.plugin_object, resultfile)
+        for pigeon, _ring, _year, place, speed in results:
+            if pigeon is None:
+                if unmatched is not None:
+                    unmatched += 1
+                continue
+            rows.append(
+                {
+                    "pigeon": pigeon.id,
+                    "date": data["date"],
+                    "racepoint": data["racepoint"].title(),
+                    "place": int(place),
+                    "out": int(data["n_pigeons"]),
+                    "sector": data["sector"].title(),
+                    "category": data["category"].title(),
+                    "speed": speed_to_float(speed),
+                }
+            )
+    return path, plugin.name, rows, unmatched
+
+
+def import_files(dbfile, paths, workers=None):
+    """Parse the files concurrently and insert all matched results at once. The database
+    is only opened for the insert, the workers are forked without an open connection.
+
+    :returns: a dictionary with the summary
+    """
+    summary = {
+        "files": len(paths),
+        "parsed": 0,
+        "unknown": [],
+        "failed": [],
+        "matched": 0,
+        "unmatched": 0,
+        "uncounted": 0,
+        "imported": 0,
+    }
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dbfile,)) as executor:
+        futures = [(path, executor.submit(parse_result_file, path)) for path in paths]
+        for path, future in futures:
+            try:
+                path, parser_name, results, unmatched = future.result()
+            except Exception as exc:
+                logger.error("Failed to parse %s: %s", path, exc)
+                summary["failed"].append(path)
+                continue
+            if parser_name is None:
+                summary["unknown"].append(path)
+                continue
+            logger.debug("Parsed %s with %s, %s result(s) matched", path, parser_name, len(results))
+            summary["parsed"] += 1
+            summary["matched"] += len(results)
+            if unmatched is None:
+                summary["uncounted"] += 1
+            else:
+                summary["unmatched"] += unmatched
+            rows.extend(results)
+
+    from pigeonplanner.database import session
+
+    session.open(dbfile)
+    try:
+        summary["imported"] = insert_results(rows)
+    finally:
+        session.close()
+    return summary
+
+
+def _install_gettext():
+    import builtins
+
+    if not hasattr(builtins, "_"):
+        gettext.install(const.DOMAIN, const.LANGDIR)
+
+
+def _init_worker(dbfile):
+    _install_gettext()
+    from pigeonplanner.database.main import get_read_only_args
+    from pigeonplanner.database.models import database
+
+    # The parsers only look up pigeons, the connection is opened on the first query.
+    uri, pragmas = get_read_only_args(dbfile)
+    database.init(uri, uri=True, pragmas=pragmas)
+
+
+def run(args=None):
+    parser = argparse.ArgumentParser(description="Import result files into a Pigeon Planner database.")
+    parser.add_argument("database", help="path to the database file")
+    parser.add_argument("files", nargs="+", help="result files, directories or glob patterns")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument(
+        "-d", "--debug", action="store_true", dest="debug", help="Print debug messages to the console"
+    )
+    cmdline_args = parser.parse_args(args)
+
+    logging.basicConfig(
+        format=const.LOG_FORMAT_CLI, level=logging.DEBUG if cmdline_args.debug else logging.WARNING
+    )
+    _install_gettext()
+
+    if not yapsy_available:
+        logger.error("Yapsy is needed to import results.")
+        return 1
+    if not os.path.isfile(cmdline_args.database):
+        logger.error("Database %s does not exist.", cmdline_args.database)
+        return 1
+    paths = collect_files(cmdline_args.files)
+    if not paths:
+        logger.error("No result files found.")
+        return 1
+
+    from pigeonplanner.database import session
+    from pigeonplanner.database.main import DatabaseVersionError
+
+    try:
+        session.open(cmdline_args.database)
+        needs_update = session.needs_update()
+    except DatabaseVersionError:
+        logger.error("The database is made by a newer version of Pigeon Planner.")
+        return 1
+    finally:
+        session.close()
+    if needs_update:
+        logger.error("The database needs to be updated. Open it in Pigeon Planner first.")
+        return 1
+    summary = import_files(cmdline_args.database, paths, cmdline_args.workers)
+
+    print_summary(summary)
+    return 0
+
+
+def print_summary(summary):
+    num_unknown = len(summary["unknown"])
+    num_failed = len(summary["failed"])
+    print("Files: %s parsed, %s unknown format, %s failed" % (summary["parsed"], num_unknown, num_failed))
+    for path in summary["unknown"]:
+        print("  Unknown format: %s" % path)
+    for path in summary["failed"]:
+        print("  Failed: %s" % path)
+    num_skipped = summary["matched"] - summary["imported"]
+    print("Results: %s imported, %s skipped (already existing)" % (summary["imported"], num_skipped))
+    # Parsers that don't stream the file don't report the results without a matching pigeon
+    if summary["uncounted"] < summary["parsed"]:
+        line = "Results without a matching pigeon: %s" % summary["unmatched"]
+        if summary["uncounted"]:
+            line += " (unknown for %s file(s))" % summary["uncounted"]
+        print(line)
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -17,12 +17,18 @@
 
 
 import datetime
+import itertools
 
 from yapsy.IPlugin import IPlugin
 
 from pigeonplanner.core import const
 from pigeonplanner.database.models import Pigeon
 
+# The format is recognised from the first lines, the file is never read completely for this.
+HEADER_LINES = 10
+# Number of result lines of which the bands are looked up at once
+MATCH_CHUNK_SIZE = 500
+
 
 def expand_year(year):
     if len(year) == 4:
@@ -32,18 +38,37 @@ def expand_year(year):
 
 class DTDParser(IPlugin):
     def check(self, resultfile):
-        for line in resultfile:
+        for line in itertools.islice(resultfile, HEADER_LINES):
             line = line.lower()
             if "data technology-deerlijk" in line or "data technology deerlijk" in line:
                 return True
         return False
 
     def parse_file(self, resultfile):
-        data = {"sector": "", "category": "", "n_pigeons": "", "date": "", "racepoint": ""}
+        data, records = self.stream_file(resultfile)
         results = {}
+        for pigeon, ring, year, place, speed in records:
+            if pigeon is not None:
+                results[pigeon] = [ring, year, str(place), speed]
+        return data, results
+
+    def stream_file(self, resultfile):
+        """Parse the header and return it together with a generator of the result lines.
+        The result lines are only read while the generator is consumed, so the file is
+        read once and large files are never completely in memory.
+
+        :returns: a tuple of the race data and a generator of (pigeon, ring, year, place, speed)
+                  tuples. The pigeon is None if the band isn't in the database.
+        """
+        lines = enumerate(resultfile)
+        data, revindex, lines = self._parse_header(lines)
+        return data, self._iter_results(lines, revindex)
+
+    def _parse_header(self, lines):
+        data = {"sector": "", "category": "", "n_pigeons": "", "date": "", "racepoint": ""}
         firstline = -1
         revindex = -1
-        for linenumber, line in enumerate(resultfile):
+        for linenumber, line in lines:
             # Remove all whitspace
             line = line.strip()
 
@@ -55,6 +80,11 @@ class DTDParser(IPlugin):
             if firstline < 0:
                 firstline = linenumber
 
+            # The header ended without a column line, this is already a result line
+            if linenumber > firstline + 4:
+                lines = itertools.chain([(linenumber, line)], lines)
+                break
+
             # The first line contains:
             #    Name of club      Location of club      DATA TECHNOLOGY-DEERLIJK
             if linenumber == firstline:
@@ -94,7 +124,6 @@ class DTDParser(IPlugin):
                 data["date"] = dt.strftime(const.DATE_FORMAT)
                 # The remaining items before the date form the racepoint
                 data["racepoint"] = " ".join(items[: pigeonsindex - 1])
-                continue
 
             # We parse the lines from the end for easier column detection.
             # Usually the last column is the speed, but in some cases the position
@@ -104,12 +133,24 @@ class DTDParser(IPlugin):
             if linenumber == firstline + 4:
                 if items[-1] == "NR":
                     revindex -= 1
-                continue
-
+                break
+        return data, revindex, lines
+
+    def _iter_results(self, lines, revindex):
+        for chunk in self._iter_chunks(lines, revindex):
+            # Look up the pigeons of a whole chunk at once instead of querying each result line
+            pigeons = Pigeon.get_for_band_numbers((ring, year) for ring, year, _place, _speed in chunk)
+            for ring, year, place, speed in chunk:
+                yield pigeons.get((ring, year)), ring, year, place, speed
+
+    def _iter_chunks(self, lines, revindex):
+        chunk = []
+        for _linenumber, line in lines:
+            items = line.split()
             # Only parse lines that start with a number (place)
             try:
                 place = int(items[0])
-            except ValueError:
+            except (IndexError, ValueError):
                 continue
             speed = items[revindex]
             ring, year = items[revindex - 3], items[revindex - 2]
@@ -117,9 +158,9 @@ class DTDParser(IPlugin):
             if len(year) > 1:
                 ring, year = year[:-2], year[-2:]
             year = expand_year(year)
-            try:
-                pigeon = Pigeon.get_for_band(("", "", ring, year))
-                results[pigeon] = [ring, year, str(place), speed]
-            except Pigeon.DoesNotExist:
-                pass
-        return data, results
+            chunk.append((ring, year, place, speed))
+            if len(chunk) == MATCH_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
@@ -74,17 +74,21 @@ class KDBDParser(IPlugin):
         if found is None:
             raise ValueError("No results found.")
         raw_results = json.loads(found.group(1))
+        # The plugin object is reused, don't keep the results of a previous file
+        self.results = {}
+        lines = []
         for result in raw_results:
             full_ring = result["Ringnummer"]
             ring = full_ring[:-2]
             year = "20%s" % full_ring[-2:]
-            place = result["Plaats"]
-            speed = result["Snelheid"]
-            try:
-                pigeon = Pigeon.get_for_band(("", "", ring, year))
+            lines.append((ring, year, result["Plaats"], result["Snelheid"]))
+
+        # Look up all pigeons at once instead of querying each result
+        pigeons = Pigeon.get_for_band_numbers((ring, year) for ring, year, _place, _speed in lines)
+        for ring, year, place, speed in lines:
+            pigeon = pigeons.get((ring, year))
+            if pigeon is not None:
                 self.results[pigeon] = [ring, year, str(place), speed]
-            except Pigeon.DoesNotExist:
-                pass
 
     def parse_file(self, resultfile):
         html = resultfile.read()
@@ -18,9 +18,11 @@
 import os
 import json
 import logging
+import threading
 from xml.sax.saxutils import escape
 
 from gi.repository import Gtk
+from gi.repository import GLib
 
 from pigeonplanner import messages
 from pigeonplanner.ui import builder
@@ -49,7 +51,7 @@ class BackupDialog(builder.GtkBuilder):
 
         self.widgets.button_fileselect = filechooser.FileChooser()
         self.widgets.button_fileselect.connect("file-set", self.on_button_fileselect_file_set)
-        self.widgets.button_fileselect.add_backup_filter()
+        self.widgets.button_fileselect.add_backup_filter(incremental=True)
         self.widgets.align_fileselect.add(self.widgets.button_fileselect)
 
         self.widgets.selection_dbrestore = self.widgets.treeview_dbrestore.get_selection()
@@ -58,8 +60,11 @@ class BackupDialog(builder.GtkBuilder):
         self.widgets.dialog.show_all()
 
         self.restore_op = None
+        self._backup_running = False
 
     def on_dialog_delete_event(self, _widget, _event):
+        if self._backup_running:
+            return True
         self.widgets.dialog.destroy()
         return False
 
@@ -89,14 +94,38 @@ class BackupDialog(builder.GtkBuilder):
     def on_button_create_clicked(self, _widget):
         save_path = self.widgets.label_savepath.get_text()
         save_config = self.widgets.check_saveconfig.get_active()
+        self._set_backup_running(True)
+        self.widgets.progressbar_create.set_fraction(0.0)
+        self.widgets.progressbar_create.show()
+        backupthread = threading.Thread(None, self._create_backup_thread, None, (save_path, save_config))
+        backupthread.start()
+
+    def _create_backup_thread(self, save_path, save_config):
+        # Only touch the interface from the main thread
+        def progress(fraction):
+            GLib.idle_add(self.widgets.progressbar_create.set_fraction, fraction)
+
         try:
-            backup.create_backup(save_path, overwrite=True, include_config=save_config)
+            backup.create_backup(save_path, overwrite=True, include_config=save_config, progress=progress)
         except Exception as exc:
+            GLib.idle_add(self._create_backup_finished, exc)
+        else:
+            GLib.idle_add(self._create_backup_finished, None)
+
+    def _create_backup_finished(self, exc):
+        self._set_backup_running(False)
+        self.widgets.progressbar_create.hide()
+        if exc is not None:
             msg = (_("There was an error making the backup."), str(exc), _("Failed!"))
             messagedialog.ErrorDialog(msg, self.widgets.dialog)
         else:
             messagedialog.InfoDialog(messages.MSG_BACKUP_SUCCES, self.widgets.dialog)
 
+    def _set_backup_running(self, running):
+        self._backup_running = running
+        for widget in ("button_create", "button_back", "button_close", "button_saveselect", "check_saveconfig"):
+            getattr(self.widgets, widget).set_sensitive(not running)
+
     def on_button_restore_clicked(self, _widget):
         dbobjs = [row[self.LS_RESTORE_DBOBJ] for row in self.widgets.liststoredbrestore if row[self.LS_RESTORE_CHECK]]
         if len(dbobjs) == 0:
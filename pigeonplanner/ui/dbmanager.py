@@ -33,6 +33,8 @@ from pigeonplanner.ui.maildialog import MailDialog
 from pigeonplanner.ui.messagedialog import InfoDialog, QuestionDialog, ErrorDialog
 from pigeonplanner.core import const
 from pigeonplanner.core import common
+from pigeonplanner.core import ancestry
+from pigeonplanner.core import racestats
 from pigeonplanner.database import session
 from pigeonplanner.database.main import DatabaseVersionError, DatabaseMigrationError
 from pigeonplanner.database.models import Pigeon, Racepoint
@@ -146,6 +148,8 @@ class DBManagerWindow(builder.GtkBuilder, GObject.GObject, component.Component):
         self._repair_checkers = [
             PigeonEmptyYearChecker(),
             RacepointUnitChecker(),
+            PigeonAncestryChecker(),
+            RaceStatsChecker(),
         ]
 
         dbmanager.prompt_do_upgrade = self._prompt_do_upgrade
@@ -612,6 +616,9 @@ class PigeonEmptyYearChecker:
         query = Pigeon.delete().where(Pigeon.band_year == "")
         num_repaired = query.execute()
         logger.debug("Database check: PigeonEmptyYearChecker deleted %s row(s)", num_repaired)
+        # The bulk delete bypasses the signal handlers that keep the ancestry table up to date
+        if num_repaired and ancestry.is_enabled():
+            ancestry.rebuild()
         return _("Deleted %s object(s)") % num_repaired
 
 
@@ -625,3 +632,25 @@ class RacepointUnitChecker:
         num_repaired = query.execute()
         logger.debug("Database check: RacepointUnitChecker updated %s row(s)", num_repaired)
         return _("Updated %s object(s)") % num_repaired
+
+
+class PigeonAncestryChecker:
+    def __init__(self):
+        self.description = _("Check the pigeon ancestry table.")
+        self.action = _("Rebuild the table from all sires and dams.")
+
+    def repair(self) -> str:  # noqa
+        num_rows = ancestry.rebuild()
+        logger.debug("Database check: PigeonAncestryChecker rebuilt %s row(s)", num_rows)
+        return _("Rebuilt %s object(s)") % num_rows
+
+
+class RaceStatsChecker:
+    def __init__(self):
+        self.description = _("Check the race statistics table.")
+        self.action = _("Rebuild the table from all results.")
+
+    def repair(self) -> str:  # noqa
+        num_rows = racestats.rebuild()
+        logger.debug("Database check: RaceStatsChecker rebuilt %s row(s)", num_rows)
+        return _("Rebuilt %s object(s)") % num_rows
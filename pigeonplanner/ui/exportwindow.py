@@ -26,7 +26,6 @@ from pigeonplanner.ui import builder
 from pigeonplanner.ui import component
 from pigeonplanner.ui import filechooser
 from pigeonplanner.ui.messagedialog import ErrorDialog
-from pigeonplanner.database.models import Pigeon
 
 logger = logging.getLogger(__name__)
 
@@ -64,19 +63,14 @@ class ExportWindow(builder.GtkBuilder):
 
         treeview = component.get("Treeview")
         if self.widgets.radioselected.get_active():
-            pigeons = treeview.get_selected_pigeon()
-            if pigeons is None:
-                pigeons = []
-            # pigeons can be a list of selected or just one pigeon object.
-            if isinstance(pigeons, Pigeon):
-                pigeons = [pigeons]
+            pigeon_ids = treeview.get_selected_pigeon_ids()
         elif self.widgets.radiovisible.get_active():
-            pigeons = treeview.get_pigeons(True, True)
+            pigeon_ids = treeview.get_pigeon_ids(filtered=True)
         else:
-            pigeons = Pigeon.select()
+            pigeon_ids = None
         exporter = self.__get_exporter()
         try:
-            exporter.run(filepath, pigeons)
+            exporter.run(filepath, pigeon_ids)
         except IOError as e:
             logger.exception(e)
             ErrorDialog((_("The selected path is not writeable."), None, _("Error")), self.widgets.window)
@@ -83,11 +83,15 @@ class _FileChooser:  # Gtk.FileChooser):  # TODO GTK3: why does this fail?
         filter_.add_pattern("*.TXT")
         self.add_filter(filter_)
 
-    def add_backup_filter(self):
+    def add_backup_filter(self, incremental=False):
         filter_ = Gtk.FileFilter()
         filter_.set_name("Zip (.zip)")
         filter_.add_mime_type("zip/zip")
         filter_.add_pattern("*.zip")
+        if incremental:
+            # The manifest file of an incremental backup
+            filter_.set_name(_("Backup (.zip, .json)"))
+            filter_.add_pattern("*.json")
         self.add_filter(filter_)
 
     def add_custom_filter(self, name, *patterns):
@@ -52,7 +52,6 @@ from pigeonplanner.ui.pedigreeprintsetup import setupwindow
 from pigeonplanner.core import enums
 from pigeonplanner.core import const
 from pigeonplanner.core import common
-from pigeonplanner.core import errors
 from pigeonplanner.core import backup
 from pigeonplanner.core import config
 from pigeonplanner.core import pigeon as corepigeon
@@ -255,9 +254,13 @@ class MainWindow(Gtk.ApplicationWindow, builder.GtkBuilder, component.Component)
         if config.get("backup.automatic-backup") and bckp:
             days_in_seconds = config.get("backup.interval") * 24 * 60 * 60
             if time.time() - config.get("backup.last") >= days_in_seconds:
-                save_path = os.path.join(config.get("backup.location"), backup.create_backup_filename())
                 try:
-                    backup.create_backup(save_path, overwrite=True, include_config=True)
+                    if config.get("backup.incremental"):
+                        store_path = os.path.join(config.get("backup.location"), backup.BACKUP_STORE_DIRNAME)
+                        backup.create_incremental_backup(store_path, include_config=True)
+                    else:
+                        save_path = os.path.join(config.get("backup.location"), backup.create_backup_filename())
+                        backup.create_backup(save_path, overwrite=True, include_config=True)
                 except Exception as exc:
                     logger.error(exc)
                     msg = (_("There was an error making the backup."), str(exc), _("Failed!"))
@@ -566,27 +569,9 @@ class MainWindow(Gtk.ApplicationWindow, builder.GtkBuilder, component.Component)
             return
 
         logger.debug("Adding a range of pigeons")
-        value = int(rangefrom)
-        while value <= int(rangeto):
-            band = str(value)
-            data = {
-                "band_number": band,
-                "band_year": rangeyear,
-                "band_country": "",
-                "band_letters": "",
-                "sex": rangesex,
-                "sire": None,
-                "dam": None,
-                "image": None,
-            }
-            logger.debug("Range: adding '%s'", (band, rangeyear))
-            try:
-                pigeon = corepigeon.add_pigeon(data, enums.Status.active, {})
-            except (errors.PigeonAlreadyExists, errors.PigeonAlreadyExistsHidden):
-                value += 1
-                continue
-            self.widgets.treeview.add_pigeon(pigeon)
-            value += 1
+        band_numbers = [str(value) for value in range(int(rangefrom), int(rangeto) + 1)]
+        pigeon_ids = corepigeon.add_pigeons(band_numbers, rangeyear, rangesex)
+        self.widgets.treeview.add_pigeons(pigeon_ids)
 
         self.widgets.rangedialog.hide()
 
@@ -595,8 +580,7 @@ class MainWindow(Gtk.ApplicationWindow, builder.GtkBuilder, component.Component)
 
     # Main treeview callbacks
     def on_treeview_pigeons_changed(self, _widget):
-        pigeons = self.widgets.treeview.get_pigeons(filtered=True)
-        pigeon_count = common.count_active_pigeons(pigeons)
+        pigeon_count = self.widgets.treeview.get_sex_counts()
         self.widgets.labelStatTotal.set_markup("<b>%i</b>" % pigeon_count["total"])
         self.widgets.labelStatCocks.set_markup("<b>%i</b>" % pigeon_count[enums.Sex.cock])
         self.widgets.labelStatHens.set_markup("<b>%i</b>" % pigeon_count[enums.Sex.hen])
@@ -157,6 +157,7 @@ class OptionsDialog(builder.GtkBuilder, GObject.GObject):
             ("backup.automatic-backup", self.widgets.checkbackup.get_active()),
             ("backup.interval", self.widgets.spinday.get_value_as_int()),
             ("backup.location", self.widgets.fcbutton.get_filename()),
+            ("backup.incremental", self.widgets.checkincremental.get_active()),
             ("columns.pigeon-name", self.widgets.chkName.get_active()),
             ("columns.pigeon-band-country", self.widgets.chkCountry.get_active()),
             ("columns.pigeon-colour", self.widgets.chkColour.get_active()),
@@ -209,6 +210,7 @@ class OptionsDialog(builder.GtkBuilder, GObject.GObject):
         self.widgets.checkbackup.set_active(config.get("backup.automatic-backup"))
         self.widgets.spinday.set_value(config.get("backup.interval"))
         self.widgets.fcbutton.set_current_folder(config.get("backup.location"))
+        self.widgets.checkincremental.set_active(config.get("backup.incremental"))
         self.widgets.combodistance.set_active(config.get("options.distance-unit"))
         self.widgets.combospeed.set_active(config.get("options.speed-unit"))
         self.widgets.spincoef.set_value(config.get("options.coef-multiplier"))
@@ -16,33 +16,25 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 
-import os
 import logging
-import operator
 
-try:
-    from yapsy.VersionedPluginManager import VersionedPluginManager
-
-    yapsy_available = True
-    yapsy_logger = logging.getLogger("yapsy")
-    yapsy_logger.setLevel(logging.WARNING)
-except ImportError:
-    yapsy_available = False
+from gi.repository import Gtk
 
 from pigeonplanner.ui import builder
 from pigeonplanner.ui import filechooser
 from pigeonplanner.ui.widgets import dateentry
 from pigeonplanner.ui.messagedialog import WarningDialog, ErrorDialog
+from pigeonplanner import resultimport
 from pigeonplanner.core import const
 from pigeonplanner.core import common
-from pigeonplanner.core import errors
 from pigeonplanner.core import mailing
-from pigeonplanner.database.models import Result
 
 logger = logging.getLogger(__name__)
 
 
 class ResultParser(builder.GtkBuilder):
+    FILL_CHUNK_SIZE = 200
+
     def __init__(self, parent):
         builder.GtkBuilder.__init__(self, "ResultParser.ui")
         self.data = None
@@ -53,7 +45,7 @@ class ResultParser(builder.GtkBuilder):
         self.widgets.parserdialog.show_all()
         # For some reason the grid is still expanded when it's properly set in Glade.
         self.widgets.datagrid.set_property("expand", False)
-        if yapsy_available:
+        if resultimport.yapsy_available:
             self._find_parsers()
         else:
             ErrorDialog((_("This tool needs Yapsy to run correctly."), None, ""), self.widgets.parserdialog)
@@ -78,52 +70,57 @@ class ResultParser(builder.GtkBuilder):
             if not WarningDialog(msg, self.widgets.parserdialog).run():
                 return
         resultfile.seek(0)
+        self.widgets.liststore.clear()
         try:
-            self.data, results = parser.parse_file(resultfile)
+            self.data, results = resultimport.stream_results(parser, resultfile)
+            self.widgets.dateentry.set_text(self.data["date"])
+            self.widgets.racepointentry.set_text(self.data["racepoint"].title())
+            self.widgets.sectorentry.set_text(self.data["sector"].title())
+            self.widgets.categoryentry.set_text(self.data["category"].title())
+            self.widgets.pigeonsentry.set_text(self.data["n_pigeons"])
+            self.widgets.datagrid.set_sensitive(True)
+            self._fill_liststore(results)
         except Exception:
-            import traceback
-
-            data = [
-                " **** File:",
-                self.resultfilename,
-                "\n **** Parser:",
-                "%s %s" % (parserplugin.name, parserplugin.version),
-                "\n **** Exception:",
-                traceback.format_exc(),
-            ]
-            text = "\n".join(data)
-            textbuffer = self.widgets.textview.get_buffer()
-            textbuffer.set_text(text)
-            self.widgets.reportdialog.show()
-            return
-
-        self.widgets.dateentry.set_text(self.data["date"])
-        self.widgets.racepointentry.set_text(self.data["racepoint"].title())
-        self.widgets.sectorentry.set_text(self.data["sector"].title())
-        self.widgets.categoryentry.set_text(self.data["category"].title())
-        self.widgets.pigeonsentry.set_text(self.data["n_pigeons"])
-
-        self.widgets.datagrid.set_sensitive(True)
-        self.widgets.liststore.clear()
-        if not results:
-            self.widgets.infobar.show()
-            self.widgets.addbutton.set_sensitive(False)
-            self.widgets.pigeonsw.set_sensitive(False)
+            self._show_report(parserplugin)
             return
-        self.widgets.infobar.hide()
-        self.widgets.addbutton.set_sensitive(True)
-        self.widgets.pigeonsw.set_sensitive(True)
-        for pigeon, result in results.items():
+        finally:
+            resultfile.close()
+
+        has_results = len(self.widgets.liststore) > 0
+        self.widgets.infobar.set_visible(not has_results)
+        self.widgets.addbutton.set_sensitive(has_results)
+        self.widgets.pigeonsw.set_sensitive(has_results)
+
+    def _fill_liststore(self, results):
+        # Rows are shown while the rest of the file is still being read
+        for index, (pigeon, ring, year, place, speed) in enumerate(results, 1):
+            if pigeon is None:
+                continue
             try:
-                speedfloat = float(result[-1].replace(",", "."))
+                speedfloat = float(speed.replace(",", "."))
             except ValueError:
-                result[-1] = ""
+                speed = ""
                 speedfloat = 0.0
-            row = result
-            row.insert(0, pigeon)
-            row.insert(0, True)
-            row.append(speedfloat)
-            self.widgets.liststore.append(row)
+            self.widgets.liststore.append([True, pigeon, ring, year, str(place), speed, speedfloat])
+            if index % self.FILL_CHUNK_SIZE == 0:
+                while Gtk.events_pending():
+                    Gtk.main_iteration()
+
+    def _show_report(self, parserplugin):
+        import traceback
+
+        data = [
+            " **** File:",
+            self.resultfilename,
+            "\n **** Parser:",
+            "%s %s" % (parserplugin.name, parserplugin.version),
+            "\n **** Exception:",
+            traceback.format_exc(),
+        ]
+        text = "\n".join(data)
+        textbuffer = self.widgets.textview.get_buffer()
+        textbuffer.set_text(text)
+        self.widgets.reportdialog.show()
 
     # noinspection PyMethodMayBeStatic
     def on_helpbutton_clicked(self, _widget):
@@ -154,11 +151,13 @@ class ResultParser(builder.GtkBuilder):
         weather = self.widgets.weatherentry.get_text()
         temperature = self.widgets.temperatureentry.get_text()
 
+        rows = []
         for row in self.widgets.liststore:
             toggle, pigeon, ring, year, place, speed, speedfloat = row
             if not toggle:
                 continue
             data = {
+                "pigeon": pigeon.id,
                 "date": date,
                 "racepoint": point,
                 "place": place,
@@ -173,12 +172,10 @@ class ResultParser(builder.GtkBuilder):
                 "windspeed": windspeed,
                 "temperature": temperature,
             }
+            rows.append(data)
 
-            try:
-                query = Result.insert(pigeon=pigeon, **data)
-                query.execute()
-            except errors.IntegrityError:
-                logger.info("Selected result already exists for pigeon id=%s band=%s", pigeon.id, pigeon.band_tuple)
+        inserted = resultimport.insert_results(rows)
+        logger.debug("Inserted %s of %s parsed result(s)", inserted, len(rows))
         self.close_window()
 
     def on_celltoggle_toggled(self, _cell, path):
@@ -212,11 +209,7 @@ class ResultParser(builder.GtkBuilder):
         self.widgets.grid.attach(self.widgets.filebutton, 1, 0, 1, 1)
 
     def _find_parsers(self):
-        manager = VersionedPluginManager()
-        manager.setPluginPlaces([const.RESULTPARSERDIR, os.path.join(const.PLUGINDIR, "resultparsers")])
-        manager.collectPlugins()
-        plugins = sorted(manager.getAllPlugins(), key=operator.attrgetter("name"))
-        for plugin in plugins:
+        for plugin in resultimport.find_parsers():
             name = "%s - %s" % (plugin.name, plugin.version)
             self.widgets.parserstore.append([plugin, name])
         self.widgets.parsercombo.set_active(0)
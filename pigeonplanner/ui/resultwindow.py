@@ -35,6 +35,8 @@ from pigeonplanner.ui.filechooser import PdfSaver, ExportChooser
 from pigeonplanner.ui.messagedialog import ErrorDialog
 from pigeonplanner.core import common
 from pigeonplanner.core import config
+from pigeonplanner.core import championship
+from pigeonplanner.core import results as coreresults
 from pigeonplanner.reportlib import (
     report,
     ReportError,
@@ -43,7 +45,8 @@ from pigeonplanner.reportlib import (
     PRINT_ACTION_EXPORT,
 )
 from pigeonplanner.reports.results import ResultsReport, ResultsReportOptions
-from pigeonplanner.database.models import Pigeon, Result, Racepoint, Category, Sector, Type, Weather, Wind
+from pigeonplanner.reports.championship import ChampionshipReport, ChampionshipReportOptions
+from pigeonplanner.database.models import Result, Racepoint, Category, Sector, Type, Weather, Wind
 
 
 def get_view_for_current_config():
@@ -179,6 +182,15 @@ class BaseView:
     def get_report_data(self):
         raise NotImplementedError
 
+    def _build_where(self, *filters):
+        # The filter items are added with the liststore columns, the query needs the names
+        items = [
+            utils.TreeviewFilter.FilterItem(self.column2name[item.name], item.value, item.operator, item.type)
+            for filter_ in filters
+            for item in filter_
+        ]
+        return coreresults.build_where(items)
+
 
 class ClassicView(BaseView):
     ID = 0
@@ -229,9 +241,11 @@ class ClassicView(BaseView):
     def __init__(self, root):
         BaseView.__init__(self, root)
 
-        self.filtermodel = None
-        self.sortmodel = None
-        self._filter = None
+        self._where = None
+        self._sort_name = "date"
+        self._sort_order = Gtk.SortType.ASCENDING
+        self._sort_column = None
+        self._n_results = 0
 
         self.build_ui()
 
@@ -240,6 +254,8 @@ class ClassicView(BaseView):
         return self.treeview
 
     def build_ui(self):
+        # Rows are fetched page by page while scrolling. Sorting and filtering
+        # is done by the database, not by a sort or filter model.
         self.liststore = Gtk.ListStore(
             object,
             object,
@@ -264,45 +280,45 @@ class ClassicView(BaseView):
             float,
         )
 
-        self.filtermodel = self.liststore.filter_new()
-        self.filtermodel.set_visible_func(self._visible_func)
-        self.sortmodel = Gtk.TreeModelSort(self.filtermodel)
-        self.sortmodel.set_sort_func(self.LS_COL_YEAR, self._sort_func)
-
         self.treeview = Gtk.TreeView()
-        self.treeview.set_model(self.sortmodel)
+        self.treeview.set_model(self.liststore)
         self.treeview.set_rules_hint(True)
         self.treeview.set_enable_search(False)
         self.selection = self.treeview.get_selection()
         colnames = [
-            ("band", None),
-            ("year", None),
-            ("date", None),
-            ("point", None),
-            ("place", self.LS_COL_PLACEDINT),
-            ("out", None),
-            ("coef", self.LS_COL_COEFFLOAT),
-            ("speed", self.LS_COL_SPEEDFLOAT),
-            ("sector", None),
-            ("type", None),
-            ("category", None),
-            ("wind", None),
-            ("windspeed", None),
-            ("weather", None),
-            ("temperature", None),
-            ("comment", None),
+            "band",
+            "year",
+            "date",
+            "point",
+            "place",
+            "out",
+            "coef",
+            "speed",
+            "sector",
+            "type",
+            "category",
+            "wind",
+            "windspeed",
+            "weather",
+            "temperature",
+            "comment",
         ]
-        for index, (colname, sortid) in enumerate(colnames):
+        for index, colname in enumerate(colnames):
             startcol = index + 2
             textrenderer = Gtk.CellRendererText()
             tvcolumn = Gtk.TreeViewColumn(self.colname2string[colname], textrenderer, text=startcol)
             tvcolumn.set_sizing(Gtk.TreeViewColumnSizing.AUTOSIZE)
             tvcolumn.set_clickable(True)
-            tvcolumn.set_sort_column_id(sortid or startcol)
+            tvcolumn.connect("clicked", self.on_column_clicked, colname)
             self.treeview.append_column(tvcolumn)
+            if colname == self._sort_name:
+                self._sort_column = tvcolumn
+                tvcolumn.set_sort_indicator(True)
+                tvcolumn.set_sort_order(self._sort_order)
         frame = self._build_parent_frame(_("Results"), self.treeview)
         frame.show_all()
         self._root.pack_start(frame, True, True, 0)
+        self.treeview.get_vadjustment().connect("value-changed", self.on_vadjustment_changed)
 
     def set_columns(self):
         columnsdic = {
@@ -321,50 +337,9 @@ class ClassicView(BaseView):
             self.treeview.get_column(key).set_visible(value)
 
     def fill_treeview(self):
-        self.treeview.freeze_child_notify()
-        self.treeview.set_model(None)
-        self.liststore.set_default_sort_func(lambda *args: -1)
-        self.liststore.set_sort_column_id(-1, Gtk.SortType.ASCENDING)
-
         self.clear()
-        for result in Result.select():
-            placestr, coef, coefstr = common.format_place_coef(result.place, result.out)
-            speed = common.format_speed(result.speed)
-            # A result can have None as pigeon.
-            band_tuple = () if result.pigeon is None else result.pigeon.band_tuple
-            band = "" if result.pigeon is None else result.pigeon.band
-            year = "" if result.pigeon is None else result.pigeon.band_year
-
-            self.liststore.insert(
-                0,
-                [
-                    result,
-                    band_tuple,
-                    band,
-                    year,
-                    str(result.date),
-                    result.racepoint,
-                    placestr,
-                    result.out,
-                    coefstr,
-                    speed,
-                    result.sector,
-                    result.type,
-                    result.category,
-                    result.wind,
-                    result.windspeed,
-                    result.weather,
-                    result.temperature,
-                    result.comment,
-                    result.place,
-                    coef,
-                    result.speed,
-                ],
-            )
-
-        self.treeview.set_model(self.sortmodel)
-        self.treeview.thaw_child_notify()
-        self.liststore.set_sort_column_id(self.LS_COL_DATE, Gtk.SortType.ASCENDING)
+        self._n_results = coreresults.count_results(self._where)
+        self._load_next_page()
 
     def clear(self):
         self.liststore.clear()
@@ -373,10 +348,10 @@ class ClassicView(BaseView):
         self.selection.emit("changed")
 
     def refilter(self):
-        self.filtermodel.refilter()
+        self.fill_treeview()
 
     def set_filter(self, filter1, filter2):
-        self._filter = filter1 + filter2
+        self._where = self._build_where(filter1, filter2)
 
     def update_filter(self):
         # Not used in this view
@@ -384,49 +359,73 @@ class ClassicView(BaseView):
 
     def get_report_data(self, flatten=False):
         data = []
-        for row in self.sortmodel:
-            temp = {}
-            for col in (
-                self.LS_COL_BAND,
-                self.LS_COL_YEAR,
-                self.LS_COL_DATE,
-                self.LS_COL_RACEPOINT,
-                self.LS_COL_PLACED,
-                self.LS_COL_OUT,
-                self.LS_COL_COEF,
-                self.LS_COL_SPEED,
-                self.LS_COL_SECTOR,
-                self.LS_COL_TYPE,
-                self.LS_COL_CATEGORY,
-                self.LS_COL_WIND,
-                self.LS_COL_WINDSPEED,
-                self.LS_COL_WEATHER,
-                self.LS_COL_TEMPERATURE,
-                self.LS_COL_COMMENT,
-                self.LS_COL_PLACEDINT,
-                self.LS_COL_COEFFLOAT,
-                self.LS_COL_SPEEDFLOAT,
-            ):
-                name = self.column2name[col]
-                temp[name] = self.sortmodel.get_value(row.iter, col)
-            temp["ring"] = "%s / %s" % (temp["band"], temp["year"][2:])
-            data.append(temp)
+        order_by = self._get_order_by()
+        offset = 0
+        # Fetch everything that matches the filter, not only the rows that were scrolled to.
+        while True:
+            results = coreresults.get_results_page(self._where, order_by, offset)
+            for result in results:
+                temp = dict(result)
+                temp["date"] = str(result["date"])
+                temp["point"] = result["racepoint"]
+                temp["ring"] = "%s / %s" % (temp["band"], temp["year"][2:])
+                data.append(temp)
+            if len(results) < coreresults.PAGE_SIZE:
+                break
+            offset += len(results)
         return data
 
-    def _visible_func(self, model, treeiter, _data=None):
-        for item in self._filter:
-            modelvalue = model.get_value(treeiter, item.name)
-            if not item.operator(modelvalue, item.value):
-                return False
-        return True
+    def on_column_clicked(self, column, colname):
+        if column is self._sort_column and self._sort_order == Gtk.SortType.ASCENDING:
+            self._sort_order = Gtk.SortType.DESCENDING
+        else:
+            self._sort_order = Gtk.SortType.ASCENDING
+        if self._sort_column is not None:
+            self._sort_column.set_sort_indicator(False)
+        self._sort_column = column
+        self._sort_name = colname
+        column.set_sort_indicator(True)
+        column.set_sort_order(self._sort_order)
+        self.fill_treeview()
+
+    def on_vadjustment_changed(self, adjustment):
+        # Load the next page when the last page is almost reached
+        if adjustment.get_value() + 2 * adjustment.get_page_size() >= adjustment.get_upper():
+            self._load_next_page()
+
+    def _load_next_page(self):
+        offset = len(self.liststore)
+        if offset >= self._n_results:
+            return
+        for result in coreresults.get_results_page(self._where, self._get_order_by(), offset):
+            self.liststore.append(
+                [
+                    result,
+                    result["band_tuple"],
+                    result["band"],
+                    result["year"],
+                    str(result["date"]),
+                    result["racepoint"],
+                    result["placestr"],
+                    result["out"],
+                    result["coefstr"],
+                    result["speedstr"],
+                    result["sector"],
+                    result["type"],
+                    result["category"],
+                    result["wind"],
+                    result["windspeed"],
+                    result["weather"],
+                    result["temperature"],
+                    result["comment"],
+                    result["place"],
+                    result["coef"],
+                    result["speed"],
+                ]
+            )
 
-    def _sort_func(self, model, iter1, iter2, _data=None):
-        data1 = model.get_value(iter1, self.LS_COL_YEAR)
-        data2 = model.get_value(iter2, self.LS_COL_YEAR)
-        if data1 == data2:
-            data1 = model.get_value(iter1, self.LS_COL_BAND)
-            data2 = model.get_value(iter2, self.LS_COL_BAND)
-        return (data1 > data2) - (data1 < data2)
+    def _get_order_by(self):
+        return coreresults.get_order_by(self._sort_name, self._sort_order == Gtk.SortType.DESCENDING)
 
 
 class SplittedView(BaseView):
@@ -490,12 +489,10 @@ class SplittedView(BaseView):
 
         self.results_cache = {}
         self.race_ls = None
-        self.race_filter = None
         self.race_sort = None
         self.race_tv = None
         self.race_sel = None
-        self._filter_races = None
-        self._filter_results = None
+        self._where = None
 
         self.build_ui()
 
@@ -504,10 +501,9 @@ class SplittedView(BaseView):
         return self.treeview
 
     def build_ui(self):
+        # Filtering is done by the database, only the matching races are added.
         self.race_ls = Gtk.ListStore(int, str, str, str, str, str, str, str)
-        self.race_filter = self.race_ls.filter_new()
-        self.race_filter.set_visible_func(self._visible_races_func)
-        self.race_sort = Gtk.TreeModelSort(self.race_filter)
+        self.race_sort = Gtk.TreeModelSort(self.race_ls)
         self.race_tv = Gtk.TreeView()
         self.race_tv.set_model(self.race_sort)
         self.race_tv.set_rules_hint(True)
@@ -578,44 +574,21 @@ class SplittedView(BaseView):
 
     def fill_treeview(self):
         self.clear()
-        counter = 0
-        for race in Result.select().group_by(Result.date, Result.racepoint).order_by(Result.date.asc()):
-            self.results_cache[counter] = {"results": [], "filtered": []}
-            resultstmp = (
-                Result.select()
-                .where((Result.date == race.date) & (Result.racepoint == race.racepoint))
-                .order_by(Result.racepoint.asc())
-                .dicts()
-            )
-            for result in resultstmp:
-                pigeon = Pigeon.get(Pigeon.id == result["pigeon"])
-                result["band_tuple"] = pigeon.band_tuple
-                result["band"] = pigeon.band
-                result["year"] = pigeon.band_year
-                result["ring"] = pigeon.band
-
-                placestr, coef, coefstr = common.format_place_coef(result["place"], result["out"])
-                result["speedstr"] = common.format_speed(result["speed"])
-                result["coef"] = coef
-                result["coefstr"] = coefstr
-                result["placestr"] = placestr
-
-                self.results_cache[counter]["results"].append(result)
-                self.results_cache[counter]["filtered"].append(result)
-
+        self.results_cache = {}
+        for counter, (race, results) in enumerate(coreresults.get_races(self._where)):
+            self.results_cache[counter] = {"results": results}
             self.race_ls.append(
                 [
                     counter,
-                    str(race.date),
-                    race.racepoint,
-                    race.type,
-                    race.wind,
-                    race.windspeed,
-                    race.weather,
-                    race.temperature,
+                    str(race["date"]),
+                    race["racepoint"],
+                    race["type"],
+                    race["wind"],
+                    race["windspeed"],
+                    race["weather"],
+                    race["temperature"],
                 ]
             )
-            counter += 1
 
     def clear(self):
         self.liststore.clear()
@@ -625,8 +598,6 @@ class SplittedView(BaseView):
         self.race_sel.emit("changed")
 
     def refilter(self):
-        self.race_filter.refilter()
-
         model, node = self.race_sel.get_selected()
         if node is None:
             self.race_sel.select_path(0)
@@ -634,28 +605,10 @@ class SplittedView(BaseView):
             self.race_tv.scroll_to_cell(model.get_path(node))
 
     def set_filter(self, races, results):
-        self._filter_races = races
-        self._filter_results = results
+        self._where = self._build_where(races, results)
 
     def update_filter(self):
-        if not self._filter_results.has_filters():
-            for result in self.results_cache.values():
-                result["filtered"] = result["results"][:]
-            return
-
-        for row in self.race_ls:
-            filtered = []
-            race_key = self.race_ls.get_value(row.iter, self.LS_COL_KEY)
-            for result in self.results_cache[race_key]["results"]:
-                show = True
-                for item in self._filter_results:
-                    resultvalue = result[self.column2name[item.name]]
-                    if not item.operator(item.type(resultvalue), item.type(item.value)):
-                        show = False
-                        break
-                if show:
-                    filtered.append(result)
-            self.results_cache[race_key]["filtered"] = filtered
+        self.fill_treeview()
 
     def get_report_data(self, flatten=False):
         # data = [{"race": {}, "results": [{}]}]
@@ -676,7 +629,7 @@ class SplittedView(BaseView):
                 temp["race"][name] = self.race_sort.get_value(row.iter, col)
             # Get the filtered results for the race
             race_key = self.race_sort.get_value(row.iter, self.LS_COL_KEY)
-            temp["results"] = self.results_cache[race_key]["filtered"][:]
+            temp["results"] = self.results_cache[race_key]["results"][:]
             data.append(temp)
 
         if flatten:
@@ -697,7 +650,7 @@ class SplittedView(BaseView):
 
         self.liststore.clear()
         key = model.get_value(rowiter, self.LS_COL_KEY)
-        for result in self.results_cache[key]["filtered"]:
+        for result in self.results_cache[key]["results"]:
             self.liststore.append(
                 [
                     result["band_tuple"],
@@ -716,19 +669,6 @@ class SplittedView(BaseView):
                 ]
             )
 
-    def _visible_races_func(self, model, treeiter, _data=None):
-        for item in self._filter_races:
-            modelvalue = model.get_value(treeiter, item.name)
-            if not item.operator(modelvalue, item.value):
-                return False
-
-        if not self._filter_results.has_filters():
-            # No result filters
-            return True
-
-        race_key = self.race_ls.get_value(treeiter, self.LS_COL_KEY)
-        return len(self.results_cache[race_key]["filtered"]) > 0
-
 
 class ResultWindow(builder.GtkBuilder):
     def __init__(self, parent):
@@ -739,6 +679,7 @@ class ResultWindow(builder.GtkBuilder):
         self.csvname = filename + ".csv"
         self._filter_races = utils.TreeviewFilter()
         self._filter_results = utils.TreeviewFilter()
+        self._championship_future = None
 
         view = get_view_for_current_config()
         self.widgets.resultview = view(self.widgets.hbox)
@@ -758,6 +699,10 @@ class ResultWindow(builder.GtkBuilder):
 
     # Callbacks
     def on_close_window(self, _widget, _event=None):
+        # The callbacks of the background work would use the destroyed window
+        if self._championship_future is not None:
+            self._championship_future.cancel()
+            self._championship_future = None
         self.widgets.resultwindow.destroy()
 
     def on_close_filter(self, _widget, _event=None):
@@ -910,7 +855,51 @@ class ResultWindow(builder.GtkBuilder):
     def on_print_clicked(self, _widget):
         self._do_operation(PRINT_ACTION_DIALOG)
 
+    def on_championship_clicked(self, widget):
+        userinfo = common.get_own_address()
+        if not tools.check_user_info(self.widgets.resultwindow, userinfo):
+            return
+
+        formula = championship.get_formula_for_current_config()
+        group_by = ("season", "category")
+
+        def get_rankings(database):
+            return championship.get_rankings(formula, group_by, db=database)
+
+        def on_rankings(rankings):
+            if self._championship_future is None:
+                # The window was closed meanwhile
+                return
+            self._championship_future = None
+            widget.set_sensitive(True)
+            self._preview_championship((formula, group_by, rankings), userinfo)
+
+        def on_error(exc):
+            if self._championship_future is None:
+                return
+            self._championship_future = None
+            widget.set_sensitive(True)
+            ErrorDialog(
+                (_("The championship rankings could not be calculated."), str(exc), _("Error")),
+                self.widgets.resultwindow,
+            )
+
+        # All results are read, don't block the window meanwhile.
+        widget.set_sensitive(False)
+        self._championship_future = utils.run_in_background(get_rankings, on_rankings, error_callback=on_error)
+
     # Private methods
+    def _preview_championship(self, data, userinfo):
+        psize = common.get_pagesize_from_opts()
+        opts = ChampionshipReportOptions(psize, None, PRINT_ACTION_PREVIEW, parent=self.widgets.resultwindow)
+        try:
+            report(ChampionshipReport, opts, data, userinfo)
+        except ReportError as exc:
+            ErrorDialog(
+                (exc.value.split("\n")[0], _("You probably don't have write permissions on this folder."), _("Error")),
+                self.widgets.resultwindow,
+            )
+
     def _save_filter_results(self):
         self.widgets.resultview.set_filter(self._filter_races, self._filter_results)
         self.widgets.resultview.update_filter()
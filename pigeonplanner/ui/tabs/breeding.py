@@ -31,6 +31,7 @@ from pigeonplanner.ui.messagedialog import ErrorDialog
 from pigeonplanner.ui.messagedialog import QuestionDialog
 from pigeonplanner.core import enums
 from pigeonplanner.core import common
+from pigeonplanner.core import kinship
 from pigeonplanner.core import pigeon as corepigeon
 from pigeonplanner.database.models import Pigeon, Breeding
 
@@ -377,7 +378,10 @@ class BreedingTab(builder.GtkBuilder, basetab.BaseTab):
         return pigeon
 
     def _add_parent_record(self, pigeon):
-        rowiter = self.widgets.treestore.append(None, [None, pigeon, pigeon.band])
+        # Show the inbreeding coefficient youngsters of this pair would have
+        coi = kinship.get_calculator().offspring_inbreeding(self.pigeon.id, pigeon.id)
+        label = "%s (%s %s)" % (pigeon.band, _("COI"), kinship.format_coefficient(coi))
+        rowiter = self.widgets.treestore.append(None, [None, pigeon, label])
         return rowiter
 
     def _get_or_create_parent_record(self, pigeon):
@@ -16,6 +16,8 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 
+import locale
+
 from gi.repository import Gtk
 
 from pigeonplanner import messages
@@ -31,6 +33,7 @@ from pigeonplanner.core import enums
 from pigeonplanner.core import common
 from pigeonplanner.core import errors
 from pigeonplanner.core import config
+from pigeonplanner.core import racestats
 from pigeonplanner.database.models import Result, Racepoint, Category, Sector, Type, Weather, Wind
 
 
@@ -729,6 +732,7 @@ class ResultsTab(builder.GtkBuilder, basetab.BaseTab):
             return
 
         self.widgets.resultview.remove_selected()
+        self._set_season_stats()
 
     def on_buttonclose_clicked(self, _widget):
         self._close_dialog()
@@ -764,6 +768,7 @@ class ResultsTab(builder.GtkBuilder, basetab.BaseTab):
         ).where((Result.date == data["date"]) & (Result.racepoint == data["racepoint"]))
         update_query.execute()
         self.widgets.resultview.refresh()
+        self._set_season_stats()
 
         self.widgets.comboracepoint.add_item(data["racepoint"])
         self.widgets.combosector.add_item(data["sector"])
@@ -809,9 +814,11 @@ class ResultsTab(builder.GtkBuilder, basetab.BaseTab):
         self.widgets.labelpigeon.set_text(pigeon.band)
 
         self.widgets.resultview.set_pigeon(pigeon)
+        self._set_season_stats()
 
     def clear_pigeon(self):
         self.widgets.resultview.clear()
+        self.widgets.resultview.maintree.set_tooltip_text(None)
 
     def get_pigeon_state_widgets(self):
         return [self.widgets.buttonadd]
@@ -833,6 +840,22 @@ class ResultsTab(builder.GtkBuilder, basetab.BaseTab):
                 self.widgets.resultview.set_pigeon(self.pigeon)
 
     # Internal methods
+    def _set_season_stats(self):
+        lines = []
+        for stats in racestats.get_season_stats(self.pigeon):
+            values = {
+                "season": stats.season,
+                "races": stats.races,
+                "prizes": stats.prizes,
+                "coef": locale.format_string("%.2f", racestats.get_average_coefficient(stats)),
+                "points": locale.format_string("%.2f", stats.ace_points),
+            }
+            lines.append(
+                _("%(season)s: %(races)s races, %(prizes)s prizes, average coefficient %(coef)s, %(points)s points")
+                % values
+            )
+        self.widgets.resultview.maintree.set_tooltip_text("\n".join(lines) or None)
+
     def _close_dialog(self):
         if not self.widgets.entrydate.is_valid_date():
             self.widgets.entrydate.set_today()
@@ -16,17 +16,23 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 
+import logging
 import operator
+from concurrent.futures import Future
 from typing import List, Tuple, Callable, Optional
 
 from gi.repository import Gtk
 from gi.repository import Gdk
+from gi.repository import GLib
 
 from pigeonplanner.core import enums
 from pigeonplanner.core import config
 from pigeonplanner.core import pigeon as corepigeon
+from pigeonplanner.database import session
 from pigeonplanner.database.models import Pigeon
 
+logger = logging.getLogger(__name__)
+
 
 def get_sex_icon_name(sex: enums.Sex) -> str:
     if sex == enums.Sex.cock:
@@ -121,6 +127,45 @@ def draw_pedigree(grid: Gtk.Grid, root_pigeon: Optional[Pigeon] = None, draw_cb:
     grid.queue_draw()
 
 
+def run_in_background(func: Callable, callback: Callable, *args, error_callback: Optional[Callable] = None) -> Future:
+    """Call func(database, *args) on a read-only worker connection, see ReadOnlyPool. The
+    callback is called with the return value in the main loop, or error_callback with the
+    exception if it fails.
+    """
+    future = session.get_read_pool().submit(func, *args)
+    return _deliver_in_main_loop(future, callback, error_callback)
+
+
+def run_query_in_background(query, callback: Callable, error_callback: Optional[Callable] = None) -> Future:
+    """Run a peewee query on a read-only worker connection and call the callback with the
+    list of rows in the main loop.
+    """
+    future = session.get_read_pool().select(query)
+    return _deliver_in_main_loop(future, callback, error_callback)
+
+
+def _deliver_in_main_loop(future: Future, callback: Callable, error_callback: Optional[Callable]) -> Future:
+    def on_done(done):
+        if done.cancelled():
+            return
+        exc = done.exception()
+        if exc is None:
+            GLib.idle_add(_call_once, callback, done.result())
+        elif error_callback is not None:
+            GLib.idle_add(_call_once, error_callback, exc)
+        else:
+            logger.error("Background database work failed", exc_info=exc)
+
+    future.add_done_callback(on_done)
+    return future
+
+
+def _call_once(func: Callable, *args) -> bool:
+    func(*args)
+    # Remove the idle source
+    return False
+
+
 class HiddenPigeonsMixin:
     # noinspection PyMethodMayBeStatic
     def _visible_func(self, model: Gtk.TreeModel, rowiter: Gtk.TreeModelRowIter, _data=None) -> bool:
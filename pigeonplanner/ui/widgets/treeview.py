@@ -20,13 +20,17 @@ from gi.repository import Gtk
 from gi.repository import GObject
 from gi.repository import GdkPixbuf
 
+import peewee
+
 from pigeonplanner.ui import utils
 from pigeonplanner.ui import builder
 from pigeonplanner.ui import component
 from pigeonplanner.core import enums
 from pigeonplanner.core import const
+from pigeonplanner.core import common
 from pigeonplanner.core import config
-from pigeonplanner.database.models import Pigeon, Colour, Strain, Loft
+from pigeonplanner.core import pigeon as corepigeon
+from pigeonplanner.database.models import Pigeon, Status, Colour, Strain, Loft
 
 
 class FilterDialog(builder.GtkBuilder):
@@ -91,7 +95,7 @@ class FilterDialog(builder.GtkBuilder):
         self.widgets.bandentrydam.clear()
 
         self.filter.clear()
-        self.treeview._modelfilter.refilter()
+        self.treeview.refilter()
         component.get("Statusbar").set_filter(False)
         self.treeview.emit("pigeons-changed")
 
@@ -127,7 +131,7 @@ class FilterDialog(builder.GtkBuilder):
         loft = self.widgets.comboloft.get_child().get_text()
         self.filter.add("loft", loft)
 
-        self.treeview._modelfilter.refilter()
+        self.treeview.refilter()
         component.get("Statusbar").set_filter(self.filter.has_filters())
         self.treeview.emit("pigeons-changed")
 
@@ -152,7 +156,8 @@ class MainTreeView(Gtk.TreeView, component.Component):
         LS_STATUS,
         LS_SEXIMG,
         LS_HIDDENIMG,
-    ) = range(14)
+        LS_SEXID,
+    ) = range(15)
 
     (
         COL_HIDDEN,
@@ -169,11 +174,20 @@ class MainTreeView(Gtk.TreeView, component.Component):
         COL_STATUS,
     ) = range(12)
 
+    # Number of rows inserted into the liststore before pending events are processed
+    FILL_CHUNK_SIZE = 1000
+
     def __init__(self):
         Gtk.TreeView.__init__(self)
         component.Component.__init__(self, "Treeview")
 
         self._block_visible_func = False
+        # Ids of the pigeons that match the active filter, None if there's no filter
+        self._filtered_ids = None
+        # Number of shown pigeons per sex, kept up to date with each changed row
+        self._sex_counts = self._new_sex_counts()
+        # Pigeon id to liststore iter. The iters of a liststore stay valid as long as the row exists.
+        self._row_iters = {}
 
         sort_direction = (
             Gtk.SortType.ASCENDING if config.get("interface.pigeon-sort") == 0 else Gtk.SortType.DESCENDING
@@ -221,7 +235,10 @@ class MainTreeView(Gtk.TreeView, component.Component):
         return self._modelfilter.convert_path_to_child_path(filterpath)
 
     def add_row(self, row, select=True):
+        self._update_filtered_id(row[self.LS_PIGEON])
         rowiter = self._liststore.insert(0, row)
+        self._row_iters[row[self.LS_PIGEON]] = rowiter
+        self._count_row(row[self.LS_PIGEON], row[self.LS_SEXID], 1)
         if select:
             try:
                 topiter = self.get_top_iter(rowiter)
@@ -242,21 +259,48 @@ class MainTreeView(Gtk.TreeView, component.Component):
             raise ValueError("A path or iter is required!")
         if rowiter is None:
             rowiter = self._liststore.get_iter(path)
+        values = dict(zip(data[::2], data[1::2]))
+        old_id, old_sex = self._liststore.get(rowiter, self.LS_PIGEON, self.LS_SEXID)
+        self._count_row(old_id, old_sex, -1)
+        if self.LS_PIGEON in values:
+            self._update_filtered_id(values[self.LS_PIGEON])
         self._liststore.set(rowiter, *data)
+        new_id = values.get(self.LS_PIGEON, old_id)
+        if new_id != old_id:
+            del self._row_iters[old_id]
+            self._row_iters[new_id] = rowiter
+        self._count_row(new_id, values.get(self.LS_SEXID, old_sex), 1)
         self.emit("pigeons-changed")
 
     def remove_row(self, path):
         sortiter = self._modelsort.get_iter(path)
         rowiter = self.get_child_iter(sortiter)
+        pigeon_id, sex = self._liststore.get(rowiter, self.LS_PIGEON, self.LS_SEXID)
+        self._count_row(pigeon_id, sex, -1)
+        self._row_iters.pop(pigeon_id, None)
         self._liststore.remove(rowiter)
         self.emit("pigeons-changed")
 
+    def refilter(self):
+        """Query the pigeons that match the active filter and refilter the rows"""
+        self._update_filtered_ids()
+        self._modelfilter.refilter()
+        self._recount()
+
     def get_n_rows(self):
         return len(self._liststore)
 
+    def get_sex_counts(self):
+        """Get the number of shown pigeons per sex and the total, like common.count_active_pigeons()"""
+        counts = dict(self._sex_counts)
+        counts["total"] = sum(self._sex_counts.values())
+        return counts
+
     def clear_treeview(self):
         self._block_visible_func = True
         self._liststore.clear()
+        self._row_iters.clear()
+        self._sex_counts = self._new_sex_counts()
         self._block_visible_func = False
 
     def fill_treeview(self, path=0):
@@ -273,15 +317,17 @@ class MainTreeView(Gtk.TreeView, component.Component):
         # are inserted through this method as the database query will handle this.
         self._block_visible_func = True
         self._liststore.clear()
+        self._row_iters.clear()
+        self._update_filtered_ids()
 
-        query = Pigeon.select()
-        if not config.get("interface.show-all-pigeons"):
-            query = query.where(Pigeon.visible == True)
-        for pigeon in query:
-            self._liststore.insert(0, self._row_for_pigeon(pigeon))
-            while Gtk.events_pending():
-                Gtk.main_iteration()
+        for index, row in enumerate(self._query_rows(), 1):
+            self._row_iters[row[self.LS_PIGEON]] = self._liststore.insert(0, row)
+            # Keep the interface responsive, but don't process events after each insert.
+            if index % self.FILL_CHUNK_SIZE == 0:
+                while Gtk.events_pending():
+                    Gtk.main_iteration()
 
+        self._recount()
         self.set_model(self._modelsort)
         self._selection.select_path(path)
         self.emit("pigeons-changed")
@@ -297,6 +343,17 @@ class MainTreeView(Gtk.TreeView, component.Component):
     def add_pigeon(self, pigeon, select=True):
         self.add_row(self._row_for_pigeon(pigeon), select)
 
+    def add_pigeons(self, pigeon_ids):
+        """Add the rows for many new pigeons with a single query and signal the change once"""
+        if not pigeon_ids:
+            return
+        if self._filtered_ids is not None:
+            self._filtered_ids |= corepigeon.get_filtered_pigeon_ids(self._filterdialog.filter, pigeon_ids)
+        for row in self._query_rows(pigeon_ids):
+            self._row_iters[row[self.LS_PIGEON]] = self._liststore.insert(0, row)
+            self._count_row(row[self.LS_PIGEON], row[self.LS_SEXID], 1)
+        self.emit("pigeons-changed")
+
     def update_pigeon(self, pigeon, rowiter=None, path=None):
         if rowiter is None and path is None:
             path = self.get_path_for_pigeon(pigeon)
@@ -331,14 +388,13 @@ class MainTreeView(Gtk.TreeView, component.Component):
             utils.get_sex_icon_name(pigeon.sex),
             self.LS_HIDDENIMG,
             "" if pigeon.visible else "icon_hidden",
+            self.LS_SEXID,
+            pigeon.sex,
         )
         self.update_row(data, rowiter=rowiter, path=path)
 
     def has_pigeon(self, pigeon):
-        for row in self._liststore:
-            if self._liststore.get_value(row.iter, self.LS_PIGEON) == pigeon.id:
-                return True
-        return False
+        return pigeon.id in self._row_iters
 
     def select_pigeon(self, _widget, pigeon):
         """Select the pigeon in the main treeview
@@ -346,14 +402,19 @@ class MainTreeView(Gtk.TreeView, component.Component):
         :param _widget: Only given when selected through menu
         :param pigeon: The pigeon object to search
         """
-        for row in self._modelsort:
-            if self._modelsort.get_value(row.iter, self.LS_PIGEON) == pigeon.id:
-                self._selection.unselect_all()
-                self._selection.select_iter(row.iter)
-                self.scroll_to_cell(row.path)
-                self.grab_focus()
-                return True
-        return False
+        rowiter = self._row_iters.get(pigeon.id)
+        if rowiter is None:
+            return False
+        try:
+            topiter = self.get_top_iter(rowiter)
+        except RuntimeError:
+            # The pigeon is filtered out
+            return False
+        self._selection.unselect_all()
+        self._selection.select_iter(topiter)
+        self.scroll_to_cell(self._modelsort.get_path(topiter))
+        self.grab_focus()
+        return True
 
     def select_all_pigeons(self):
         self._selection.select_all()
@@ -385,9 +446,22 @@ class MainTreeView(Gtk.TreeView, component.Component):
         if ordered:
             # Querying the database to get the actual Pigeon objects from the IDs loses the order of the
             # rows in the treeview. Sort the fetched objects by the original list of IDs.
-            pigeons = sorted(pigeons, key=lambda pigeon: ids.index(pigeon.id))
+            positions = {pigeon_id: index for index, pigeon_id in enumerate(ids)}
+            pigeons = sorted(pigeons, key=lambda pigeon: positions[pigeon.id])
         return pigeons
 
+    def get_pigeon_ids(self, filtered=False):
+        """Get the ids of the pigeons loaded in the treeview, in the same order as in the treeview
+
+        :param filtered: return the ids as filtered in the treeview
+        """
+        model = self._modelsort if filtered else self._liststore
+        return [row[self.LS_PIGEON] for row in model]
+
+    def get_selected_pigeon_ids(self):
+        model, paths = self._selection.get_selected_rows()
+        return [model[path][self.LS_PIGEON] for path in paths]
+
     def get_selected_pigeon(self):
         model, paths = self._selection.get_selected_rows()
         if len(paths) == 1:
@@ -400,9 +474,12 @@ class MainTreeView(Gtk.TreeView, component.Component):
             return None
 
     def get_path_for_pigeon(self, pigeon):
-        for row in self._liststore:
-            if row[self.LS_PIGEON] == pigeon.id:
-                return self.get_top_path(row.path)[0]
+        rowiter = self._row_iters.get(pigeon.id)
+        if rowiter is None:
+            return None
+        path = self.get_top_path(self._liststore.get_path(rowiter))
+        # The pigeon is filtered out when there's no path
+        return None if path is None else path[0]
 
     def get_pigeon_at_path(self, path):
         path = self.get_child_path(path)
@@ -435,7 +512,7 @@ class MainTreeView(Gtk.TreeView, component.Component):
 
     # Internal methods
     def _build_treeview(self):
-        liststore = Gtk.ListStore(int, str, str, str, str, str, str, str, str, str, str, str, str, str)
+        liststore = Gtk.ListStore(int, str, str, str, str, str, str, str, str, str, str, str, str, str, int)
         columns = [
             "",
             _("Band no."),
@@ -487,17 +564,128 @@ class MainTreeView(Gtk.TreeView, component.Component):
             pigeon.status.status_string,
             utils.get_sex_icon_name(pigeon.sex),
             "" if pigeon.visible else "icon_hidden",
+            pigeon.sex,
         ]
 
+    @classmethod
+    def _query_rows(cls, pigeon_ids=None):
+        """Yield the liststore rows for all pigeons using a single query. The sire, dam
+        and status are joined in instead of being fetched for each pigeon separately.
+
+        :param pigeon_ids: Optional. Only yield the rows for the pigeons with these ids.
+        """
+        if pigeon_ids is not None:
+            # Stay below the SQLite limit on the number of variables in a query.
+            for chunk in peewee.chunked(list(pigeon_ids), 900):
+                yield from cls._query_rows_where(Pigeon.id.in_(chunk))
+            return
+        if config.get("interface.show-all-pigeons"):
+            yield from cls._query_rows_where(None)
+        else:
+            yield from cls._query_rows_where(Pigeon.visible == True)  # noqa
+
+    @staticmethod
+    def _query_rows_where(where):
+        sire = Pigeon.alias()
+        dam = Pigeon.alias()
+        query = (
+            Pigeon.select(
+                Pigeon.id,
+                Pigeon.band_format,
+                Pigeon.band_country,
+                Pigeon.band_letters,
+                Pigeon.band_number,
+                Pigeon.band_year,
+                Pigeon.name,
+                Pigeon.colour,
+                Pigeon.sex,
+                Pigeon.loft,
+                Pigeon.strain,
+                Pigeon.visible,
+                Status.status_id,
+                sire.band_format,
+                sire.band_country,
+                sire.band_letters,
+                sire.band_number,
+                sire.band_year,
+                dam.band_format,
+                dam.band_country,
+                dam.band_letters,
+                dam.band_number,
+                dam.band_year,
+            )
+            .join(Status, peewee.JOIN.LEFT_OUTER, on=(Status.pigeon == Pigeon.id))
+            .switch(Pigeon)
+            .join(sire, peewee.JOIN.LEFT_OUTER, on=(Pigeon.sire == sire.id))
+            .switch(Pigeon)
+            .join(dam, peewee.JOIN.LEFT_OUTER, on=(Pigeon.dam == dam.id))
+        )
+        if where is not None:
+            query = query.where(where)
+
+        for row in query.tuples():
+            pigeon_id, band_format, country, letters, number, year = row[:6]
+            name, colour, sex, loft, strain, visible, status_id = row[6:13]
+            sire_band = row[13:18]
+            dam_band = row[18:23]
+            if status_id is None:
+                status_id = enums.Status.active
+            yield [
+                pigeon_id,
+                Pigeon.format_band(band_format, country, letters, number, year),
+                year,
+                country,
+                name,
+                colour,
+                enums.Sex.get_string(sex),
+                "" if sire_band[0] is None else Pigeon.format_band(*sire_band),
+                "" if dam_band[0] is None else Pigeon.format_band(*dam_band),
+                loft,
+                strain,
+                enums.Status.get_string(status_id),
+                utils.get_sex_icon_name(sex),
+                "" if visible else "icon_hidden",
+                sex,
+            ]
+
+    @staticmethod
+    def _new_sex_counts():
+        return {enums.Sex.cock: 0, enums.Sex.hen: 0, enums.Sex.youngbird: 0, enums.Sex.unknown: 0}
+
+    def _count_row(self, pigeon_id, sex, delta):
+        if self._filtered_ids is None or pigeon_id in self._filtered_ids:
+            self._sex_counts[sex] = self._sex_counts.get(sex, 0) + delta
+
+    def _recount(self):
+        if self._filtered_ids is None:
+            # All rows are shown, let the database count them.
+            counts = common.count_active_pigeons(include_hidden=config.get("interface.show-all-pigeons"))
+            del counts["total"]
+            self._sex_counts = counts
+            return
+        self._sex_counts = self._new_sex_counts()
+        for row in self._liststore:
+            self._count_row(row[self.LS_PIGEON], row[self.LS_SEXID], 1)
+
+    def _update_filtered_ids(self):
+        if self._filterdialog.filter.has_filters():
+            self._filtered_ids = corepigeon.get_filtered_pigeon_ids(self._filterdialog.filter)
+        else:
+            self._filtered_ids = None
+
+    def _update_filtered_id(self, pigeon_id):
+        # Check a single added or changed pigeon against the active filter
+        if self._filtered_ids is None:
+            return
+        if corepigeon.get_filtered_pigeon_ids(self._filterdialog.filter, [pigeon_id]):
+            self._filtered_ids.add(pigeon_id)
+        else:
+            self._filtered_ids.discard(pigeon_id)
+
     def _visible_func(self, model, treeiter, _data=None):
-        if self._block_visible_func:
+        if self._block_visible_func or self._filtered_ids is None:
             return True
-        pigeon = Pigeon.get_by_id(model[treeiter][self.LS_PIGEON])
-        for item in self._filterdialog.filter:
-            pvalue = getattr(pigeon, item.name)
-            if not item.operator(item.type(pvalue), item.type(item.value)):
-                return False
-        return True
+        return model[treeiter][self.LS_PIGEON] in self._filtered_ids
 
     def _sort_func(self, model, iter1, iter2, _data=None):
         data1 = model.get_value(iter1, self.LS_YEAR)
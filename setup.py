@@ -57,6 +57,9 @@ if const.UNIX:
 entry_points = {
     "gui_scripts": [
         "pigeonplanner = pigeonplanner.main:run"
+    ],
+    "console_scripts": [
+        "pigeonplanner-import = pigeonplanner.resultimport:run"
     ]
 }
 
@@ -16,13 +16,34 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 
+import os
+import csv
+import json
+import operator
+import shutil
+import sqlite3
+import tempfile
+
 import nose.tools as nt
 from . import utils
 
+from pigeonplanner.core import const
 from pigeonplanner.core import enums
+from pigeonplanner.core import backup
+from pigeonplanner.core import common
+from pigeonplanner.core import kinship
+from pigeonplanner.core import ancestry
+from pigeonplanner.core import racestats
+from pigeonplanner.core import championship
 from pigeonplanner.core import errors
+from pigeonplanner.core import results as coreresults
 from pigeonplanner.core import pigeon as corepigeon
-from pigeonplanner.database.models import Pigeon
+from pigeonplanner.export.exportcsv import ExportCSV
+from pigeonplanner.export.exportjsonlines import ExportJSONLines
+from pigeonplanner.export.exportsqlite import ExportSQLite
+from pigeonplanner.database.models import Colour, Pigeon, PigeonAncestry, PigeonSeasonStats, Racepoint, Result, database
+from pigeonplanner.ui.utils import TreeviewFilter
+from pigeonplanner.ui.widgets.treeview import MainTreeView
 
 
 def test_pigeon_helpers():
@@ -55,3 +76,530 @@ def test_pigeon_helpers():
 test_pigeon_helpers.setup = utils.open_test_db
 test_pigeon_helpers.teardown = utils.close_test_db
 
+
+def test_add_pigeons():
+    data = {"band_number": "5", "band_year": "2020", "band_country": "", "band_letters": "", "sex": enums.Sex.cock}
+    existing = corepigeon.add_pigeon(data, enums.Status.active, {})
+
+    band_numbers = [str(number) for number in range(1, 501)]
+    pigeon_ids = corepigeon.add_pigeons(band_numbers, "2020", enums.Sex.youngbird)
+    nt.assert_equal(len(pigeon_ids), 499)
+    nt.assert_not_in(existing.id, pigeon_ids)
+    pigeon = Pigeon.get_by_id(pigeon_ids[0])
+    nt.assert_equal((pigeon.band_number, pigeon.sex), ("1", enums.Sex.youngbird))
+    nt.assert_equal(pigeon.status.status_id, enums.Status.active)
+    nt.assert_equal(Pigeon.select().count(), 500)
+
+    # Adding the range again doesn't add anything
+    nt.assert_equal(corepigeon.add_pigeons(band_numbers, "2020", enums.Sex.youngbird), [])
+    nt.assert_raises(ValueError, corepigeon.add_pigeons, band_numbers, "2020", "0")
+
+test_add_pigeons.setup = utils.open_test_db
+test_add_pigeons.teardown = utils.close_test_db
+
+
+def test_count_active_pigeons():
+    corepigeon.add_pigeons(["1", "2", "3"], "2020", enums.Sex.youngbird)
+    corepigeon.add_pigeons(["4"], "2020", enums.Sex.hen)
+    Pigeon.update(visible=False).where(Pigeon.band_number == "1").execute()
+
+    counts = common.count_active_pigeons()
+    nt.assert_equal((counts["total"], counts[enums.Sex.youngbird], counts[enums.Sex.hen]), (3, 2, 1))
+    counts = common.count_active_pigeons(include_hidden=True)
+    nt.assert_equal((counts["total"], counts[enums.Sex.youngbird], counts[enums.Sex.cock]), (4, 3, 0))
+
+test_count_active_pigeons.setup = utils.open_test_db
+test_count_active_pigeons.teardown = utils.close_test_db
+
+
+def test_main_treeview_rows():
+    sire = utils.add_pigeon("1", enums.Sex.cock)
+    dam = utils.add_pigeon("2", enums.Sex.hen)
+    child = utils.add_pigeon("3", enums.Sex.youngbird, sire=sire.band_tuple, dam=dam.band_tuple)
+    utils.add_pigeon("4", enums.Sex.hen, visible=False)
+
+    rows = {row[MainTreeView.LS_PIGEON]: row for row in MainTreeView._query_rows()}
+    nt.assert_equal(set(rows), {sire.id, dam.id, child.id})
+    row = rows[child.id]
+    nt.assert_equal((row[MainTreeView.LS_RING], row[MainTreeView.LS_SIRE]), (child.band, sire.band))
+    nt.assert_equal(row[MainTreeView.LS_DAM], dam.band)
+    nt.assert_equal(row[MainTreeView.LS_STATUS], enums.Status.get_string(enums.Status.active))
+    nt.assert_equal(row[MainTreeView.LS_SEXID], enums.Sex.youngbird)
+    nt.assert_equal(rows[sire.id][MainTreeView.LS_SIRE], "")
+
+    # Adding a range with an active filter, as MainTreeView.add_pigeons() does, with more ids
+    # than fit in one query
+    utils.limit_query_variables()
+    pigeon_ids = corepigeon.add_pigeons([str(number) for number in range(10, 1010)], "2020", enums.Sex.cock)
+    pigeon_filter = TreeviewFilter()
+    pigeon_filter.add("sex", enums.Sex.cock, type_=int, allow_empty_value=True)
+    filtered_ids = corepigeon.get_filtered_pigeon_ids(pigeon_filter, pigeon_ids + [child.id])
+    nt.assert_equal(filtered_ids, set(pigeon_ids))
+    rows = list(MainTreeView._query_rows(pigeon_ids + [child.id]))
+    nt.assert_equal(len(rows), 1001)
+
+test_main_treeview_rows.setup = utils.open_test_db
+test_main_treeview_rows.teardown = utils.close_test_db
+
+
+def test_export_csv():
+    sire = utils.add_pigeon("1", enums.Sex.cock)
+    dam = utils.add_pigeon("2", enums.Sex.hen)
+    child = utils.add_pigeon("3", enums.Sex.youngbird, sire=sire.band_tuple, dam=dam.band_tuple, image="/tmp/3.png")
+
+    filepath = os.path.join(tempfile.mkdtemp(), "pigeons.csv")
+    ExportCSV.run(filepath, [child.id, sire.id])
+    with open(filepath, encoding="utf-8") as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    nt.assert_equal([row["number"] for row in rows], ["3", "1"])
+    nt.assert_equal((rows[0]["sire"], rows[0]["dam"], rows[0]["image"]), (sire.band, dam.band, "/tmp/3.png"))
+    nt.assert_equal((rows[1]["sire"], rows[1]["image"], rows[1]["status"]), ("", "", str(enums.Status.active)))
+
+    ExportCSV.run(filepath)
+    with open(filepath, encoding="utf-8") as csvfile:
+        nt.assert_equal(len(list(csv.DictReader(csvfile))), 3)
+    os.remove(filepath)
+
+test_export_csv.setup = utils.open_test_db
+test_export_csv.teardown = utils.close_test_db
+
+
+def test_export_jsonlines_sqlite():
+    grandsire = utils.add_pigeon("1", enums.Sex.cock)
+    sire = utils.add_pigeon("2", enums.Sex.cock, sire=grandsire.band_tuple)
+    dam = utils.add_pigeon("3", enums.Sex.hen)
+    child = utils.add_pigeon("4", enums.Sex.youngbird, sire=sire.band_tuple, dam=dam.band_tuple)
+    utils.add_pigeon("5", enums.Sex.hen)
+    Result.create(pigeon=child, date="2020-05-01", racepoint="Noyon", place=1, out=100)
+    Result.create(pigeon=dam, date="2020-05-01", racepoint="Noyon", place=2, out=100)
+    Colour.create(colour="Blue")
+
+    tempdir = tempfile.mkdtemp()
+    filepath = os.path.join(tempdir, "pigeons.jsonl")
+    ExportJSONLines.run(filepath, [child.id, dam.id])
+    with open(filepath, encoding="utf-8") as jsonfile:
+        pigeons = [json.loads(line) for line in jsonfile]
+    nt.assert_equal([pigeon["number"] for pigeon in pigeons], ["4", "3"])
+    nt.assert_equal(pigeons[0]["sire"], sire.band)
+
+    # The ancestors of the selected pigeon are exported as well
+    filepath = os.path.join(tempdir, "pigeons.db")
+    ExportSQLite.run(filepath, [child.id])
+    connection = sqlite3.connect(filepath)
+    numbers = {number for (number,) in connection.execute("SELECT band_number FROM pigeon")}
+    nt.assert_equal(numbers, {"1", "2", "3", "4"})
+    nt.assert_equal(connection.execute("SELECT COUNT(*) FROM result").fetchone(), (2,))
+    nt.assert_equal(connection.execute("SELECT colour FROM colour").fetchall(), [("Blue",)])
+    nt.assert_equal(connection.execute("PRAGMA user_version").fetchone(), (database.pragma("user_version"),))
+    nt.assert_equal(connection.execute("PRAGMA foreign_key_check").fetchall(), [])
+    connection.close()
+    shutil.rmtree(tempdir)
+
+test_export_jsonlines_sqlite.setup = utils.open_test_db
+test_export_jsonlines_sqlite.teardown = utils.close_test_db
+
+
+def test_snapshot_database():
+    tempdir = tempfile.mkdtemp()
+    source = os.path.join(tempdir, "source.db")
+    connection = sqlite3.connect(source)
+    connection.execute("CREATE TABLE pigeon (band TEXT)")
+    connection.executemany("INSERT INTO pigeon VALUES (?)", [("%s" % number,) for number in range(5000)])
+    connection.commit()
+    # Changes that aren't committed yet are not part of the snapshot
+    connection.execute("INSERT INTO pigeon VALUES ('uncommitted')")
+
+    fractions = []
+    destination = os.path.join(tempdir, "snapshot.db")
+    backup.snapshot_database(source, destination, fractions.append)
+    connection.rollback()
+    connection.close()
+
+    snapshot = sqlite3.connect(destination)
+    nt.assert_equal(snapshot.execute("SELECT COUNT(*) FROM pigeon").fetchone(), (5000,))
+    nt.assert_equal(snapshot.execute("PRAGMA integrity_check").fetchone(), ("ok",))
+    snapshot.close()
+    nt.assert_equal(fractions[-1], 1.0)
+    nt.assert_equal(fractions, sorted(fractions))
+    shutil.rmtree(tempdir)
+
+
+def test_backup_store():
+    tempdir = tempfile.mkdtemp()
+    source = os.path.join(tempdir, "source.db")
+    connection = sqlite3.connect(source)
+    connection.execute("CREATE TABLE pigeon (band TEXT)")
+    connection.executemany("INSERT INTO pigeon VALUES (?)", [("%08d" % number,) for number in range(50000)])
+    connection.commit()
+
+    store = backup.BackupStore(os.path.join(tempdir, "store"))
+    entry1 = store.add_file(source)
+    nt.assert_equal(entry1["size"], os.path.getsize(source))
+    # Storing the same file again doesn't add chunks
+    nt.assert_equal(store.add_file(source), entry1)
+
+    connection.execute("UPDATE pigeon SET band = 'changed' WHERE rowid = 1")
+    connection.commit()
+    connection.close()
+    entry2 = store.add_file(source)
+    changed = set(entry2["chunks"]) - set(entry1["chunks"])
+    nt.assert_true(0 < len(changed) < len(entry2["chunks"]))
+    # Each chunk is stored once
+    num_chunks = sum(len(filenames) for _dirpath, _dirnames, filenames in os.walk(store.chunkdir))
+    nt.assert_equal(num_chunks, len(set(entry1["chunks"]) | set(entry2["chunks"])))
+
+    infopath = os.path.join(tempdir, os.path.basename(const.DATABASEINFO))
+    with open(infopath, "wb") as infofile:
+        infofile.write(b"[]")
+    manifest_path = store.write_manifest([store.add_file(infopath), entry1])
+    operation = backup.RestoreOperation(manifest_path)
+    nt.assert_true(operation.is_valid_archive())
+    nt.assert_equal(operation.database_info, b"[]")
+    nt.assert_in("source.db", operation.namelist)
+    nt.assert_equal(store.get_latest_manifest()["files"][1], entry1)
+
+    restored = os.path.join(tempdir, "restored.db")
+    store.restore_file(entry1, restored)
+    connection = sqlite3.connect(restored)
+    nt.assert_equal(connection.execute("SELECT band FROM pigeon WHERE rowid = 1").fetchone(), ("00000000",))
+    connection.close()
+
+    # A damaged chunk is detected
+    with open(store.get_chunk_path(entry1["chunks"][0]), "wb") as chunkfile:
+        chunkfile.write(b"damaged")
+    nt.assert_raises(backup.RestoreError, store.restore_file, entry1, restored)
+    shutil.rmtree(tempdir)
+
+
+def test_incremental_backup_open_database():
+    tempdir = tempfile.mkdtemp()
+    dbpath = os.path.join(tempdir, "pigeonplanner.db")
+    connection = sqlite3.connect(dbpath)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("CREATE TABLE pigeon (band TEXT)")
+    connection.commit()
+
+    # The write-ahead log of the open database is moved into the database file
+    nt.assert_greater(os.path.getsize(dbpath + "-wal"), 0)
+    source_stat = backup._get_source_stat(dbpath)
+    nt.assert_is_not_none(source_stat)
+    nt.assert_equal(backup._get_source_stat(dbpath), source_stat)
+
+    connection.execute("INSERT INTO pigeon VALUES ('1')")
+    connection.commit()
+    nt.assert_not_equal(backup._get_source_stat(dbpath), source_stat)
+    connection.close()
+    shutil.rmtree(tempdir)
+
+
+def test_verify_database():
+    tempdir = tempfile.mkdtemp()
+    path = os.path.join(tempdir, "pigeonplanner.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE pigeon (band TEXT)")
+    connection.execute("PRAGMA user_version = %s" % database.pragma("user_version"))
+    connection.commit()
+    backup.verify_database(path)
+
+    # Made by a newer version
+    connection.execute("PRAGMA user_version = %s" % (database.pragma("user_version") + 1))
+    connection.commit()
+    connection.close()
+    nt.assert_raises(backup.RestoreError, backup.verify_database, path)
+
+    with open(path, "wb") as dbfile:
+        dbfile.write(b"damaged" * 1000)
+    nt.assert_raises(backup.RestoreError, backup.verify_database, path)
+    shutil.rmtree(tempdir)
+
+test_verify_database.setup = utils.open_test_db
+test_verify_database.teardown = utils.close_test_db
+
+
+def test_get_filtered_pigeon_ids():
+    data = {"band_number": "1", "band_year": "2014", "band_country": "", "band_letters": "", "sex": enums.Sex.cock}
+    pigeon1 = corepigeon.add_pigeon(data, enums.Status.active, {})
+    data = {"band_number": "2", "band_year": "2016", "band_country": "", "band_letters": "", "sex": enums.Sex.hen,
+            "sire": ("", "", "1", "2014")}
+    pigeon2 = corepigeon.add_pigeon(data, enums.Status.breeder, {})
+
+    pigeon_filter = TreeviewFilter()
+    pigeon_filter.add("band_year", 2015, operator.gt, int)
+    nt.assert_equal(corepigeon.get_filtered_pigeon_ids(pigeon_filter), {pigeon2.id})
+
+    pigeon_filter.clear()
+    pigeon_filter.add("status_id", enums.Status.active, type_=int, allow_empty_value=True)
+    nt.assert_equal(corepigeon.get_filtered_pigeon_ids(pigeon_filter), {pigeon1.id})
+
+    pigeon_filter.clear()
+    pigeon_filter.add("sire_filter", ("", "", "1", "2014"), type_=tuple, allow_empty_value=True)
+    pigeon_filter.add("sex", enums.Sex.hen, type_=int, allow_empty_value=True)
+    nt.assert_equal(corepigeon.get_filtered_pigeon_ids(pigeon_filter), {pigeon2.id})
+    nt.assert_equal(corepigeon.get_filtered_pigeon_ids(pigeon_filter, [pigeon1.id]), set())
+
+    # More ids than fit in one query
+    utils.limit_query_variables()
+    pigeon_ids = corepigeon.add_pigeons([str(number) for number in range(10, 1010)], "2016", enums.Sex.hen)
+    nt.assert_equal(corepigeon.get_filtered_pigeon_ids(pigeon_filter, pigeon_ids + [pigeon2.id]), {pigeon2.id})
+    pigeon_filter.clear()
+    pigeon_filter.add("band_year", 2015, operator.gt, int)
+    nt.assert_equal(len(corepigeon.get_filtered_pigeon_ids(pigeon_filter, pigeon_ids + [pigeon1.id])), 1000)
+
+test_get_filtered_pigeon_ids.setup = utils.open_test_db
+test_get_filtered_pigeon_ids.teardown = utils.close_test_db
+
+
+def test_build_pedigree_tree():
+    grandsire = utils.add_pigeon("1")
+    sire = utils.add_pigeon("2", sire=grandsire.band_tuple)
+    dam = utils.add_pigeon("3")
+    pigeon = utils.add_pigeon("4", sire=sire.band_tuple, dam=dam.band_tuple)
+
+    ancestors = corepigeon.get_ancestors(pigeon, 4)
+    nt.assert_equal(set(ancestors), {grandsire.id, sire.id, dam.id})
+    nt.assert_equal(set(corepigeon.get_ancestors(pigeon, 1)), {sire.id, dam.id})
+
+    lst = [None] * 15
+    corepigeon.build_pedigree_tree(pigeon, 0, 1, lst)
+    nt.assert_is(lst[0], pigeon)
+    nt.assert_equal([p.id if p else None for p in lst[1:4]], [sire.id, dam.id, grandsire.id])
+    nt.assert_true(all(p is None for p in lst[4:]))
+
+test_build_pedigree_tree.setup = utils.open_test_db
+test_build_pedigree_tree.teardown = utils.close_test_db
+
+
+def test_ancestry():
+    def table():
+        query = PigeonAncestry.select(PigeonAncestry.ancestor_id, PigeonAncestry.descendant_id,
+                                      PigeonAncestry.depth, PigeonAncestry.path_count)
+        return sorted(query.tuples())
+
+    founder = utils.add_pigeon("1")
+    sire = utils.add_pigeon("2", sire=founder.band_tuple)
+    dam = utils.add_pigeon("3", sire=founder.band_tuple)
+    pigeon = utils.add_pigeon("4", sire=sire.band_tuple, dam=dam.band_tuple)
+
+    nt.assert_equal(ancestry.count_descendants(founder), 3)
+    nt.assert_equal(ancestry.get_descendant_ids(founder, max_depth=1), {sire.id, dam.id})
+    nt.assert_equal(ancestry.get_common_ancestors(sire, dam), {founder.id: (1, 1)})
+    nt.assert_in((founder.id, pigeon.id, 2, 2), table())
+
+    # The incrementally maintained table equals a full rebuild
+    incremental = table()
+    ancestry.rebuild()
+    nt.assert_equal(incremental, table())
+
+    # Changing the parents updates all descendants
+    corepigeon.update_pigeon(dam, utils.pigeon_data("3", enums.Sex.hen), enums.Status.active, {})
+    nt.assert_in((founder.id, pigeon.id, 2, 1), table())
+    incremental = table()
+    ancestry.rebuild()
+    nt.assert_equal(incremental, table())
+
+    # New parents reach the grandchildren in one go, saving without changes leaves the table alone
+    grandchild = utils.add_pigeon("5", sire=pigeon.band_tuple, dam=dam.band_tuple)
+    data = utils.pigeon_data("3", enums.Sex.hen, sire=founder.band_tuple)
+    corepigeon.update_pigeon(dam, data, enums.Status.active, {})
+    nt.assert_in((founder.id, grandchild.id, 2, 1), table())
+    nt.assert_in((founder.id, grandchild.id, 3, 2), table())
+    incremental = table()
+    # update_pigeon() changes the data it's given
+    data = utils.pigeon_data("3", enums.Sex.hen, sire=founder.band_tuple)
+    corepigeon.update_pigeon(dam, data, enums.Status.active, {})
+    nt.assert_equal(incremental, table())
+    ancestry.rebuild()
+    nt.assert_equal(incremental, table())
+
+    corepigeon.remove_pigeon(sire)
+    nt.assert_equal(ancestry.count_descendants(founder), 3)
+    incremental = table()
+    ancestry.rebuild()
+    nt.assert_equal(incremental, table())
+
+test_ancestry.setup = utils.open_test_db
+test_ancestry.teardown = utils.close_test_db
+
+
+def test_kinship():
+    sire = utils.add_pigeon("1")
+    dam = utils.add_pigeon("2")
+    brother = utils.add_pigeon("3", sire=sire.band_tuple, dam=dam.band_tuple)
+    sister = utils.add_pigeon("4", sire=sire.band_tuple, dam=dam.band_tuple)
+    other = utils.add_pigeon("5")
+    halfsister = utils.add_pigeon("6", sire=sire.band_tuple, dam=other.band_tuple)
+    inbred = utils.add_pigeon("7", sire=brother.band_tuple, dam=sister.band_tuple)
+
+    calculator = kinship.KinshipCalculator()
+    nt.assert_equal(calculator.inbreeding(sire.id), 0.0)
+    nt.assert_almost_equal(calculator.inbreeding(inbred.id), 0.25)
+    nt.assert_almost_equal(calculator.offspring_inbreeding(brother.id, halfsister.id), 0.125)
+    nt.assert_almost_equal(calculator.kinship(inbred.id, inbred.id), 0.625)
+
+    ids = [inbred.id, brother.id, halfsister.id, other.id]
+    ids, matrix = calculator.kinship_matrix(ids)
+    for i, id1 in enumerate(ids):
+        for j, id2 in enumerate(ids):
+            nt.assert_almost_equal(matrix[i][j], calculator.kinship(id1, id2))
+
+test_kinship.setup = utils.open_test_db
+test_kinship.teardown = utils.close_test_db
+
+
+def _count_queries(func):
+    queries = []
+    execute_sql = database.execute_sql
+
+    def counting_execute_sql(sql, *args, **kwargs):
+        queries.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    database.execute_sql = counting_execute_sql
+    try:
+        return func(), len(queries)
+    finally:
+        del database.execute_sql
+
+
+def test_get_races():
+    pigeon1 = Pigeon.create(band_number="1", band_year="2020", sex=enums.Sex.cock)
+    pigeon2 = Pigeon.create(band_number="2", band_year="2020", sex=enums.Sex.hen)
+    Result.create(pigeon=pigeon1, date="2020-05-02", racepoint="Noyon", place=3, out=100, speed=1200.5)
+    Result.create(pigeon=pigeon2, date="2020-05-02", racepoint="Noyon", place=0, out=100)
+    Result.create(pigeon=pigeon1, date="2020-05-01", racepoint="Arras", place=10, out=50, wind="N")
+
+    races, num_queries = _count_queries(coreresults.get_races)
+    nt.assert_equal(num_queries, 1)
+    nt.assert_equal([race["racepoint"] for race, _results in races], ["Arras", "Noyon"])
+    race, results = races[0]
+    nt.assert_equal(race["wind"], "N")
+    nt.assert_equal(results[0]["pigeon"], pigeon1.id)
+    nt.assert_equal(results[0]["band"], pigeon1.band)
+    nt.assert_equal(results[0]["band_tuple"], pigeon1.band_tuple)
+    nt.assert_equal(results[0]["year"], "2020")
+    nt.assert_equal(results[0]["coef"], 20.0)
+    nt.assert_equal(len(races[1][1]), 2)
+    nt.assert_equal(races[1][1][1]["placestr"], "-")
+
+    # Races without results that match the filter are left out
+    filters = TreeviewFilter()
+    filters.add("place", 0, operator.gt, int, True)
+    filters.add("coef", 10.0, operator.gt, float)
+    races = coreresults.get_races(coreresults.build_where(filters))
+    nt.assert_equal(len(races), 1)
+    nt.assert_equal(races[0][0]["racepoint"], "Arras")
+
+    # The number of queries doesn't depend on the number of races
+    for day in range(3, 28):
+        Result.create(pigeon=pigeon2, date="2020-05-%02d" % day, racepoint="Noyon", place=day, out=100)
+    races, num_queries = _count_queries(coreresults.get_races)
+    nt.assert_equal(len(races), 27)
+    nt.assert_equal(num_queries, 1)
+
+test_get_races.setup = utils.open_test_db
+test_get_races.teardown = utils.close_test_db
+
+
+def test_get_results_page():
+    pigeon1 = Pigeon.create(band_number="1", band_year="2019", sex=enums.Sex.cock)
+    pigeon2 = Pigeon.create(band_number="2", band_year="2020", sex=enums.Sex.hen)
+    for day in range(1, 11):
+        Result.create(pigeon=pigeon1, date="2020-05-%02d" % day, racepoint="Noyon", place=day, out=100)
+        Result.create(pigeon=pigeon2, date="2020-06-%02d" % day, racepoint="Arras", place=0, out=50)
+
+    order_by = coreresults.get_order_by("date", descending=True)
+    page = coreresults.get_results_page(None, order_by, 0, 5)
+    nt.assert_equal([str(result["date"]) for result in page][:2], ["2020-06-10", "2020-06-09"])
+    page = coreresults.get_results_page(None, order_by, 15, 10)
+    nt.assert_equal(len(page), 5)
+    nt.assert_equal(str(page[-1]["date"]), "2020-05-01")
+
+    filters = TreeviewFilter()
+    filters.add("point", "Noyon")
+    filters.add("coef", 5.0, operator.le, float)
+    where = coreresults.build_where(filters)
+    nt.assert_equal(coreresults.count_results(where), 5)
+    page = coreresults.get_results_page(where, coreresults.get_order_by("coef", descending=True), 0)
+    nt.assert_equal([result["place"] for result in page], [5, 4, 3, 2, 1])
+
+    filters = TreeviewFilter()
+    filters.add("band_tuple", pigeon2.band_tuple, type_=tuple)
+    filters.add("year", 2020, operator.ge, int)
+    filters.add("place", 0, operator.gt, int, True)
+    nt.assert_equal(coreresults.count_results(coreresults.build_where(filters)), 0)
+    nt.assert_is_none(coreresults.build_where(TreeviewFilter()))
+
+test_get_results_page.setup = utils.open_test_db
+test_get_results_page.teardown = utils.close_test_db
+
+
+def test_racestats():
+    pigeon1 = Pigeon.create(band_number="1", band_year="2019", sex=enums.Sex.cock)
+    pigeon2 = Pigeon.create(band_number="2", band_year="2019", sex=enums.Sex.hen)
+    Racepoint.create(racepoint="Noyon", distance="150", unit=1)
+    Result.create(pigeon=pigeon1, date="2020-05-01", racepoint="Noyon", place=1, out=100, speed=1200.0)
+    result = Result.create(pigeon=pigeon1, date="2020-05-08", racepoint="Arras", place=50, out=100, speed=1000.0)
+    Result.create(pigeon=pigeon1, date="2020-05-15", racepoint="Arras", place=0, out=100)
+    Result.create(pigeon=pigeon2, date="2021-05-01", racepoint="Noyon", place=10, out=20)
+    # An unknown number of pigeons still counts as a race
+    Result.create(pigeon=pigeon1, date="2020-05-22", racepoint="Arras", place=0, out=0)
+
+    (stats,) = racestats.get_season_stats(pigeon1)
+    nt.assert_equal((stats.season, stats.races, stats.prizes), (2020, 4, 2))
+    nt.assert_almost_equal(stats.best_place_ratio, 0.01)
+    nt.assert_almost_equal(racestats.get_average_coefficient(stats), 25.5)
+    nt.assert_almost_equal(racestats.get_average_speed(stats), 1100.0)
+    nt.assert_almost_equal(stats.distance, 150.0)
+    nt.assert_almost_equal(stats.ace_points, 100.0 + 51.0)
+
+    # Saving, updating and removing results keeps the statistics up to date
+    Result.create(pigeon=pigeon2, date="2020-06-01", racepoint="Noyon", place=5, out=100)
+    result = result.update_and_return(date="2021-05-08")
+    seasons = [(stats.season, stats.prizes) for stats in racestats.get_season_stats(pigeon1)]
+    nt.assert_equal(seasons, [(2021, 1), (2020, 1)])
+    result.delete_instance()
+    nt.assert_equal([stats.season for stats in racestats.get_season_stats(pigeon1)], [2020])
+    ranking = racestats.get_season_ranking(2020)
+    nt.assert_equal([stats.pigeon for stats in ranking], [pigeon1, pigeon2])
+
+    # The incremental updates give the same statistics as a rebuild
+    before = list(PigeonSeasonStats.select().order_by(PigeonSeasonStats.pigeon, PigeonSeasonStats.season).tuples())
+    racestats.rebuild()
+    after = list(PigeonSeasonStats.select().order_by(PigeonSeasonStats.pigeon, PigeonSeasonStats.season).tuples())
+    nt.assert_equal([row[1:] for row in before], [row[1:] for row in after])
+
+test_racestats.setup = utils.open_test_db
+test_racestats.teardown = utils.close_test_db
+
+
+def test_championship():
+    pigeon1 = Pigeon.create(band_number="1", band_year="2019", sex=enums.Sex.cock)
+    pigeon2 = Pigeon.create(band_number="2", band_year="2019", sex=enums.Sex.cock)
+    pigeon3 = Pigeon.create(band_number="3", band_year="2019", sex=enums.Sex.cock)
+    Racepoint.create(racepoint="Noyon", distance="150", unit=1)
+    Racepoint.create(racepoint="Orleans", distance="450", unit=1)
+    Result.create(pigeon=pigeon1, date="2020-05-01", racepoint="Noyon", place=1, out=100, category="Old")
+    Result.create(pigeon=pigeon1, date="2020-06-01", racepoint="Orleans", place=10, out=100, category="Old")
+    Result.create(pigeon=pigeon2, date="2020-05-01", racepoint="Noyon", place=2, out=100, category="Old")
+    Result.create(pigeon=pigeon2, date="2020-06-01", racepoint="Orleans", place=0, out=100, category="Old")
+    Result.create(pigeon=pigeon3, date="2020-05-01", racepoint="Noyon", place=2, out=100, category="Young")
+    Result.create(pigeon=pigeon3, date="2021-05-01", racepoint="Noyon", place=5, out=100, category="Young")
+
+    # More prizes ranks first, then the lowest sum of coefficients
+    rankings = championship.get_rankings(championship.CoefficientFormula(best_races=2))
+    nt.assert_equal(sorted(rankings), [(2020,), (2021,)])
+    ranking = [(entry["rank"], entry["pigeon"], entry["races"], entry["prizes"]) for entry in rankings[(2020,)]]
+    nt.assert_equal(ranking, [(1, pigeon1.id, 2, 2), (2, pigeon2.id, 2, 1), (2, pigeon3.id, 1, 1)])
+    nt.assert_almost_equal(rankings[(2020,)][0]["value"], 11.0)
+
+    # Points depend on the distance, equal points share a rank
+    formula = championship.PrizePointsFormula(((0, 10), (300, 20)))
+    rankings = championship.get_rankings(formula, ("season", "category"), seasons=[2020])
+    nt.assert_equal(sorted(rankings), [(2020, "Old"), (2020, "Young")])
+    ranking = [(entry["rank"], entry["pigeon"], entry["value"]) for entry in rankings[(2020, "Old")]]
+    nt.assert_equal(ranking, [(1, pigeon1.id, 30), (2, pigeon2.id, 10)])
+
+    nt.assert_raises(ValueError, championship.get_rankings, formula, ("loft",))
+
+test_championship.setup = utils.open_test_db
+test_championship.teardown = utils.close_test_db
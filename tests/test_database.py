@@ -17,15 +17,32 @@
 
 
 import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from importlib import import_module
 
 import nose.tools as nt
+import peewee
 from peewee import SqliteDatabase
 
 from . import utils
+from pigeonplanner.database import models
 from pigeonplanner.database import session
 from pigeonplanner.database import migrations
+from pigeonplanner.database.main import ReadOnlyPool
 from pigeonplanner.database.manager import DBManager, DatabaseInfo, DatabaseInfoError
 from pigeonplanner.core import const
+from pigeonplanner.core import enums
+from pigeonplanner.core import config
+from pigeonplanner.core import ancestry
+from pigeonplanner.core import championship
+from pigeonplanner.core import pigeon as corepigeon
+
+migration_indexes = import_module("pigeonplanner.database.migrations.002_foreign_key_indexes")
+migration_racestats = import_module("pigeonplanner.database.migrations.003_race_statistics")
+migration_ancestry = import_module("pigeonplanner.database.migrations.004_pigeon_ancestry")
 
 
 def test_connection():
@@ -50,6 +67,143 @@ def test_database_version():
 test_database_version.setup = utils.open_test_db
 test_database_version.teardown = utils.close_test_db
 
+def test_pragma_profile():
+    tempdir = tempfile.mkdtemp()
+    dbfile = os.path.join(tempdir, "pigeonplanner.db")
+    session.open(dbfile)
+    nt.assert_equal(models.database.pragma("journal_mode"), "wal")
+    nt.assert_equal(models.database.pragma("synchronous"), 1)
+    nt.assert_equal(models.database.pragma("foreign_keys"), 1)
+    nt.assert_equal(models.database.pragma("temp_store"), 2)
+    session.close()
+
+    # Without the write-ahead log the database goes back to the rollback journal
+    config.set("options.database-wal", False)
+    try:
+        session.open(dbfile)
+        nt.assert_equal(models.database.pragma("journal_mode"), "delete")
+        nt.assert_equal(models.database.pragma("synchronous"), 2)
+        session.close()
+    finally:
+        config.reset("options.database-wal")
+        shutil.rmtree(tempdir)
+
+
+def get_full_scans(query):
+    """Get the steps of the query plan that read a whole table or index"""
+    sql, params = query.sql()
+    plan = models.database.execute_sql("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[-1] for row in plan if row[-1].startswith("SCAN ")]
+
+
+def test_foreign_key_indexes():
+    for table in models.database.get_tables():
+        # The first column of each index
+        indexed = set()
+        for index in models.database.execute_sql('PRAGMA index_list("%s")' % table).fetchall():
+            columns = models.database.execute_sql('PRAGMA index_info("%s")' % index[1]).fetchall()
+            indexed.add(columns[0][2])
+        for foreign_key in models.database.execute_sql('PRAGMA foreign_key_list("%s")' % table):
+            nt.assert_in(foreign_key[3], indexed, "%s.%s has no index" % (table, foreign_key[3]))
+test_foreign_key_indexes.setup = utils.open_test_db
+test_foreign_key_indexes.teardown = utils.close_test_db
+
+def test_query_plans():
+    pigeon = models.Pigeon(id=1)
+    queries = [
+        pigeon.children_sire,
+        pigeon.children_dam,
+        pigeon.results,
+        pigeon.images,
+        pigeon.media,
+        pigeon.status_partner,
+        models.Pigeon.select().where(
+            (models.Pigeon.band_country == "")
+            & (models.Pigeon.band_letters == "")
+            & (models.Pigeon.band_number == "1")
+            & (models.Pigeon.band_year == "2020")
+        ),
+        models.Pigeon.select().where(
+            (models.Pigeon.band_country == "")
+            & (models.Pigeon.band_letters == "")
+            & (models.Pigeon.band_number.in_(["1", "2"]))
+        ),
+        models.Result.select().where((models.Result.date == "2020-05-01") & (models.Result.racepoint == "Noyon")),
+        models.Result.select().where(models.Result.racepoint == "Noyon"),
+        models.Breeding.select().where(models.Breeding.sire == pigeon),
+        models.Breeding.select().where(models.Breeding.dam == pigeon),
+        models.Breeding.select().where((models.Breeding.child1 == pigeon) | (models.Breeding.child2 == pigeon)),
+        models.PigeonMedication.select().where(models.PigeonMedication.pigeon == pigeon),
+    ]
+    for query in queries:
+        nt.assert_equal(get_full_scans(query), [], query.sql()[0])
+test_query_plans.setup = utils.open_test_db
+test_query_plans.teardown = utils.close_test_db
+
+def test_migration_foreign_key_indexes():
+    index_names = [index for _table, _column, index in migration_indexes.INDEXES]
+    for index in index_names:
+        models.database.execute_sql('DROP INDEX "%s"' % index)
+    nt.assert_not_equal(get_full_scans(models.Pigeon(id=1).children_sire), [])
+
+    migration_indexes.do_migration(models.database)
+    nt.assert_equal(get_full_scans(models.Pigeon(id=1).children_sire), [])
+    created = {row[0] for row in models.database.execute_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    nt.assert_true(created.issuperset(index_names))
+    # Running it again doesn't fail on the existing indexes
+    migration_indexes.do_migration(models.database)
+test_migration_foreign_key_indexes.setup = utils.open_test_db
+test_migration_foreign_key_indexes.teardown = utils.close_test_db
+
+def test_migration_race_statistics():
+    pigeon = models.Pigeon.create(band_number="1", band_year="2020", sex=enums.Sex.cock)
+    models.Result.create(pigeon=pigeon, date="2020-05-01", racepoint="Noyon", place=1, out=100)
+    models.database.drop_tables([models.PigeonSeasonStats])
+
+    migration_racestats.do_migration(models.database)
+    stats = models.PigeonSeasonStats.get()
+    nt.assert_equal((stats.pigeon_id, stats.season, stats.races), (pigeon.id, 2020, 1))
+test_migration_race_statistics.setup = utils.open_test_db
+test_migration_race_statistics.teardown = utils.close_test_db
+
+def test_migration_pigeon_ancestry():
+    sire = models.Pigeon.create(band_number="1", band_year="2020", sex=enums.Sex.cock)
+    models.Pigeon.create(band_number="2", band_year="2021", sex=enums.Sex.cock, sire=sire)
+    models.database.drop_tables([models.PigeonAncestry])
+
+    migration_ancestry.do_migration(models.database)
+    nt.assert_equal(ancestry.count_descendants(sire), 1)
+test_migration_pigeon_ancestry.setup = utils.open_test_db
+test_migration_pigeon_ancestry.teardown = utils.close_test_db
+
+
+def test_read_pool():
+    tempdir = tempfile.mkdtemp()
+    session.open(os.path.join(tempdir, "pigeonplanner.db"))
+    try:
+        models.Colour.create(colour="Blue")
+        pool = session.get_read_pool()
+        query = models.Colour.select(models.Colour.colour).tuples()
+        nt.assert_equal(pool.select(query).result(), [("Blue",)])
+
+        # Changes of the main connection are seen by the workers
+        models.Colour.create(colour="Red")
+        rows = pool.submit(lambda database: database.execute(query).fetchall()).result()
+        nt.assert_equal(rows, [("Blue",), ("Red",)])
+        insert = models.Colour.insert(colour="Black")
+        nt.assert_raises(peewee.OperationalError, pool.submit(lambda database: database.execute(insert)).result)
+
+        data = {"band_number": "1", "band_year": "2020", "band_country": "", "band_letters": "", "sex": enums.Sex.cock}
+        pigeon = corepigeon.add_pigeon(data, enums.Status.active, {})
+        models.Result.create(pigeon=pigeon, date="2020-05-01", racepoint="Noyon", place=1, out=100)
+        formula = championship.CoefficientFormula()
+        rankings = pool.submit(lambda database: championship.get_rankings(formula, db=database)).result()
+        nt.assert_equal(rankings, championship.get_rankings(formula))
+    finally:
+        session.close()
+        shutil.rmtree(tempdir)
+    nt.assert_raises(ValueError, ReadOnlyPool, ":memory:")
+
 
 class TestDatabaseManager:
     def setUp(self):
@@ -146,3 +300,36 @@ class TestDatabaseManager:
         nt.assert_false(os.path.exists(dbobj.path))
         nt.assert_not_in(dbobj, self.dbmanager.get_databases())
 
+
+    def test_copy_move_wal(self):
+        # A database left behind by a crash, with a commit that's only in the write-ahead log
+        tempdir = tempfile.mkdtemp()
+        crashed = os.path.join(tempdir, "crashed.db")
+        connection = sqlite3.connect(crashed)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA wal_autocheckpoint = 0")
+        connection.execute("CREATE TABLE pigeon (band TEXT)")
+        connection.execute("INSERT INTO pigeon VALUES ('1')")
+        connection.commit()
+        path = os.path.join(tempdir, "pigeonplanner.db")
+        shutil.copy(crashed, path)
+        shutil.copy(crashed + "-wal", path + "-wal")
+        connection.close()
+
+        def get_bands(dbpath):
+            with closing(sqlite3.connect(dbpath)) as dbconnection:
+                return dbconnection.execute("SELECT band FROM pigeon").fetchall()
+
+        dbobj = self.dbmanager.add("TestDB", "", path)
+        copied = self.dbmanager.copy(dbobj)
+        nt.assert_equal(get_bands(copied.path), [("1",)])
+
+        newdir = os.path.join(tempdir, "moved")
+        os.mkdir(newdir)
+        moved = self.dbmanager.move(dbobj, newdir)
+        nt.assert_equal(get_bands(moved.path), [("1",)])
+        nt.assert_equal(os.listdir(newdir), [os.path.basename(path)])
+
+        self.dbmanager.delete(moved)
+        nt.assert_equal(os.listdir(newdir), [])
+        shutil.rmtree(tempdir)
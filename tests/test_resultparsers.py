@@ -16,10 +16,16 @@
 # along with Pigeon Planner.  If not, see <http://www.gnu.org/licenses/>
 
 
+import os
+import shutil
+import sqlite3
+import tempfile
+
 import nose.tools as nt
 from yapsy.PluginManager import PluginManager
 
 from . import utils
+from pigeonplanner import resultimport
 from pigeonplanner.core import const
 from pigeonplanner.core import enums
 from pigeonplanner.database.models import Pigeon
@@ -130,7 +136,84 @@ def test_kbdb_parse_results():
     nt.assert_list_equal(parser.results[pigeon1], ["1234567", "2013", "2", "1661.3061"])
 
 
+def test_dtd_stream():
+    pigeon = Pigeon.create(band_number="1234567", band_year="2013", sex=enums.Sex.cock)
+    parser = manager.getPluginByName("Data Technology-Deerlijk").plugin_object
+
+    with open("tests/data/result_kbdb_1.html") as resultfile:
+        nt.assert_false(parser.check(resultfile))
+    with open("tests/data/result_dtd_1.txt") as resultfile:
+        nt.assert_true(parser.check(resultfile))
+        resultfile.seek(0)
+        data, records = parser.stream_file(resultfile)
+        nt.assert_equal(data["racepoint"], "FONTENAY SUR EURE")
+        records = list(records)
+    nt.assert_equal(len(records), 4)
+    nt.assert_equal(records[0], (pigeon, "1234567", "2013", 1, "1397,00"))
+    # Bands that aren't in the database are still reported
+    nt.assert_equal(records[1], (None, "9999999", "2013", 2, "1372,55"))
+
+
 test_dtd.setup = utils.open_test_db
 test_dtd.teardown = utils.close_test_db
+test_dtd_stream.setup = utils.open_test_db
+test_dtd_stream.teardown = utils.close_test_db
 test_kbdb_parse_results.setup = utils.open_test_db
 test_kbdb_parse_results.teardown = utils.close_test_db
+
+
+def test_resultimport():
+    pigeon = Pigeon.create(band_number="1234567", band_year="2013", sex=enums.Sex.cock)
+
+    path, parser_name, rows, unmatched = resultimport.parse_result_file("tests/data/result_dtd_1.txt")
+    nt.assert_equal(parser_name, "Data Technology-Deerlijk")
+    nt.assert_equal(len(rows), 1)
+    nt.assert_equal(unmatched, 3)
+    nt.assert_equal(rows[0]["pigeon"], pigeon.id)
+    nt.assert_equal(rows[0]["place"], 1)
+    nt.assert_equal(rows[0]["speed"], 1397.0)
+
+    # Existing results are skipped
+    nt.assert_equal(resultimport.insert_results(rows), 1)
+    nt.assert_equal(resultimport.insert_results(rows), 0)
+
+    path, parser_name, rows, unmatched = resultimport.parse_result_file("tests/data/result_kbdb_1.html")
+    nt.assert_equal(parser_name, "KBDB online")
+    nt.assert_is_none(unmatched)
+
+test_resultimport.setup = utils.open_test_db
+test_resultimport.teardown = utils.close_test_db
+
+
+def test_resultimport_newer_database():
+    tempdir = tempfile.mkdtemp()
+    dbfile = os.path.join(tempdir, "pigeonplanner.db")
+    connection = sqlite3.connect(dbfile)
+    connection.execute("PRAGMA user_version = 999")
+    connection.close()
+    try:
+        nt.assert_equal(resultimport.run([dbfile, "tests/data/result_dtd_1.txt"]), 1)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_find_parsers_cache():
+    # Work on a copy, the plugin files of the source tree are left alone
+    tempdir = tempfile.mkdtemp()
+    plugindir = os.path.join(tempdir, "resultparsers")
+    shutil.copytree(const.RESULTPARSERDIR, plugindir, ignore=shutil.ignore_patterns("__pycache__"))
+    get_plugin_places = resultimport._get_plugin_places
+    resultimport._get_plugin_places = lambda: [plugindir]
+    try:
+        plugins = resultimport.find_parsers()
+        nt.assert_equal([plugin.name for plugin in plugins], ["Data Technology-Deerlijk", "KBDB online"])
+        nt.assert_is(resultimport.find_parsers()[0], plugins[0])
+
+        # Changing a plugin file collects the plugins again
+        path = os.path.join(plugindir, "dtd.yapsy-plugin")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        nt.assert_is_not(resultimport.find_parsers()[0], plugins[0])
+    finally:
+        resultimport._get_plugin_places = get_plugin_places
+        shutil.rmtree(tempdir)
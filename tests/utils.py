@@ -17,8 +17,12 @@
 
 
 import os
+import sqlite3
 
+from pigeonplanner.core import enums
+from pigeonplanner.core import pigeon as corepigeon
 from pigeonplanner.database import session
+from pigeonplanner.database.models import database
 
 
 DBFILE = ":memory:"
@@ -34,3 +38,21 @@ def close_test_db():
     except:
         pass
 
+
+def pigeon_data(number, sex=enums.Sex.unknown, **kwargs):
+    """Get the data of a pigeon without a country and letters, the parents are band tuples"""
+    data = {"band_number": number, "band_year": "2020", "band_country": "", "band_letters": "", "sex": sex}
+    data.update(kwargs)
+    return data
+
+
+def add_pigeon(number, sex=enums.Sex.unknown, **kwargs):
+    """Add an active pigeon, see pigeon_data()"""
+    return corepigeon.add_pigeon(pigeon_data(number, sex, **kwargs), enums.Status.active, {})
+
+
+def limit_query_variables(limit=999):
+    """Lower the number of variables per query to the default of SQLite before version 3.32"""
+    connection = database.connection()
+    if hasattr(connection, "setlimit"):
+        connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, limit)